@@ -0,0 +1,271 @@
+"""
+Offline batch conversion of sticker files, without the bot.
+
+Converts a directory of sticker files (`.tgs`, `.webm`, `.webp`) or a ZIP of them, such as
+the bot's `.tgs` export of a set, into a ZIP laid out like the bot's set archives. The
+conversions go through the same converter, result cache and scheduler as the bot's, longest
+first and `--workers` at a time, each rendered by its own subprocesses.
+
+Stickers with identical content are rendered once. Converted files are kept in the work
+directory, one folder per set of settings, so a run that was interrupted or had failures
+converts only what is missing when started again. Run it from the repository root, like
+`main.py`, for the lottie scripts; the converter settings are read from `config.json` if
+there is one, no bot token is needed.
+
+Usage: python cli.py [--format {gif,png,webp,apng}] [--quality QUALITY] [--size WxH] [--fps FPS]
+                     [--workers WORKERS] [--name NAME] [--work-dir WORK_DIR] [--output OUTPUT]
+                     [--verbose] input
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import time
+import zipfile
+from typing import Any, Dict, List
+
+from loguru import logger
+
+from config import load_config
+
+# Before the modules below read their settings: without a config.json they use the defaults.
+load_config(missing_ok=True)
+
+import result_cache  # noqa: E402
+from conversion import CONVERT_WORKERS, convert_cached, get_script_path, source_folder  # noqa: E402
+from decoders import get_decoder  # noqa: E402
+from preset import DEFAULT_PRESET  # noqa: E402
+from scheduler import estimate_units, eta_seconds, format_eta, predict_seconds  # noqa: E402
+
+PROGRESS_WIDTH = 30
+
+
+def _is_sticker(name: str) -> bool:
+    try:
+        get_decoder(name)
+    except ValueError:
+        return False
+    return True
+
+
+def read_stickers(input_path: str, sources_dir: str) -> List[Dict[str, Any]]:
+    """
+    List the sticker files of a directory (searched recursively) or ZIP.
+
+    :param input_path: Directory or ZIP file.
+    :param sources_dir: Where stickers from a ZIP that can't be piped to their decoder are written.
+    :return: Dicts with `file_unique_id` (the file name without extension), `extension`,
+             `path` and `data` (the content for stickers read from a ZIP, else None).
+    """
+    stickers: Dict[str, Dict[str, Any]] = {}
+
+    def add(name: str, path: str, data=None) -> None:
+        stem, extension = os.path.splitext(os.path.basename(name))
+        if stem in stickers:
+            logger.warning(f"Skipping {name}: another sticker is named {stem}")
+            return
+        stickers[stem] = {"file_unique_id": stem, "extension": extension.lstrip("."), "path": path, "data": data}
+
+    if zipfile.is_zipfile(input_path):
+        os.makedirs(sources_dir, exist_ok=True)
+        with zipfile.ZipFile(input_path) as zf:
+            for name in sorted(zf.namelist()):
+                if not name.endswith("/") and _is_sticker(name):
+                    add(name, os.path.join(sources_dir, os.path.basename(name)), zf.read(name))
+    else:
+        for root, dirs, files in os.walk(input_path):
+            dirs.sort()
+            for name in sorted(files):
+                if _is_sticker(name):
+                    add(name, os.path.join(root, name))
+    return list(stickers.values())
+
+
+def default_name(input_path: str) -> str:
+    """
+    Archive name for an input: the set name of a bot export (`<set>_tgs.zip`), else its file name.
+    """
+    name = os.path.splitext(os.path.basename(os.path.normpath(input_path)))[0]
+    return name[:-len("_tgs")] if name.endswith("_tgs") else name
+
+
+class Progress:
+    """
+    One-line progress bar with the predicted time left, on stderr.
+    """
+
+    def __init__(self, total: int, workers: int):
+        self.total = total
+        self.workers = workers
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def update(self, pending: Dict[str, float]) -> None:
+        filled = PROGRESS_WIDTH * self.done // max(1, self.total)
+        eta = format_eta(eta_seconds(pending.values(), self.workers)) if pending else "done"
+        failed = f", {self.failed} failed" if self.failed else ""
+        sys.stderr.write(
+            f"\r[{'#' * filled}{'-' * (PROGRESS_WIDTH - filled)}] {self.done}/{self.total}{failed} · {eta}   "
+        )
+        sys.stderr.flush()
+
+    def finish(self) -> None:
+        sys.stderr.write(f"\nConverted in {time.monotonic() - self.started:.0f}s\n")
+
+
+async def convert_all(stickers: List[Dict[str, Any]], out_dir: str, chosen_format: str, quality: int,
+                      width: int, height: int, fps: int, workers: int) -> int:
+    """
+    Convert the stickers not yet converted in `out_dir`, longest first.
+
+    Stickers with the same content (see `result_cache.content_id`) are converted once and
+    the output is copied. Outputs are moved into `out_dir` only once complete, so an
+    interrupted run leaves nothing half-written there.
+
+    :return: Number of stickers that failed to convert.
+    """
+    partial_dir = os.path.join(out_dir, "partial")
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    os.makedirs(partial_dir)
+    todo = [st for st in stickers
+            if not os.path.exists(os.path.join(out_dir, f"{st['file_unique_id']}.{chosen_format}"))]
+    progress = Progress(len(stickers), workers)
+    progress.done = len(stickers) - len(todo)
+
+    def record(st: Dict[str, Any]) -> None:
+        digest = result_cache.content_hash(st["path"], st["data"])
+        result_cache.record_content(st["file_unique_id"], digest)
+
+    await asyncio.to_thread(lambda: [record(st) for st in todo])
+    # file_unique_id -> stickers with the same content, whose output is copied from it
+    duplicates: Dict[str, List[str]] = {}
+    first_by_content: Dict[str, str] = {}
+    for st in todo:
+        unique_id = st["file_unique_id"]
+        first = first_by_content.setdefault(result_cache.content_id(unique_id), unique_id)
+        if first != unique_id:
+            duplicates.setdefault(first, []).append(unique_id)
+    firsts = set(first_by_content.values())
+    todo = [st for st in todo if st["file_unique_id"] in firsts]
+
+    units = await asyncio.to_thread(
+        lambda: {st["file_unique_id"]: estimate_units(st["path"], width, height, fps, st["data"]) for st in todo}
+    )
+    pending = {
+        st["file_unique_id"]: predict_seconds(st["extension"], chosen_format, units[st["file_unique_id"]])
+        for st in todo
+    }
+    todo.sort(key=lambda st: pending[st["file_unique_id"]], reverse=True)
+    script_path = get_script_path(chosen_format)
+    semaphore = asyncio.Semaphore(workers)
+    progress.update(pending)
+
+    async def convert_one(st: Dict[str, Any]) -> None:
+        unique_id = st["file_unique_id"]
+        copies = duplicates.get(unique_id, [])
+        partial_path = os.path.join(partial_dir, f"{unique_id}.{chosen_format}")
+        async with semaphore:
+            try:
+                await convert_cached(st["path"], partial_path, unique_id, chosen_format, quality, width,
+                                     height, fps, script_path, st["data"], units[unique_id])
+                for copy_id in copies:
+                    copy_path = os.path.join(partial_dir, f"{copy_id}.{chosen_format}")
+                    if os.path.isdir(partial_path):
+                        shutil.copytree(partial_path, copy_path)
+                    else:
+                        shutil.copyfile(partial_path, copy_path)
+                    os.replace(copy_path, os.path.join(out_dir, f"{copy_id}.{chosen_format}"))
+                os.replace(partial_path, os.path.join(out_dir, f"{unique_id}.{chosen_format}"))
+            except Exception as e:
+                logger.error(f"Failed converting {unique_id}: {e}")
+                progress.failed += 1 + len(copies)
+            else:
+                progress.done += 1 + len(copies)
+            pending.pop(unique_id)
+            progress.update(pending)
+
+    await asyncio.gather(*(convert_one(st) for st in todo))
+    progress.finish()
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    return progress.failed
+
+
+def write_archive(stickers: List[Dict[str, Any]], out_dir: str, zip_path: str, name: str,
+                  chosen_format: str) -> int:
+    """
+    ZIP the converted stickers and their sources as `<name>/<format>/...` like the bot does.
+
+    :return: Number of converted stickers in the archive.
+    """
+    count = 0
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for st in stickers:
+            unique_id, extension = st["file_unique_id"], st["extension"]
+            img_path = os.path.join(out_dir, f"{unique_id}.{chosen_format}")
+            arcname = f"{name}/{chosen_format}/{unique_id}.{chosen_format}"
+            if os.path.isdir(img_path):
+                # PNG output: a directory of frames.
+                for frame in sorted(os.listdir(img_path)):
+                    zf.write(os.path.join(img_path, frame), f"{arcname}/{frame}")
+            elif os.path.exists(img_path):
+                zf.write(img_path, arcname)
+            else:
+                continue
+            count += 1
+            source_arcname = f"{name}/{source_folder(extension, chosen_format)}/{unique_id}.{extension}"
+            if st["data"] is not None:
+                zf.writestr(source_arcname, st["data"])
+            else:
+                zf.write(st["path"], source_arcname)
+    return count
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Convert a directory or ZIP of sticker files offline.")
+    parser.add_argument("--format", default=DEFAULT_PRESET.chosen_format, choices=("gif", "png", "webp", "apng"))
+    parser.add_argument("--quality", type=int, default=DEFAULT_PRESET.quality)
+    parser.add_argument("--size", default=f"{DEFAULT_PRESET.width}x{DEFAULT_PRESET.height}",
+                        help="output size as WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=int, default=DEFAULT_PRESET.fps)
+    parser.add_argument("--workers", type=int, default=CONVERT_WORKERS,
+                        help="conversions to run at once")
+    parser.add_argument("--name", help="archive name (default: the input's name)")
+    parser.add_argument("--work-dir", help="where converted files are kept between runs (default: tmp/<name>-cli)")
+    parser.add_argument("--output", help="ZIP to write (default: <name>_<format>.zip)")
+    parser.add_argument("--verbose", action="store_true", help="log every conversion command")
+    parser.add_argument("input", help="directory of sticker files or ZIP")
+    args = parser.parse_args()
+
+    try:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+    except ValueError:
+        parser.error(f"invalid --size {args.size!r}, expected WIDTHxHEIGHT")
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+
+    name = args.name or default_name(args.input)
+    work_dir = args.work_dir or os.path.join("tmp", f"{name}-cli")
+    out_dir = os.path.join(work_dir, f"{args.format}_{args.quality}_{width}x{height}_{args.fps}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    stickers = read_stickers(args.input, os.path.join(work_dir, "sources"))
+    if not stickers:
+        print(f"No sticker files found in {args.input}", file=sys.stderr)
+        return 1
+    failed = asyncio.run(convert_all(stickers, out_dir, args.format, args.quality, width, height, args.fps,
+                                     max(1, args.workers)))
+
+    zip_path = args.output or f"{name}_{args.format}.zip"
+    count = write_archive(stickers, out_dir, zip_path, name, args.format)
+    print(f"Wrote {count}/{len(stickers)} stickers to {zip_path}")
+    if failed:
+        print(f"{failed} stickers failed; run again with the same settings to retry them.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
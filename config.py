@@ -1,22 +1,104 @@
 """
 Configuration loading and proxy setup.
+
+`config.json` is parsed once per process; every `load_config()` call returns the same
+`Config` object. With `"hot_reload": true` the file is re-read when it changes and that
+object is updated in place, so settings looked up per request (such as
+`allow_sticker_sets`) follow the file without a restart. Settings modules copy into
+constants at import still need one.
 """
 import json
 import os
+import time
+from typing import Dict
+
 from loguru import logger
 
+CONFIG_PATH = "config.json"
+# Seconds between checks of the config file's modification time when hot reload is on.
+RELOAD_CHECK_INTERVAL = 2.0
+
+
+class Config(dict):
+    """
+    The parsed configuration file, with typed accessors for the top-level settings.
+    Sections are still read as `config.get("section", {})`.
+    """
+
+    def __init__(self, path: str, data: dict, mtime: float):
+        super().__init__(data)
+        self.path = path
+        self.mtime = mtime
+        self.next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+
+    @property
+    def bot_token(self) -> str:
+        return self.get("bot_token", "")
 
-def load_config(config_path: str = "config.json") -> dict:
+    @property
+    def allow_sticker_sets(self) -> bool:
+        return self.get("allow_sticker_sets", False)
+
+    @property
+    def hot_reload(self) -> bool:
+        return self.get("hot_reload", False)
+
+    def replace(self, data: dict, mtime: float) -> None:
+        # Update before removing stale keys so concurrent readers never see an empty config.
+        self.update(data)
+        for key in [key for key in self if key not in data]:
+            del self[key]
+        self.mtime = mtime
+
+    def reload_if_changed(self) -> None:
+        """
+        Re-read the file if its modification time changed, at most every
+        `RELOAD_CHECK_INTERVAL` seconds. An unreadable or invalid file keeps the current values.
+        """
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + RELOAD_CHECK_INTERVAL
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self.mtime:
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not reload {self.path}, keeping the current configuration: {e}")
+            return
+        self.replace(data, mtime)
+        logger.info(f"Reloaded configuration from {self.path}")
+
+
+_configs: Dict[str, Config] = {}
+
+
+def load_config(config_path: str = CONFIG_PATH, missing_ok: bool = False) -> Config:
     """
     Load bot configuration from a JSON file.
 
+    The file is read on the first call only (or again after it changed, if `hot_reload`
+    is enabled); later calls return the cached `Config`.
+
     :param config_path: Path to the configuration file.
+    :param missing_ok: Use an empty configuration, i.e. every setting's default, if the
+                       file doesn't exist. Later calls return that configuration too.
     :return: Configuration dictionary.
-    :raises FileNotFoundError: If the config file is not found.
+    :raises FileNotFoundError: If the config file is not found and `missing_ok` is False.
     :raises json.JSONDecodeError: If the file contains invalid JSON.
     """
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
+    config = _configs.get(config_path)
+    if config is None and missing_ok and not os.path.exists(config_path):
+        config = _configs[config_path] = Config(config_path, {}, 0.0)
+    elif config is None:
+        mtime = os.path.getmtime(config_path)
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = Config(config_path, json.load(f), mtime)
+        _configs[config_path] = config
+    elif config.hot_reload:
+        config.reload_if_changed()
     return config
 
 
@@ -0,0 +1,110 @@
+"""
+Conversion of one sticker file with the bot's settings: the conversion script per format,
+the result cache and the scheduler's conversion slots.
+
+Shared by the bot's exporter and the offline CLI (`cli.py`), so it doesn't import the
+Telegram-facing modules.
+"""
+import asyncio
+import os
+import shutil
+import time
+from typing import Optional
+
+import result_cache
+from config import load_config
+from converter import convert_sticker
+from scheduler import conversion_slot, estimate_units, predict_seconds, record_timing
+from tracing import current_span
+
+_config = load_config()
+CONVERT_WORKERS = _config.get("convert_workers", 5)
+
+
+def get_script_path(format_type: str) -> str:
+    """
+    Return the conversion script path based on format type and platform.
+
+    :param format_type: One of "gif", "png", "webp", "apng".
+    :return: Path to the shell script.
+    :raises ValueError: If format_type is invalid.
+    """
+    import platform
+    PLAT = f"{platform.system().lower()}_{platform.machine().lower()}"
+    if PLAT == "linux_x86_64":
+        PLAT = "linux_amd64"
+    if PLAT not in ["linux_amd64", "windows_amd64"]:
+        raise ValueError(f"Unsupported platform: {PLAT}")
+
+    script_map = {
+        "gif": f"lib/{PLAT}/lottie_to_gif.sh",
+        "png": f"lib/{PLAT}/lottie_to_png.sh",
+        "webp": f"lib/{PLAT}/lottie_to_webp.sh",
+        "apng": f"lib/{PLAT}/lottie_to_apng.sh",
+    }
+    if format_type not in script_map:
+        raise ValueError(f"Invalid format type: {format_type}")
+    return script_map[format_type]
+
+
+def source_folder(extension: str, chosen_format: str) -> str:
+    """
+    ZIP folder for the original sticker files next to the converted ones.
+
+    :param extension: Extension of the sticker file (`tgs`, `webm`, `webp`).
+    :param chosen_format: Output format of the conversion.
+    :return: Folder name; a `.webp` sticker converted to WebP would otherwise collide.
+    """
+    if extension == chosen_format:
+        return f"source_{extension}"
+    return extension
+
+
+async def convert_cached(
+    source_path: str,
+    out_path: str,
+    file_unique_id: str,
+    chosen_format: str,
+    quality: int,
+    width: int,
+    height: int,
+    fps: int,
+    script_path: str,
+    source_data: Optional[bytes] = None,
+    units: Optional[float] = None,
+) -> bool:
+    """
+    Convert a sticker, serving the result from the result cache when possible.
+
+    Conversions wait for a slot of the scheduler, and their time is measured to improve
+    later predictions (see `scheduler.py`).
+
+    :param source_path: Sticker file (its name only, with `source_data`).
+    :param out_path: Where the converted file is written.
+    :param file_unique_id: Telegram's stable ID of the sticker file (part of the cache key).
+    :param chosen_format: Output format.
+    :param quality: Conversion quality (percentage).
+    :param width: Output width.
+    :param height: Output height.
+    :param fps: Frame rate.
+    :param script_path: Conversion script for `convert_sticker`.
+    :param source_data: Sticker content, if held in memory.
+    :param units: Work units from `estimate_units`, if already estimated.
+    :return: True if the result came from the cache.
+    """
+    key = result_cache.cache_key(file_unique_id, chosen_format, quality, width, height, fps)
+    cached = await asyncio.to_thread(result_cache.lookup, key)
+    if cached is not None:
+        await asyncio.to_thread(shutil.copyfile, cached, out_path)
+        if current_span() is not None:
+            current_span().set(cache="hit")
+        return True
+    extension = os.path.splitext(source_path)[1].lstrip(".")
+    if units is None:
+        units = await asyncio.to_thread(estimate_units, source_path, width, height, fps, source_data)
+    async with conversion_slot(predict_seconds(extension, chosen_format, units)):
+        started = time.perf_counter()
+        await convert_sticker(source_path, out_path, width, height, fps, quality, script_path, source_data)
+        record_timing(extension, chosen_format, units, time.perf_counter() - started)
+    await asyncio.to_thread(result_cache.store, key, out_path)
+    return False
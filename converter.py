@@ -1,51 +1,428 @@
 """
-Lottie `.tgs` to image conversion logic.
+Sticker (`.tgs`, `.webm`, `.webp`) to image conversion logic.
 """
+import asyncio
+import gzip
+import json
+import math
+import os
+import shutil
 import subprocess
-from lottie import parsers
+import sys
+import time
 from loguru import logger
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+from config import load_config
+from decoders import get_decoder
+from jobs import current_job, kill_process_tree, popen_kwargs
+from metrics import ACTIVE_CONVERSIONS, RENDER_FAILURES, RENDER_SECONDS
+from tracing import span
 
-def tgs_convert(
-    tgs_path: str,
+_config = load_config()
+_converter_conf = _config.get("converter", {})
+CONVERT_TIMEOUT = _converter_conf.get("timeout", 300)
+CPU_LIMIT_SECONDS = _converter_conf.get("cpu_seconds", 600)
+MEMORY_LIMIT_MB = _converter_conf.get("memory_mb", 2048)
+# "shared": split the cores between running conversions, "single": one thread per
+# conversion (many jobs), "all": every conversion may use all cores (few jobs).
+THREADS_MODE = _converter_conf.get("threads_mode", "shared")
+# "gifski": encode GIFs with the lottie_to_gif.sh script, "palette": encode them with
+# gif_encoder.py (global palette, delta frames, frame deduplication).
+GIF_ENCODER = _converter_conf.get("gif_encoder", "gifski")
+# Animated stickers converted to at most `supersample_max_size` pixels per side are rendered
+# `supersample` times larger and box-filtered down, which smooths the edges of tiny
+# thumbnails at the cost of rendering more pixels. 1 = always render at the output size.
+SUPERSAMPLE = _converter_conf.get("supersample", 1)
+SUPERSAMPLE_MAX_SIZE = _converter_conf.get("supersample_max_size", 128)
+# Animated stickers are rendered as up to this many frame ranges in parallel, each by its
+# own renderer process; 0 = one range per thread of the conversion, 1 = off.
+FRAME_CHUNKS = _converter_conf.get("frame_chunks", 1)
+# Fewer frames per range don't make up for the renderer starting and parsing the animation.
+MIN_CHUNK_FRAMES = 24
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RUN_LIMITED = os.path.join(_BASE_DIR, "run_limited.py")
+ENCODE_FRAMES_SCRIPT = os.path.join(_BASE_DIR, "encode_frames.py")
+STDERR_TAIL = 2000
+
+_running_conversions = 0
+
+
+def cpu_count() -> int:
+    """
+    Number of CPUs this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def thread_budget(running: int) -> int:
+    """
+    Threads a new conversion may use for rendering and encoding.
+
+    :param running: Conversions running including the new one.
+    :return: Thread count to pass as `--threads`.
+    """
+    cores = cpu_count()
+    if THREADS_MODE == "single":
+        return 1
+    if THREADS_MODE == "all":
+        return cores
+    return max(1, cores // max(1, running))
+
+
+async def _run_with_usage(cmd: List[str], timeout: Optional[float] = None,
+                          input_data: Optional[bytes] = None) -> Dict[str, Any]:
+    """
+    Run a command as an asyncio subprocess and collect its resource usage.
+
+    On POSIX the command is started through `run_limited.py`, which applies the configured
+    CPU-time and memory rlimits and reports CPU time and peak RSS for the script and every
+    renderer/encoder process it waited for. The child runs in its own process group and is
+    registered with the current job, so cancelling the job kills it.
+
+    :param cmd: Command line to execute.
+    :param timeout: Wall-clock limit in seconds (defaults to `converter.timeout`, 0 = none).
+    :param input_data: Bytes to feed to the command's stdin.
+    :return: Dict with `wall_seconds` and, where available, `cpu_user_seconds`,
+             `cpu_system_seconds` and `max_rss_kb`.
+    :raises subprocess.CalledProcessError: If the command exits with a non-zero status;
+            `stderr` holds the tail of its error output.
+    :raises subprocess.TimeoutExpired: If the command runs longer than `timeout`.
+    """
+    timeout = CONVERT_TIMEOUT if timeout is None else timeout
+    exec_cmd = list(cmd)
+    kwargs = popen_kwargs()
+    stats_read = stats_write = None
+    if os.name == "posix":
+        stats_read, stats_write = os.pipe()
+        exec_cmd = [
+            sys.executable, RUN_LIMITED,
+            "--cpu-seconds", str(CPU_LIMIT_SECONDS),
+            "--memory-mb", str(MEMORY_LIMIT_MB),
+            "--stats-fd", str(stats_write),
+            "--", *cmd,
+        ]
+        kwargs["pass_fds"] = (stats_write,)
+
+    start = time.perf_counter()
+    job = current_job()
+    try:
+        if input_data is not None:
+            kwargs["stdin"] = asyncio.subprocess.PIPE
+        proc = await asyncio.create_subprocess_exec(*exec_cmd, stderr=asyncio.subprocess.PIPE, **kwargs)
+    except BaseException:
+        if stats_read is not None:
+            os.close(stats_read)
+        raise
+    finally:
+        if stats_write is not None:
+            os.close(stats_write)
+    if job is not None:
+        job.add_process(proc)
+    try:
+        _, stderr = await asyncio.wait_for(proc.communicate(input_data), timeout=timeout or None)
+    except asyncio.TimeoutError:
+        kill_process_tree(proc)
+        await proc.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        kill_process_tree(proc)
+        raise
+    finally:
+        if job is not None:
+            job.remove_process(proc)
+        usage = _read_stats(stats_read)
+
+    stats: Dict[str, Any] = {"wall_seconds": round(time.perf_counter() - start, 3), **usage}
+    if proc.returncode != 0:
+        stderr_text = stderr.decode("utf-8", errors="replace")[-STDERR_TAIL:]
+        logger.error(f"Command exited with {proc.returncode}: {' '.join(cmd)}\n{stderr_text}")
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr_text)
+    return stats
+
+
+def _read_stats(fd: Optional[int]) -> Dict[str, Any]:
+    if fd is None:
+        return {}
+    # Non-blocking: a killed or still-exiting wrapper may not have written anything.
+    os.set_blocking(fd, False)
+    try:
+        data = os.read(fd, 65536)
+    except BlockingIOError:
+        data = b""
+    finally:
+        os.close(fd)
+    try:
+        return json.loads(data) if data else {}
+    except ValueError:
+        return {}
+
+
+def _merge_stats(total: Dict[str, Any], stats: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(total)
+    for key, value in stats.items():
+        if key == "max_rss_kb":
+            merged[key] = max(merged.get(key, 0), value)
+        elif key.endswith("_seconds"):
+            merged[key] = round(merged.get(key, 0) + value, 3)
+        else:
+            merged[key] = value
+    return merged
+
+
+def supersample_factor(decoder, width: int, height: int) -> int:
+    """
+    Factor to render a sticker larger than its output by, 1 to render at the output size.
+    """
+    if SUPERSAMPLE > 1 and decoder.vector and max(width, height) <= SUPERSAMPLE_MAX_SIZE:
+        return SUPERSAMPLE
+    return 1
+
+
+def plan_frame_ranges(animation: Dict[str, Any], fps: int, chunks: int) -> List[Tuple[float, float, int]]:
+    """
+    Split the frames `lottie_to_png` renders of an animation into ranges rendered separately.
+
+    The renderer renders frames `ip` to `op` inclusive at `fps`, so a range ends where the
+    next one starts and that shared frame is kept only once. Ranges start on a rendered
+    frame that falls on a whole source frame, which makes the merged frames identical to
+    those of a single render.
+
+    :param animation: Lottie JSON.
+    :param fps: Frame rate rendered at.
+    :param chunks: Number of ranges wanted.
+    :return: List of (ip, op, rendered frames to keep); empty if the animation is too short
+             to split or its frame rate isn't whole.
+    """
+    ip, op, frame_rate = animation.get("ip", 0), animation.get("op", 0), animation.get("fr", 0)
+    if not frame_rate or not float(frame_rate).is_integer() or op <= ip:
+        return []
+    frame_rate = int(frame_rate)
+    total = math.ceil((op - ip + 1) * fps / frame_rate)
+    chunks = min(chunks, total // MIN_CHUNK_FRAMES)
+    if chunks < 2:
+        return []
+    step = fps // math.gcd(fps, frame_rate)
+    starts = sorted({round(total * k / chunks / step) * step for k in range(chunks)} & set(range(total)))
+    if len(starts) < 2:
+        return []
+    ranges = []
+    for start, end in zip(starts, starts[1:] + [total]):
+        range_op = ip + end * frame_rate // fps if end < total else op
+        ranges.append((ip + start * frame_rate // fps, range_op, end - start))
+    return ranges
+
+
+def _load_lottie(source_path: str, source_data: Optional[bytes]) -> Dict[str, Any]:
+    if source_data is None:
+        with open(source_path, "rb") as f:
+            source_data = f.read()
+    return json.loads(gzip.decompress(source_data))
+
+
+async def _render_frame_ranges(decoder, animation: Dict[str, Any], ranges: List[Tuple[float, float, int]],
+                               frames_dir: str, width: int, height: int, fps: int, threads: int,
+                               lib_dir: str) -> Dict[str, Any]:
+    """
+    Render the frame ranges of an animation in parallel and merge the frames into `frames_dir`.
+
+    :return: Resource usage of the renderers; `wall_seconds` is that of the slowest one.
+    """
+    chunk_threads = max(1, threads // len(ranges))
+    paths = []
+    try:
+        commands = []
+        for index, (ip, op, _) in enumerate(ranges):
+            chunk_path = f"{frames_dir}.{index}"
+            paths.append(chunk_path)
+            with open(f"{chunk_path}.json", "w") as f:
+                json.dump({**animation, "ip": ip, "op": op}, f)
+            commands.append(decoder.command(f"{chunk_path}.json", chunk_path, width, height, fps,
+                                            chunk_threads, lib_dir))
+
+        async def render(index: int, cmd: List[str]) -> Dict[str, Any]:
+            logger.info(f"Running conversion command: {' '.join(cmd)}")
+            with span("subprocess", stage="render", script=_command_name(cmd), threads=chunk_threads,
+                      frame_range=index) as proc_span:
+                step_stats = await _run_with_usage(cmd)
+                proc_span.set(**step_stats)
+            return step_stats
+
+        # Wait for every renderer before raising, so none still writes while we clean up.
+        results = await asyncio.gather(*(render(i, cmd) for i, cmd in enumerate(commands)),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        os.makedirs(frames_dir, exist_ok=True)
+        number = 0
+        for chunk_path, (_, _, keep) in zip(paths, ranges):
+            for name in sorted(n for n in os.listdir(chunk_path) if n.endswith(".png"))[:keep]:
+                os.replace(os.path.join(chunk_path, name), os.path.join(frames_dir, f"{number:05d}.png"))
+                number += 1
+    finally:
+        for chunk_path in paths:
+            shutil.rmtree(chunk_path, ignore_errors=True)
+            if os.path.exists(f"{chunk_path}.json"):
+                os.remove(f"{chunk_path}.json")
+
+    stats: Dict[str, Any] = {}
+    for result in results:
+        stats = _merge_stats(stats, result)
+    stats["wall_seconds"] = max(result.get("wall_seconds", 0) for result in results)
+    return stats
+
+
+def _encode_cmd(format_type: str, fps: int, quality: int, supersample: int, target_path: str,
+                frames_dir: str) -> List[str]:
+    return [
+        sys.executable, ENCODE_FRAMES_SCRIPT,
+        "--format", format_type,
+        "--fps", str(fps),
+        "--quality", str(max(1, min(quality, 100))),
+        "--supersample", str(supersample),
+        "--output", str(target_path),
+        frames_dir,
+    ]
+
+
+def _command_name(cmd: List[str]) -> str:
+    # "bash lottie_to_png.sh ..." / "python encode_frames.py ..." -> the script, else the program.
+    if cmd[0] in ("bash", sys.executable):
+        return os.path.basename(cmd[1])
+    return os.path.basename(cmd[0])
+
+
+def _script_cmd(script_path: str, output: str, width: int, height: int, fps: int,
+                quality: int, threads: int, source: str) -> List[str]:
+    return [
+        "bash",
+        script_path,
+        "--output", str(output),
+        "--height", str(height),
+        "--width", str(width),
+        "--fps", str(fps),
+        "--quality", str(max(1, min(quality, 100))),
+        "--threads", str(threads),
+        source,
+    ]
+
+
+async def convert_sticker(
+    source_path: str,
     target_path: str,
     width: Optional[int] = None,
     height: Optional[int] = None,
     fps: int = 60,
     quality: int = 100,
     script_path: str = None,
-) -> None:
+    source_data: Optional[bytes] = None,
+) -> Dict[str, Any]:
     """
-    Convert a `.tgs` file to a specified image format using an external shell script.
+    Convert a sticker file to a specified image format using external scripts.
+
+    The input is decoded into PNG frames by the decoder registered for its extension
+    (see `decoders.py`) and the frames are encoded by `encode_frames.py`; `.tgs` files
+    converted to GIF with gifski or to PNG run the lottie script in one step instead.
+    Frames are always rendered at the output size, so no step rescales them, unless
+    supersampling applies (see `supersample_factor`). Long `.tgs` animations may be
+    rendered as frame ranges in parallel (`converter.frame_chunks`, see `plan_frame_ranges`).
 
-    :param tgs_path: Path to the source `.tgs` file.
+    A source held in memory (`source_data`) is piped to decoders that read stdin, so
+    it is never written to disk; for other decoders it is written to `source_path` first.
+
+    :param source_path: Path (or, with `source_data`, name) of the source `.tgs`, `.webm` or `.webp` file.
     :param target_path: Path for the output image file.
     :param width: Desired width of the output (defaults to original width).
     :param height: Desired height of the output (defaults to original height).
     :param fps: Frame rate to use.
     :param quality: Output quality (percentage).
     :param script_path: Path to the conversion script (e.g., `lottie_to_gif.sh`).
-    :raises subprocess.CalledProcessError: If the conversion script fails.
+    :param source_data: Content of the source file, if it's only held in memory.
+    :return: Resource usage of the conversion subprocesses (see `_run_with_usage`).
+    :raises ValueError: If no decoder handles the source file.
+    :raises subprocess.CalledProcessError: If a conversion step fails.
+    :raises subprocess.TimeoutExpired: If a step exceeds `converter.timeout`.
     """
-    animation = parsers.tgs.parse_tgs(tgs_path)
-    if fps:
-        animation.frame_rate = fps
+    decoder = get_decoder(source_path)
+    if source_data is not None and not decoder.stdin:
+        with open(source_path, "wb") as f:
+            f.write(source_data)
+        source_data = None
+    source = "-" if source_data is not None else source_path
+    if width is None or height is None:
+        native_width, native_height = await asyncio.to_thread(decoder.probe, source_path, source_data)
+        if width is None:
+            width = native_width
+        if height is None:
+            height = native_height
 
-    if width is None:
-        width = animation.width
-    if height is None:
-        height = animation.height
+    global _running_conversions
+    frames_dir = None
+    stats: Dict[str, Any] = {}
+    try:
+        _running_conversions += 1
+        threads = thread_budget(_running_conversions)
+        format_type = os.path.splitext(str(target_path))[1].lstrip(".") or "unknown"
+        supersample = supersample_factor(decoder, width, height)
+        lottie_script = decoder.extension == "tgs" and supersample == 1 and (
+            format_type == "png" or (format_type == "gif" and GIF_ENCODER == "gifski")
+        )
+        lib_dir = os.path.dirname(script_path)
+        animation, ranges = None, []
+        chunks = FRAME_CHUNKS or threads
+        if decoder.extension == "tgs" and chunks > 1:
+            try:
+                animation = await asyncio.to_thread(_load_lottie, source_path, source_data)
+                ranges = plan_frame_ranges(animation, fps, chunks)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not split {source_path} into frame ranges: {e}")
+        if ranges:
+            # The ranges are rendered before the steps run; the steps only encode the frames.
+            frames_dir = f"{target_path}.frames"
+            if lottie_script and format_type == "gif":
+                steps = [("encode", _script_cmd(script_path, target_path, width, height, fps, quality, threads,
+                                                frames_dir))]
+            else:
+                steps = [("encode", _encode_cmd(format_type, fps, quality, supersample, target_path, frames_dir))]
+        elif lottie_script:
+            # gifski can't take per-frame delays, so it gets every rendered frame.
+            steps = [("render", _script_cmd(script_path, target_path, width, height, fps, quality, threads, source))]
+        elif format_type == "png" and supersample == 1:
+            decoder.prepare(target_path)
+            steps = [("render", decoder.command(source, target_path, width, height, fps, threads, lib_dir))]
+        else:
+            # Frames go through encode_frames.py, which downscales supersampled frames and
+            # collapses identical ones.
+            frames_dir = f"{target_path}.frames"
+            decoder.prepare(frames_dir)
+            steps = [
+                ("render", decoder.command(source, frames_dir, width * supersample, height * supersample, fps,
+                                           threads, lib_dir)),
+                ("encode", _encode_cmd(format_type, fps, quality, supersample, target_path, frames_dir)),
+            ]
 
-    cmd = [
-        "bash",
-        script_path,
-        "--output", str(target_path),
-        "--height", str(height),
-        "--width", str(width),
-        "--fps", str(fps),
-        "--quality", str(max(1, min(quality, 100))),
-        tgs_path,
-    ]
-    logger.info(f"Running conversion command: {' '.join(cmd)}")
-    subprocess.run(cmd, check=True)
\ No newline at end of file
+        with ACTIVE_CONVERSIONS.track_inprogress(), \
+                RENDER_SECONDS.time(format=format_type, size=f"{width}x{height}", fps=fps):
+            if ranges:
+                stats = await _render_frame_ranges(decoder, animation, ranges, frames_dir, width * supersample,
+                                                   height * supersample, fps, threads, lib_dir)
+            for stage, cmd in steps:
+                logger.info(f"Running conversion command: {' '.join(cmd)}")
+                with span("subprocess", stage=stage, script=_command_name(cmd), threads=threads,
+                          supersample=supersample) as proc_span:
+                    step_stats = await _run_with_usage(cmd, input_data=source_data if stage == "render" else None)
+                    proc_span.set(**step_stats)
+                stats = _merge_stats(stats, step_stats)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        RENDER_FAILURES.inc(format=format_type)
+        raise
+    finally:
+        _running_conversions -= 1
+        if frames_dir is not None:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+    return stats
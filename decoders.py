@@ -0,0 +1,198 @@
+"""
+Input decoders: turn a sticker file into a directory of PNG frames for `encode_frames.py`.
+
+- `.tgs` (animated stickers) are rendered by the `lottie_to_png.sh` script,
+- `.webm` (video stickers) are decoded by ffmpeg,
+- `.webp` (static stickers) are decoded by Pillow, through this module's command line.
+
+New input types are added by subclassing `Decoder` and calling `register_decoder`.
+Decoding libraries (lottie, Pillow) are imported when first needed, not when the bot starts.
+
+Usage: python decoders.py --width WIDTH --height HEIGHT --output FRAMES_DIR image
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Decoder:
+    """
+    Decodes one kind of sticker file into PNG frames.
+    """
+
+    extension = ""
+    # Vector input renders sharper when supersampled; raster input only gets resampled twice.
+    vector = False
+    # The command reads the sticker from stdin when given "-" as source.
+    stdin = False
+
+    def probe(self, path: str, data: Optional[bytes] = None) -> Tuple[int, int]:
+        """
+        Return the native (width, height) of the sticker, read from `data` if given.
+        """
+        raise NotImplementedError
+
+    def prepare(self, frames_dir: str) -> None:
+        """
+        Create the frames directory before the decode command runs.
+        """
+        os.makedirs(frames_dir, exist_ok=True)
+
+    def command(self, source: str, frames_dir: str, width: int, height: int, fps: int,
+                threads: int, lib_dir: str) -> List[str]:
+        """
+        Build the command that writes the frames of `source` into `frames_dir`.
+
+        :param source: Sticker file path, or "-" for stdin if `stdin` is supported.
+        :param frames_dir: Directory to write `*.png` frames to.
+        :param width: Output width.
+        :param height: Output height.
+        :param fps: Frame rate to sample at.
+        :param threads: Decoder threads, 0 = all CPUs.
+        :param lib_dir: Directory holding the platform's lottie scripts.
+        :return: Command line.
+        """
+        raise NotImplementedError
+
+
+class LottieDecoder(Decoder):
+    extension = "tgs"
+    vector = True
+    stdin = True
+
+    def probe(self, path: str, data: Optional[bytes] = None) -> Tuple[int, int]:
+        from lottie import parsers
+
+        animation = parsers.tgs.parse_tgs(io.BytesIO(data) if data is not None else path)
+        return animation.width, animation.height
+
+    def prepare(self, frames_dir: str) -> None:
+        # lottie_to_png.sh moves its output into place and must not find a directory there.
+        pass
+
+    def command(self, source, frames_dir, width, height, fps, threads, lib_dir):
+        return [
+            "bash", os.path.join(lib_dir, "lottie_to_png.sh"),
+            "--output", str(frames_dir),
+            "--height", str(height),
+            "--width", str(width),
+            "--fps", str(fps),
+            "--threads", str(threads),
+            source,
+        ]
+
+
+class VideoDecoder(Decoder):
+    extension = "webm"
+
+    def probe(self, path: str, data: Optional[bytes] = None) -> Tuple[int, int]:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "stream=width,height", "-of", "json", path],
+            check=True, capture_output=True,
+        )
+        stream = json.loads(result.stdout)["streams"][0]
+        return stream["width"], stream["height"]
+
+    def command(self, source, frames_dir, width, height, fps, threads, lib_dir):
+        # Video stickers are VP9 with an alpha channel, which only libvpx decodes.
+        return [
+            "ffmpeg", "-v", "error", "-y",
+            "-threads", str(threads),
+            "-c:v", "libvpx-vp9", "-i", source,
+            "-vf", f"fps={fps},scale={width}:{height}:force_original_aspect_ratio=decrease:flags=lanczos",
+            "-pix_fmt", "rgba",
+            "-start_number", "0",
+            os.path.join(frames_dir, "%04d.png"),
+        ]
+
+
+class ImageDecoder(Decoder):
+    extension = "webp"
+
+    def probe(self, path: str, data: Optional[bytes] = None) -> Tuple[int, int]:
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data) if data is not None else path) as im:
+            return im.size
+
+    def command(self, source, frames_dir, width, height, fps, threads, lib_dir):
+        return [
+            sys.executable, os.path.join(_BASE_DIR, "decoders.py"),
+            "--width", str(width),
+            "--height", str(height),
+            "--output", str(frames_dir),
+            source,
+        ]
+
+
+_decoders: Dict[str, Decoder] = {}
+
+
+def register_decoder(decoder: Decoder) -> None:
+    """
+    Make `decoder` handle files with its extension.
+    """
+    _decoders[decoder.extension] = decoder
+
+
+def get_decoder(path: str) -> Decoder:
+    """
+    Return the decoder for a sticker file, chosen by its extension.
+
+    :raises ValueError: If no decoder handles the extension.
+    """
+    extension = os.path.splitext(str(path))[1].lstrip(".").lower()
+    if extension not in _decoders:
+        raise ValueError(f"Unsupported sticker file: {os.path.basename(str(path))}")
+    return _decoders[extension]
+
+
+def sticker_extension(sticker) -> str:
+    """
+    File extension of a Telegram sticker's file: `tgs`, `webm` or `webp`.
+    """
+    if sticker.is_animated:
+        return "tgs"
+    if sticker.is_video:
+        return "webm"
+    return "webp"
+
+
+def decode_image(source: str, frames_dir: str, width: int, height: int) -> None:
+    """
+    Write a static image as a single frame, scaled to fit inside width×height.
+    """
+    from PIL import Image, ImageOps
+
+    os.makedirs(frames_dir, exist_ok=True)
+    with Image.open(source) as im:
+        frame = ImageOps.contain(im.convert("RGBA"), (width, height), Image.Resampling.LANCZOS)
+    frame.save(os.path.join(frames_dir, "0000.png"))
+
+
+register_decoder(LottieDecoder())
+register_decoder(VideoDecoder())
+register_decoder(ImageDecoder())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Decode a static sticker into a PNG frame.")
+    parser.add_argument("--width", type=int, required=True)
+    parser.add_argument("--height", type=int, required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("image")
+    args = parser.parse_args()
+
+    decode_image(args.image, args.output, args.width, args.height)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
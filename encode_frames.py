@@ -0,0 +1,153 @@
+"""
+Encode a directory of rendered PNG frames into an animated GIF, WebP or APNG.
+
+Consecutive identical frames (common in stickers that hold still) are collapsed into one
+frame with a longer duration before the encoder sees them, so encode time and output size
+shrink with how static the sticker is.
+
+Frames are expected at the output size. Frames rendered `--supersample` times larger are
+downscaled first; with `--format png` that is all that happens and the frame directory is
+moved to OUTPUT.
+
+Usage: python encode_frames.py --format {gif,webp,apng,png} [--fps FPS] [--quality QUALITY]
+                               [--supersample FACTOR] --output OUTPUT frames_dir
+"""
+import argparse
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+from typing import List, Tuple
+
+from PIL import Image
+
+from gif_encoder import encode_gif
+
+
+def dedup_frames(paths: List[str], fps: float) -> List[Tuple[str, float]]:
+    """
+    Collapse runs of identical frames.
+
+    The renderer writes identical pixels as identical PNG bytes, so frames are compared by
+    a hash of the file content.
+
+    :param paths: Frame paths in display order.
+    :param fps: Frame rate the frames were rendered at.
+    :return: List of (frame path, duration in ms).
+    """
+    frame_ms = 1000.0 / fps
+    frames: List[Tuple[str, float]] = []
+    last_digest = None
+    for path in paths:
+        with open(path, "rb") as f:
+            digest = hashlib.blake2b(f.read(), digest_size=16).digest()
+        if digest == last_digest:
+            frames[-1] = (frames[-1][0], frames[-1][1] + frame_ms)
+        else:
+            frames.append((path, frame_ms))
+            last_digest = digest
+    return frames
+
+
+def downscale_frames(paths: List[str], factor: int) -> None:
+    """
+    Shrink supersampled frames in place, averaging each factor×factor block of pixels.
+
+    :param paths: Frame paths.
+    :param factor: Integer factor the frames were rendered larger by.
+    """
+    for path in paths:
+        with Image.open(path) as im:
+            frame = im.convert("RGBA")
+        size = (max(1, frame.width // factor), max(1, frame.height // factor))
+        frame.resize(size, Image.Resampling.BOX).save(path)
+
+
+def _durations_ms(frames: List[Tuple[str, float]]) -> List[int]:
+    """
+    Round durations to whole milliseconds without accumulating drift.
+    """
+    result = []
+    elapsed = 0.0
+    written = 0
+    for _, duration in frames:
+        elapsed += duration
+        result.append(round(elapsed) - written)
+        written += result[-1]
+    return result
+
+
+def encode_webp(frames: List[Tuple[str, float]], output: str, quality: int) -> None:
+    cmd = ["img2webp", "-lossy", "-q", str(quality)]
+    for (path, _), duration in zip(frames, _durations_ms(frames)):
+        cmd += ["-d", str(max(1, duration)), path]
+    cmd += ["-o", output]
+    subprocess.run(cmd, check=True)
+
+
+def encode_apng(frames: List[Tuple[str, float]], output: str) -> None:
+    # Pillow writes exact per-frame delays (ffmpeg's concat demuxer loses the last one)
+    # and crops every frame to the region that changed.
+    images = []
+    for path, _ in frames:
+        with Image.open(path) as im:
+            images.append(im.convert("RGBA"))
+    images[0].save(
+        output, format="PNG", save_all=True, append_images=images[1:],
+        duration=_durations_ms(frames), loop=0, disposal=0, blend=0,
+    )
+
+
+def encode_frames(frames_dir: str, output: str, format_type: str, fps: float, quality: int = 90,
+                  supersample: int = 1) -> None:
+    """
+    Deduplicate the frames in `frames_dir` and encode them.
+
+    :param frames_dir: Directory of `*.png` frames as written by `lottie_to_png`.
+    :param output: Output file path (output directory for "png").
+    :param format_type: One of "gif", "webp", "apng", "png".
+    :param fps: Frame rate the frames were rendered at.
+    :param quality: Output quality (percentage).
+    :param supersample: Factor the frames were rendered larger than the output by.
+    :raises ValueError: If there are no frames or the format is unknown.
+    :raises subprocess.CalledProcessError: If an external encoder fails.
+    """
+    paths = sorted(glob.glob(os.path.join(frames_dir, "*.png")))
+    if not paths:
+        raise ValueError(f"No frames found in {frames_dir}")
+    if supersample > 1:
+        downscale_frames(paths, supersample)
+    if format_type == "png":
+        if os.path.abspath(frames_dir) != os.path.abspath(output):
+            shutil.move(frames_dir, output)
+        return
+    frames = dedup_frames(paths, fps)
+
+    if format_type == "gif":
+        encode_gif(frames, output, quality=quality)
+    elif format_type == "webp":
+        encode_webp(frames, output, quality)
+    elif format_type == "apng":
+        encode_apng(frames, output)
+    else:
+        raise ValueError(f"Invalid format type: {format_type}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Encode a directory of PNG frames.")
+    parser.add_argument("--format", required=True, choices=("gif", "webp", "apng", "png"))
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--supersample", type=int, default=1)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("frames_dir")
+    args = parser.parse_args()
+
+    encode_frames(args.frames_dir, args.output, args.format, args.fps, args.quality, args.supersample)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,62 +1,135 @@
 """
 Export `.tgs` files for single stickers or entire sticker sets, including conversion logic.
+
+Conversion accepts animated (`.tgs`), video (`.webm`) and static (`.webp`) stickers.
 """
 import os
 import zipfile
 import asyncio
 import shutil
+import time
 
-from httpx import ConnectError
-from telegram.error import RetryAfter, TimedOut
+from telegram.error import TelegramError
 from loguru import logger
 
 from config import load_config
-from retry_utils import retry_on_exception
-from utils import split_and_upload_document
-from converter import tgs_convert
-from typing import Dict, Any
+from conversion import CONVERT_WORKERS, convert_cached, get_script_path, source_folder
+from jobs import finish_job, start_job
+from metrics import DOWNLOAD_BYTES, DOWNLOAD_SECONDS, QUEUE_WAIT_SECONDS
+import mtproto
+import result_cache
+from retry_utils import RetryPolicy
+from scheduler import estimate_units, eta_seconds, format_eta, predict_seconds
+from tracing import current_span, span, traced_job
+from utils import LOCAL_MODE, link_local_file, notify_retry, split_and_upload_document
+from decoders import sticker_extension
+from typing import Any, Collection, Dict, List, Optional, Tuple
 
 
 _config = load_config()
 DOWNLOAD_WORKERS = _config.get("download_workers", 15)
-CONVERT_WORKERS = _config.get("convert_workers", 5)
 BOT_USER_NAME = _config.get("bot_user_name", "@sticker\\_to\\_gif\\_01\\_bot")
+# Sticker files small enough to keep in memory from download to ZIP.
+IN_MEMORY_SUFFIXES = (".tgs",)
+
+# Stickers named in the note about stickers missing from an archive.
+MAX_LISTED_MISSING = 20
+
+DOWNLOAD_POLICY = RetryPolicy("download")
+MTPROTO_DOWNLOAD_POLICY = RetryPolicy("mtproto_download")
+
 
-def get_script_path(format_type: str) -> str:
+def missing_note(missing: List[Tuple[int, str]], total: int) -> str:
     """
-    Return the conversion script path based on format type and platform.
+    Markdown note listing the stickers left out of an archive because they failed.
 
-    :param format_type: One of "gif", "png", "webp", "apng".
-    :return: Path to the shell script.
-    :raises ValueError: If format_type is invalid.
+    :param missing: Position in the set (from 0) and `file_unique_id` of each missing sticker.
+    :param total: Number of stickers the archive should have had.
+    :return: Message text for the user.
     """
-    import platform
-    PLAT = f"{platform.system().lower()}_{platform.machine().lower()}"
-    if PLAT == "linux_x86_64":
-        PLAT = "linux_amd64"
-    if PLAT not in ["linux_amd64", "windows_amd64"]:
-        raise ValueError(f"Unsupported platform: {PLAT}")
+    listed = ", ".join(f"#{idx + 1} `{unique_id}`" for idx, unique_id in missing[:MAX_LISTED_MISSING])
+    more = f" and {len(missing) - MAX_LISTED_MISSING} more" if len(missing) > MAX_LISTED_MISSING else ""
+    return (
+        f"⚠️ *{len(missing)} of {total} stickers failed* and are missing from the ZIP: {listed}{more}.\n"
+        f"_Send the set again to retry them._"
+    )
 
-    script_map = {
-        "gif": f"lib/{PLAT}/lottie_to_gif.sh",
-        "png": f"lib/{PLAT}/lottie_to_png.sh",
-        "webp": f"lib/{PLAT}/lottie_to_webp.sh",
-        "apng": f"lib/{PLAT}/lottie_to_apng.sh",
-    }
-    if format_type not in script_map:
-        raise ValueError(f"Invalid format type: {format_type}")
-    return script_map[format_type]
 
+def zip_source(zf: zipfile.ZipFile, path: str, data: Optional[bytes], arcname: str) -> None:
+    """
+    Add a downloaded sticker to a ZIP, from memory if `fetch_sticker` kept it there.
+    """
+    if data is not None:
+        zf.writestr(arcname, data)
+    elif os.path.exists(path):
+        zf.write(path, arcname)
 
-@retry_on_exception((ConnectError, TimedOut, Exception), max_retries=None)
-async def get_file_retry(bot, file_id):
-    return await bot.get_file(file_id)
 
-@retry_on_exception((ConnectError, TimedOut, Exception), max_retries=None)
-async def download_to_drive_retry(file_obj, path):
-    return await file_obj.download_to_drive(path)
+async def _remove_cancel_button(progress_msg) -> None:
+    """
+    Drop the job cancel button from a progress message once the job is over.
+    """
+    if progress_msg is None:
+        return
+    try:
+        await progress_msg.edit_reply_markup(reply_markup=None)
+    except TelegramError as e:
+        logger.debug(f"Could not remove cancel button: {e}")
+
+
+async def _download(bot, file_id: str, path: str) -> Optional[bytes]:
+    in_memory = path.endswith(IN_MEMORY_SUFFIXES)
+    data = None
+    if mtproto.MTPROTO_ENABLED:
+        with DOWNLOAD_SECONDS.time():
+            if in_memory:
+                data = await mtproto.download_bytes(file_id)
+            else:
+                await mtproto.download_file(file_id, path)
+    else:
+        file = await bot.get_file(file_id)
+        with DOWNLOAD_SECONDS.time():
+            if LOCAL_MODE and os.path.isabs(file.file_path):
+                if in_memory:
+                    with open(file.file_path, "rb") as f:
+                        data = f.read()
+                else:
+                    link_local_file(file.file_path, path)
+            elif in_memory:
+                data = bytes(await file.download_as_bytearray())
+            else:
+                await file.download_to_drive(path)
+    DOWNLOAD_BYTES.inc(len(data) if data is not None else os.path.getsize(path))
+    return data
+
+
+async def fetch_sticker(bot, file_id: str, path: str, on_retry=None,
+                        file_unique_id: Optional[str] = None) -> Optional[bytes]:
+    """
+    Download a sticker file, over MTProto if `mtproto.status` is enabled, else through the
+    Bot API, retrying transient errors under the download retry policy.
 
+    `.tgs` files (usually well under 64 KB) are kept in memory and fed from there to the
+    size probe, the renderer's stdin and the ZIP; other files are written to `path`.
+
+    :param bot: Telegram Bot instance.
+    :param file_id: Bot API file ID.
+    :param path: Destination path; its extension decides where the file goes.
+    :param on_retry: Passed to `RetryPolicy.run`.
+    :param file_unique_id: If given, the file's content hash is recorded for the result
+                           cache under this ID (see `result_cache.record_content`).
+    :return: The file content for `.tgs` files, else None.
+    :raises CircuitOpenError: If downloads are currently failing for everyone.
+    """
+    policy = MTPROTO_DOWNLOAD_POLICY if mtproto.MTPROTO_ENABLED else DOWNLOAD_POLICY
+    data = await policy.run(_download, bot, file_id, path, on_retry=on_retry)
+    if file_unique_id is not None:
+        digest = await asyncio.to_thread(result_cache.content_hash, path, data)
+        result_cache.record_content(file_unique_id, digest)
+    return data
 
+
+@traced_job("single_export")
 async def process_single_export(
     bot,
     single_info: Dict[str, Any],
@@ -76,53 +149,55 @@ async def process_single_export(
 
     tmp_dir = f"tmp/{set_name}-{user_id}-{unique_id}-export"
     os.makedirs(tmp_dir, exist_ok=True)
+    job = start_job(feedback_msg.chat_id)
+    progress_msg = None
+    current_span().set(user_id=user_id, set_name=set_name, file_unique_id=unique_id)
 
     try:
-        await feedback_msg.reply_text("📥 Downloading .tgs file…", parse_mode="Markdown")
+        progress_msg = await feedback_msg.reply_text(
+            "📥 Downloading .tgs file…", parse_mode="Markdown", reply_markup=job.cancel_markup()
+        )
         tgs_path = f"{tmp_dir}/{unique_id}.tgs"
-
-        for attempt in range(3):
-            try:
-                file = await get_file_retry(bot, sticker_file_id)
-                await download_to_drive_retry(file, tgs_path)
-                break
-            except (RetryAfter, TimedOut) as e:
-                wait_time = getattr(e, "retry_after", 60)
-                await feedback_msg.reply_text(
-                    f"⚠️ Rate limited, retrying ({attempt+1}/3)… waiting {wait_time}s",
-                    parse_mode="Markdown",
-                )
-                await asyncio.sleep(wait_time)
-
-        if not os.path.exists(tgs_path):
-            await feedback_msg.reply_text("❌ Failed to download .tgs file.", parse_mode="Markdown")
-            return
+        with span("download"):
+            tgs_data = await fetch_sticker(bot, sticker_file_id, tgs_path, on_retry=notify_retry(feedback_msg, "Download"))
 
         zip_name = f"{set_name}_{unique_id}_tgs.zip"
         zip_path = f"{tmp_dir}/{zip_name}"
-        with zipfile.ZipFile(zip_path, "w") as zf:
-            zf.write(tgs_path, arcname=f"{set_name}/{unique_id}.tgs")
+        with span("zip"), zipfile.ZipFile(zip_path, "w") as zf:
+            zf.writestr(f"{set_name}/{unique_id}.tgs", tgs_data)
 
         await feedback_msg.reply_text("📤 Sending .tgs ZIP…", parse_mode="Markdown")
-        await split_and_upload_document(
-            feedback_msg,
-            caption=(
-                f"✅ *Export Completed!*\n"
-                f"• Only `.tgs` file included.\n"
-                f"• From sticker set: `{set_name}`"
-            ),
-            zip_path=zip_path,
-            chunk_size=50_000_000,
-        )
+        with span("upload", bytes=os.path.getsize(zip_path)):
+            await split_and_upload_document(
+                feedback_msg,
+                caption=(
+                    f"✅ *Export Completed!*\n"
+                    f"• Only `.tgs` file included.\n"
+                    f"• From sticker set: `{set_name}`"
+                ),
+                zip_path=zip_path,
+                chunk_size=50_000_000,
+            )
 
+    except asyncio.CancelledError as e:
+        logger.info(f"Job {job.job_id} canceled in process_single_export")
+        current_span().fail(e)
+        if job.timed_out:
+            await feedback_msg.reply_text("⏱️ *Job timed out and was stopped.*", parse_mode="Markdown")
+        else:
+            await feedback_msg.reply_text("🛑 *Job canceled.*", parse_mode="Markdown")
     except Exception as e:
         logger.error(f"Error in process_single_export: {e}")
+        current_span().fail(e)
         await feedback_msg.reply_text(f"❌ *Error:* `{e}`", parse_mode="Markdown")
     finally:
+        finish_job(job)
+        await _remove_cancel_button(progress_msg)
         if os.path.exists(tmp_dir):
             shutil.rmtree(tmp_dir, ignore_errors=True)
 
 
+@traced_job("set_export")
 async def process_set_export(
     bot,
     sticker_set,
@@ -140,10 +215,15 @@ async def process_set_export(
     user_id = feedback_msg.from_user.id
     tmp_dir = f"tmp/{sticker_set_name}-{user_id}-export"
     os.makedirs(tmp_dir, exist_ok=True)
+    job = start_job(feedback_msg.chat_id)
+    progress_msg = None
+    job_span = current_span()
+    job_span.set(user_id=user_id, set_name=sticker_set_name)
 
     try:
-        await feedback_msg.reply_text(
-            f"🚀 *Exporting* `{sticker_set_name}` (only .tgs)", parse_mode="Markdown"
+        progress_msg = await feedback_msg.reply_text(
+            f"🚀 *Exporting* `{sticker_set_name}` (only .tgs)", parse_mode="Markdown",
+            reply_markup=job.cancel_markup(),
         )
 
         animated = [s for s in sticker_set.stickers if s.is_animated]
@@ -152,31 +232,29 @@ async def process_set_export(
             return
 
         total = len(animated)
+        job_span.set(stickers=total)
         await feedback_msg.reply_text(
             f"📥 Downloading {total} animated .tgs…", parse_mode="Markdown"
         )
 
         sem_dl = asyncio.Semaphore(DOWNLOAD_WORKERS)
+        tgs_data: Dict[str, bytes] = {}
 
         async def download_one(idx: int, sticker):
+            queued_at = time.perf_counter()
             async with sem_dl:
-                for attempt in range(3):
-                    if idx % 5 == 0:
-                        await feedback_msg.reply_text(f"⏳ Downloading .tgs {idx + 1}/{total}…")
-                    out_path = f"{tmp_dir}/{sticker.file_unique_id}.tgs"
-                    try:
-                        file = await bot.get_file(sticker.file_id)
-                        await download_to_drive_retry(file, out_path)
-                        logger.info(f"Downloaded {sticker.file_unique_id}.tgs")
-                        break
-                    except (RetryAfter, TimedOut) as e:
-                        wait_time = getattr(e, "retry_after", 60)
-                        await feedback_msg.reply_text(
-                            f"⚠️ Rate limited, waiting {wait_time}s (retry {attempt + 1}/3)…", parse_mode="Markdown"
-                        )
-                        await asyncio.sleep(wait_time)
-                    except Exception as ex:
-                        logger.error(f"Failed downloading {sticker.file_unique_id}: {ex}")
+                QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queued_at, stage="download")
+                sticker_span = job_span.group("sticker", file_unique_id=sticker.file_unique_id)
+                if idx % 5 == 0:
+                    await feedback_msg.reply_text(f"⏳ Downloading .tgs {idx + 1}/{total}…")
+                out_path = f"{tmp_dir}/{sticker.file_unique_id}.tgs"
+                try:
+                    with span("download", parent=sticker_span,
+                              queue_wait=round(time.perf_counter() - queued_at, 3)):
+                        tgs_data[sticker.file_unique_id] = await fetch_sticker(bot, sticker.file_id, out_path)
+                    logger.info(f"Downloaded {sticker.file_unique_id}.tgs")
+                except Exception as ex:
+                    logger.error(f"Failed downloading {sticker.file_unique_id}: {ex}")
 
         await asyncio.gather(
             *(download_one(i, st) for i, st in enumerate(animated))
@@ -184,35 +262,50 @@ async def process_set_export(
 
         # 打包 ZIP
         zip_path = f"{tmp_dir}/{sticker_set_name}_tgs.zip"
-        with zipfile.ZipFile(zip_path, "w") as zf:
+        with span("zip"), zipfile.ZipFile(zip_path, "w") as zf:
             for st in animated:
-                tgs_path = f"{tmp_dir}/{st.file_unique_id}.tgs"
-                if os.path.exists(tgs_path):
-                    zf.write(
-                        tgs_path,
-                        f"{sticker_set_name}/tgs/{st.file_unique_id}.tgs"
+                if st.file_unique_id in tgs_data:
+                    zf.writestr(
+                        f"{sticker_set_name}/tgs/{st.file_unique_id}.tgs",
+                        tgs_data[st.file_unique_id],
                     )
 
+        missing = [(idx, st.file_unique_id) for idx, st in enumerate(animated) if st.file_unique_id not in tgs_data]
+        if missing:
+            await feedback_msg.reply_text(missing_note(missing, total), parse_mode="Markdown")
         await feedback_msg.reply_text("📤 Sending .tgs ZIP…", parse_mode="Markdown")
-        await split_and_upload_document(
-            feedback_msg,
-            caption=(
-                f"✅ *Export Completed!*\n"
-                f"• Only `.tgs` files included.\n"
-                f"• Sticker set: `{sticker_set_name}`"
-            ),
-            zip_path=zip_path,
-            chunk_size=50_000_000,
-        )
+        with span("upload", bytes=os.path.getsize(zip_path)):
+            await split_and_upload_document(
+                feedback_msg,
+                caption=(
+                    (f"⚠️ *Export Completed, {len(missing)} of {total} missing.*\n" if missing
+                     else "✅ *Export Completed!*\n")
+                    + f"• Only `.tgs` files included.\n"
+                    f"• Sticker set: `{sticker_set_name}`"
+                ),
+                zip_path=zip_path,
+                chunk_size=50_000_000,
+            )
 
+    except asyncio.CancelledError as e:
+        logger.info(f"Job {job.job_id} canceled in process_set_export")
+        current_span().fail(e)
+        if job.timed_out:
+            await feedback_msg.reply_text("⏱️ *Job timed out and was stopped.*", parse_mode="Markdown")
+        else:
+            await feedback_msg.reply_text("🛑 *Job canceled.*", parse_mode="Markdown")
     except Exception as e:
         logger.error(f"Error in process_set_export: {e}")
+        current_span().fail(e)
         await feedback_msg.reply_text(f"❌ *Error:* `{e}`", parse_mode="Markdown")
     finally:
+        finish_job(job)
+        await _remove_cancel_button(progress_msg)
         if os.path.exists(tmp_dir):
             shutil.rmtree(tmp_dir, ignore_errors=True)
 
 
+@traced_job("single_sticker")
 async def process_single_sticker(
     bot,
     single_info: Dict[str, Any],
@@ -227,7 +320,8 @@ async def process_single_sticker(
     Download, convert, and package a single sticker; then send to user.
 
     :param bot: Telegram Bot instance.
-    :param single_info: Dict with keys `file_id`, `file_unique_id`, and `set_name`.
+    :param single_info: Dict with keys `file_id`, `file_unique_id`, `set_name` and
+                        `extension` (`tgs`, `webm` or `webp`; defaults to `tgs`).
     :param chosen_format: Desired output format (`gif`, `png`, `webp`, `apng`).
     :param quality: Conversion quality (percentage).
     :param width: Output width.
@@ -238,90 +332,106 @@ async def process_single_sticker(
     sticker_file_id = single_info["file_id"]
     unique_id = single_info["file_unique_id"]
     set_name = single_info["set_name"]
+    extension = single_info.get("extension", "tgs")
     user_id = feedback_msg.from_user.id
 
     tmp_dir = f"tmp/{set_name}-{user_id}-{unique_id}"
     os.makedirs(tmp_dir, exist_ok=True)
+    job = start_job(feedback_msg.chat_id)
+    progress_msg = None
+    current_span().set(
+        user_id=user_id, set_name=set_name, file_unique_id=unique_id,
+        format=chosen_format, quality=quality, size=f"{width}x{height}", fps=fps,
+    )
 
     try:
-        await feedback_msg.reply_text(
+        progress_msg = await feedback_msg.reply_text(
             f"🚀 *Processing* single sticker from `{set_name}`\n"
             f"**Format:** `{chosen_format.upper()}`\n"
             f"**Size:** `{width}×{height}`\n"
             f"**Quality:** `{quality}`%\n"
             f"**FPS:** `{fps}`",
             parse_mode="Markdown",
+            reply_markup=job.cancel_markup(),
         )
 
-        # 1) Download .tgs
+        # 1) Download the sticker file
         await feedback_msg.reply_text("📥 Downloading sticker…", parse_mode="Markdown")
-        tgs_path = f"{tmp_dir}/{unique_id}.tgs"
-        for attempt in range(3):
-            try:
-                file = await bot.get_file(sticker_file_id)
-                await download_to_drive_retry(file, tgs_path)
-                break
-            except (RetryAfter, TimedOut) as e:
-                wait_time = getattr(e, "retry_after", 60)
-                await feedback_msg.reply_text(
-                    f"⚠️ Rate limited, waiting {wait_time}s (retry {attempt+1}/3)…", parse_mode="Markdown"
-                )
-                await asyncio.sleep(wait_time)
-        if not os.path.exists(tgs_path):
-            await feedback_msg.reply_text("❌ Failed to download sticker.", parse_mode="Markdown")
-            return
+        source_path = f"{tmp_dir}/{unique_id}.{extension}"
+        with span("download"):
+            source_data = await fetch_sticker(
+                bot, sticker_file_id, source_path, on_retry=notify_retry(feedback_msg, "Download"),
+                file_unique_id=unique_id,
+            )
 
-        # 2) Convert using tgs_convert
+        # 2) Convert using convert_sticker
         await feedback_msg.reply_text(
             f"⚙️ Converting to {chosen_format.upper()}…", parse_mode="Markdown"
         )
-        out_path = f"{tmp_dir}/{unique_id}.{chosen_format}"
+        # Outputs get their own folder: a .webp sticker converted to WebP keeps its source.
+        os.makedirs(f"{tmp_dir}/{chosen_format}", exist_ok=True)
+        out_path = f"{tmp_dir}/{chosen_format}/{unique_id}.{chosen_format}"
         script_path = get_script_path(chosen_format)
-        await asyncio.to_thread(
-            tgs_convert,
-            tgs_path,
-            out_path,
-            width,
-            height,
-            fps,
-            quality,
-            script_path,
-        )
-        logger.info(f"Converted {unique_id}.tgs → {out_path}")
+        with span("convert"):
+            await convert_cached(
+                source_path,
+                out_path,
+                unique_id,
+                chosen_format,
+                quality,
+                width,
+                height,
+                fps,
+                script_path,
+                source_data,
+            )
+        logger.info(f"Converted {unique_id}.{extension} → {out_path}")
 
         # 3) Package into ZIP
         zip_path = f"{tmp_dir}/{set_name}_{unique_id}.zip"
-        with zipfile.ZipFile(zip_path, "w") as zf:
+        with span("zip"), zipfile.ZipFile(zip_path, "w") as zf:
             zf.write(
                 out_path,
                 f"{set_name}/{chosen_format}/{unique_id}.{chosen_format}"
             )
-            zf.write(
-                tgs_path,
-                f"{set_name}/tgs/{unique_id}.tgs"
+            zip_source(
+                zf, source_path, source_data,
+                f"{set_name}/{source_folder(extension, chosen_format)}/{unique_id}.{extension}"
             )
 
         # 4) Send ZIP
         await feedback_msg.reply_text("📤 Uploading file…", parse_mode="Markdown")
-        await split_and_upload_document(
-            feedback_msg,
-            caption=(
-                f"✅ *Task Completed!*\n"
-                f"• *Credits:* {BOT_USER_NAME}\n"
-                f"• [Add Stickers to Telegram](https://t.me/addstickers/{set_name})"
-            ),
-            zip_path=zip_path,
-            chunk_size=50_000_000,
-        )
+        with span("upload", bytes=os.path.getsize(zip_path)):
+            await split_and_upload_document(
+                feedback_msg,
+                caption=(
+                    f"✅ *Task Completed!*\n"
+                    f"• *Credits:* {BOT_USER_NAME}\n"
+                    f"• [Add Stickers to Telegram](https://t.me/addstickers/{set_name})"
+                ),
+                zip_path=zip_path,
+                chunk_size=50_000_000,
+            )
 
+    except asyncio.CancelledError as e:
+        logger.info(f"Job {job.job_id} canceled in process_single_sticker")
+        current_span().fail(e)
+        if job.timed_out:
+            await feedback_msg.reply_text("⏱️ *Job timed out and was stopped.*", parse_mode="Markdown")
+        else:
+            await feedback_msg.reply_text("🛑 *Job canceled.*", parse_mode="Markdown")
     except Exception as e:
         logger.error(f"Error in process_single_sticker: {e}")
+        current_span().fail(e)
         await feedback_msg.reply_text(f"❌ *Error:* `{e}`", parse_mode="Markdown")
     finally:
+        finish_job(job)
+        await _remove_cancel_button(progress_msg)
         if os.path.exists(tmp_dir):
             shutil.rmtree(tmp_dir, ignore_errors=True)
 
 
+@traced_job("sticker_set")
 async def process_sticker_set(
     bot,
     sticker_set,
@@ -332,7 +442,8 @@ async def process_sticker_set(
     height: int,
     fps: int,
     feedback_msg,
-) -> None:
+    skip_ids: Collection[str] = (),
+) -> List[str]:
     """
     Download, convert, and package an entire sticker set; then send to user.
 
@@ -345,124 +456,302 @@ async def process_sticker_set(
     :param height: Output height.
     :param fps: Frame rate for conversion.
     :param feedback_msg: Telegram message object to reply to.
+    :param skip_ids: `file_unique_id`s to leave out, for a delta export of the stickers
+                     added since an earlier one.
+    :return: `file_unique_id`s of the stickers delivered converted (empty if the job or the
+             upload failed).
+    """
+    current_span().set(set_name=sticker_set_name, delta=bool(skip_ids))
+    stickers = [
+        {"file_id": st.file_id, "file_unique_id": st.file_unique_id, "extension": sticker_extension(st)}
+        for st in sticker_set.stickers
+        if st.file_unique_id not in skip_ids
+    ]
+    return await _convert_stickers(
+        bot, stickers, sticker_set_name, chosen_format, quality, width, height, fps, feedback_msg,
+        set_link=True, delta=bool(skip_ids),
+    )
+
+
+@traced_job("sticker_batch")
+async def process_sticker_batch(
+    bot,
+    stickers: List[Dict[str, Any]],
+    chosen_format: str,
+    quality: int,
+    width: int,
+    height: int,
+    fps: int,
+    feedback_msg,
+) -> None:
+    """
+    Download, convert, and package stickers sent together as one batch; then send to user.
+
+    :param bot: Telegram Bot instance.
+    :param stickers: Dicts with keys `file_id`, `file_unique_id` and `extension`.
+    :param chosen_format: Desired output format (`gif`, `png`, `webp`, `apng`).
+    :param quality: Conversion quality (percentage).
+    :param width: Output width.
+    :param height: Output height.
+    :param fps: Frame rate for conversion.
+    :param feedback_msg: Telegram message object to reply to.
+    """
+    # The same sticker sent twice is converted once.
+    unique = list({st["file_unique_id"]: st for st in stickers}.values())
+    await _convert_stickers(
+        bot, unique, "stickers", chosen_format, quality, width, height, fps, feedback_msg,
+        set_link=False,
+    )
+
+
+async def _convert_stickers(
+    bot,
+    stickers: List[Dict[str, Any]],
+    archive_name: str,
+    chosen_format: str,
+    quality: int,
+    width: int,
+    height: int,
+    fps: int,
+    feedback_msg,
+    set_link: bool,
+    delta: bool = False,
+) -> List[str]:
+    """
+    Download, convert and ZIP a list of stickers in one job; then send the ZIP to the user.
+
+    :param bot: Telegram Bot instance.
+    :param stickers: Dicts with keys `file_id`, `file_unique_id` and `extension`.
+    :param archive_name: Name of the ZIP and of its top-level folder (the set name for sets).
+    :param chosen_format: Desired output format (`gif`, `png`, `webp`, `apng`).
+    :param quality: Conversion quality (percentage).
+    :param width: Output width.
+    :param height: Output height.
+    :param fps: Frame rate for conversion.
+    :param feedback_msg: Telegram message object to reply to.
+    :param set_link: Add a link to the sticker set `archive_name` to the caption.
+    :param delta: The stickers are only those added since an earlier export (noted in the caption).
+    :return: `file_unique_id`s of the stickers delivered converted (empty if the job or the
+             upload failed).
     """
     user_id = feedback_msg.from_user.id
-    tmp_dir = f"tmp/{sticker_set_name}-{user_id}"
+    job = start_job(feedback_msg.chat_id)
+    tmp_dir = f"tmp/{archive_name}-{user_id}-{job.job_id}"
     os.makedirs(tmp_dir, exist_ok=True)
+    progress_msg = None
+    job_span = current_span()
+    job_span.set(
+        user_id=user_id,
+        format=chosen_format, quality=quality, size=f"{width}x{height}", fps=fps,
+    )
+    sticker_spans = {}
 
     try:
-        await feedback_msg.reply_text(
-            f"🚀 *Processing* `{sticker_set_name}`\n"
+        progress_msg = await feedback_msg.reply_text(
+            f"🚀 *Processing* `{archive_name}`\n"
             f"**Format:** `{chosen_format.upper()}`\n"
             f"**Size:** `{width}×{height}`\n"
             f"**Quality:** `{quality}`%\n"
             f"**FPS:** `{fps}`",
             parse_mode="Markdown",
+            reply_markup=job.cancel_markup(),
         )
 
-        # 1) Download all .tgs
-        animated = [s for s in sticker_set.stickers if s.is_animated]
-        total = len(animated)
-        if not animated:
-            await feedback_msg.reply_text("ℹ️ No animated stickers found in this set.")
-            return
+        # 1) Download all sticker files
+        total = len(stickers)
+        if not stickers:
+            await feedback_msg.reply_text("ℹ️ No stickers found in this set.")
+            return []
+        job_span.set(stickers=total)
+        extensions = {st["file_unique_id"]: st["extension"] for st in stickers}
+        for st in stickers:
+            sticker_spans[st["file_unique_id"]] = job_span.group("sticker", file_unique_id=st["file_unique_id"])
 
         await feedback_msg.reply_text(
-            f"📥 Downloading `{sticker_set_name}` ({total} total)…\n_Downloading .tgs files…_",
+            f"📥 Downloading `{archive_name}` ({total} total)…\n_Downloading sticker files…_",
             parse_mode="Markdown"
         )
 
         sem_dl = asyncio.Semaphore(DOWNLOAD_WORKERS)
+        # file_unique_id -> content of stickers kept in memory (see fetch_sticker), None for
+        # stickers on disk; stickers that failed to download are missing.
+        source_data: Dict[str, Optional[bytes]] = {}
 
         async def download_one(idx: int, sticker):
+            unique_id = sticker["file_unique_id"]
+            queued_at = time.perf_counter()
             async with sem_dl:
+                QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queued_at, stage="download")
                 if idx % 5 == 0:
                     await feedback_msg.reply_text(f"⏳ Downloading sticker {idx + 1}/{total}…")
-                out_path = f"{tmp_dir}/{sticker.file_unique_id}.tgs"
-                for attempt in range(3):
-                    try:
-                        file = await get_file_retry(bot,sticker.file_id)
-                        await download_to_drive_retry(file, out_path)
-                        logger.info(f"Downloaded {sticker.file_unique_id}.tgs")
-                        break
-                    except (RetryAfter, TimedOut) as e:
-                        wait_time = getattr(e, "retry_after", 60)
-                        await feedback_msg.reply_text(
-                            f"⚠️ Rate limited, waiting {wait_time}s (retry {attempt + 1}/3)…", parse_mode="Markdown"
+                extension = extensions[unique_id]
+                out_path = f"{tmp_dir}/{unique_id}.{extension}"
+                try:
+                    with span("download", parent=sticker_spans[unique_id],
+                              queue_wait=round(time.perf_counter() - queued_at, 3)):
+                        source_data[unique_id] = await fetch_sticker(
+                            bot, sticker["file_id"], out_path, file_unique_id=unique_id
                         )
-                        await asyncio.sleep(wait_time)
-                    except Exception as ex:
-                        logger.error(f"Failed downloading {sticker.file_unique_id}: {ex}")
+                    logger.info(f"Downloaded {unique_id}.{extension}")
+                except Exception as ex:
+                    logger.error(f"Failed downloading {unique_id}: {ex}")
 
         await asyncio.gather(
-            *(download_one(i, st) for i, st in enumerate(animated))
+            *(download_one(i, st) for i, st in enumerate(stickers))
         )
 
-        # 2) Convert each .tgs concurrently
+        # 2) Convert each sticker concurrently
         await feedback_msg.reply_text(
-            f"⚙️ Converting `{sticker_set_name}` to {chosen_format.upper()}…", parse_mode="Markdown"
+            f"⚙️ Converting `{archive_name}` to {chosen_format.upper()}…", parse_mode="Markdown"
         )
         script_path = get_script_path(chosen_format)
+        # Outputs get their own folder: a .webp sticker converted to WebP keeps its source.
+        os.makedirs(f"{tmp_dir}/{chosen_format}", exist_ok=True)
         sem_conv = asyncio.Semaphore(CONVERT_WORKERS)
 
+        def estimate(unique_id: str) -> float:
+            if result_cache.contains(result_cache.cache_key(unique_id, chosen_format, quality, width, height, fps)):
+                return 0.0
+            return estimate_units(
+                f"{tmp_dir}/{unique_id}.{extensions[unique_id]}", width, height, fps, source_data[unique_id]
+            )
+
+        # Stickers with the same content (see `result_cache.content_id`) are converted once;
+        # file_unique_id -> file_unique_id of the sticker whose output is copied.
+        duplicate_of: Dict[str, str] = {}
+        first_by_content: Dict[str, str] = {}
+        for unique_id in source_data:
+            first = first_by_content.setdefault(result_cache.content_id(unique_id), unique_id)
+            if first != unique_id:
+                duplicate_of[unique_id] = first
+        if duplicate_of:
+            job_span.set(duplicates=len(duplicate_of))
+
+        units = await asyncio.to_thread(
+            lambda: {unique_id: estimate(unique_id) for unique_id in source_data if unique_id not in duplicate_of}
+        )
+        # file_unique_id -> predicted seconds of the conversions not finished yet
+        pending = {
+            unique_id: predict_seconds(extensions[unique_id], chosen_format, unique_units)
+            for unique_id, unique_units in units.items()
+        }
+        job.predicted_seconds = sum(pending.values())
+        # Longest first, so that no long conversion is started last and runs on alone.
+        ordered = sorted(
+            (st for st in stickers if st["file_unique_id"] in units),
+            key=lambda st: pending[st["file_unique_id"]], reverse=True,
+        )
+
         async def convert_one(idx: int, sticker_obj):
+            unique_id = sticker_obj["file_unique_id"]
+            queued_at = time.perf_counter()
             async with sem_conv:
+                QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queued_at, stage="convert")
                 if idx % 5 == 0:
-                    await feedback_msg.reply_text(f"⏳ Converting sticker {idx + 1}/{total}…")
-                in_tgs = f"{tmp_dir}/{sticker_obj.file_unique_id}.tgs"
-                out_img = f"{tmp_dir}/{sticker_obj.file_unique_id}.{chosen_format}"
-                await asyncio.to_thread(
-                    tgs_convert,
-                    in_tgs,
-                    out_img,
-                    width,
-                    height,
-                    fps,
-                    quality,
-                    script_path,
-                )
-                logger.info(f"Converted {sticker_obj.file_unique_id}.tgs → {out_img}")
+                    eta = format_eta(eta_seconds(pending.values(), CONVERT_WORKERS))
+                    await feedback_msg.reply_text(f"⏳ Converting sticker {idx + 1}/{total}… {eta} left")
+                extension = extensions[unique_id]
+                in_path = f"{tmp_dir}/{unique_id}.{extension}"
+                out_img = f"{tmp_dir}/{chosen_format}/{unique_id}.{chosen_format}"
+                try:
+                    with span("convert", parent=sticker_spans[unique_id],
+                              queue_wait=round(time.perf_counter() - queued_at, 3)):
+                        await convert_cached(
+                            in_path,
+                            out_img,
+                            unique_id,
+                            chosen_format,
+                            quality,
+                            width,
+                            height,
+                            fps,
+                            script_path,
+                            source_data.get(unique_id),
+                            units[unique_id],
+                        )
+                    logger.info(f"Converted {unique_id}.{extension} → {out_img}")
+                except Exception as ex:
+                    # Like a failed download: the sticker is left out and listed as missing.
+                    sticker_spans[unique_id].fail(ex)
+                    logger.error(f"Failed converting {unique_id}.{extension}: {ex}")
+                    if os.path.isdir(out_img):
+                        shutil.rmtree(out_img, ignore_errors=True)
+                    elif os.path.exists(out_img):
+                        os.remove(out_img)
+                finally:
+                    pending.pop(unique_id)
+                    job.predicted_seconds = sum(pending.values())
 
         await asyncio.gather(
-            *(convert_one(i, st) for i, st in enumerate(animated))
+            *(convert_one(i, st) for i, st in enumerate(ordered))
         )
-
-        # 3) Package all converted files plus original .tgs
+        for unique_id, first in duplicate_of.items():
+            first_img = f"{tmp_dir}/{chosen_format}/{first}.{chosen_format}"
+            out_img = f"{tmp_dir}/{chosen_format}/{unique_id}.{chosen_format}"
+            if os.path.isdir(first_img):
+                shutil.copytree(first_img, out_img)
+            elif os.path.exists(first_img):
+                shutil.copyfile(first_img, out_img)
+
+        # 3) Package all converted files plus the original sticker files
         await feedback_msg.reply_text("📦 Zipping up results…", parse_mode="Markdown")
-        zip_path = f"{tmp_dir}/{sticker_set_name}.zip"
-        with zipfile.ZipFile(zip_path, "w") as zf:
-            for sticker_obj in animated:
-                img_path = f"{tmp_dir}/{sticker_obj.file_unique_id}.{chosen_format}"
-                tgs_path = f"{tmp_dir}/{sticker_obj.file_unique_id}.tgs"
+        zip_path = f"{tmp_dir}/{archive_name}{'_new' if delta else ''}.zip"
+        converted = []
+        with span("zip"), zipfile.ZipFile(zip_path, "w") as zf:
+            for sticker_obj in stickers:
+                unique_id = sticker_obj["file_unique_id"]
+                extension = extensions[unique_id]
+                img_path = f"{tmp_dir}/{chosen_format}/{unique_id}.{chosen_format}"
+                src_path = f"{tmp_dir}/{unique_id}.{extension}"
                 if os.path.exists(img_path):
                     zf.write(
                         img_path,
-                        f"{sticker_set_name}/{chosen_format}/{sticker_obj.file_unique_id}.{chosen_format}"
-                    )
-                if os.path.exists(tgs_path):
-                    zf.write(
-                        tgs_path,
-                        f"{sticker_set_name}/tgs/{sticker_obj.file_unique_id}.tgs"
+                        f"{archive_name}/{chosen_format}/{unique_id}.{chosen_format}"
                     )
+                    converted.append(unique_id)
+                zip_source(
+                    zf, src_path, source_data.get(unique_id),
+                    f"{archive_name}/{source_folder(extension, chosen_format)}/{unique_id}.{extension}"
+                )
 
         # 4) Upload ZIP
+        missing = [(idx, st["file_unique_id"]) for idx, st in enumerate(stickers)
+                   if st["file_unique_id"] not in converted]
+        if missing:
+            await feedback_msg.reply_text(missing_note(missing, total), parse_mode="Markdown")
         await feedback_msg.reply_text(
-            f"📤 Uploading ZIP for `{sticker_set_name}` now…", parse_mode="Markdown"
-        )
-        await split_and_upload_document(
-            feedback_msg,
-            caption=(
-                f"✅ *Task Completed!*\n"
-                f"• *Credits:* {BOT_USER_NAME}"
-                f"• [Add Stickers to Telegram](https://t.me/addstickers/{sticker_set_name})"
-            ),
-            zip_path=zip_path,
-            chunk_size=50_000_000,
+            f"📤 Uploading ZIP for `{archive_name}` now…", parse_mode="Markdown"
         )
-
+        with span("upload", bytes=os.path.getsize(zip_path)):
+            delivered = await split_and_upload_document(
+                feedback_msg,
+                caption=(
+                    (f"⚠️ *Task Completed, {len(missing)} of {total} missing.*\n" if missing
+                     else "✅ *Task Completed!*\n")
+                    + f"• *Credits:* {BOT_USER_NAME}"
+                    + (f"\n• Only the {len(converted)} stickers new since your last export." if delta else "")
+                    + (f"\n• [Add Stickers to Telegram](https://t.me/addstickers/{archive_name})" if set_link else "")
+                ),
+                zip_path=zip_path,
+                chunk_size=50_000_000,
+            )
+        # Stickers count as exported only once the user actually has the archive.
+        return converted if delivered else []
+
+    except asyncio.CancelledError as e:
+        logger.info(f"Job {job.job_id} canceled while converting {archive_name}")
+        current_span().fail(e)
+        if job.timed_out:
+            await feedback_msg.reply_text("⏱️ *Job timed out and was stopped.*", parse_mode="Markdown")
+        else:
+            await feedback_msg.reply_text("🛑 *Job canceled.*", parse_mode="Markdown")
     except Exception as e:
-        logger.error(f"Error in process_sticker_set: {e}")
+        logger.error(f"Error converting {archive_name}: {e}")
+        current_span().fail(e)
         await feedback_msg.reply_text(f"❌ *Error:* `{e}`", parse_mode="Markdown")
     finally:
+        finish_job(job)
+        await _remove_cancel_button(progress_msg)
         if os.path.exists(tmp_dir):
-            shutil.rmtree(tmp_dir, ignore_errors=True)
\ No newline at end of file
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return []
\ No newline at end of file
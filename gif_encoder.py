@@ -0,0 +1,209 @@
+"""
+GIF encoder tuned for rendered Lottie frames.
+
+Vector stickers are flat-colored and often hold still, so instead of quantizing every
+frame on its own this encoder:
+
+- computes one global palette from a sample of frames,
+- stores each frame as the rectangle that changed since the previous one, with unchanged
+  pixels left transparent so they compress to almost nothing,
+- merges identical consecutive frames into one frame with a longer delay.
+
+Used by `encode_frames.py`.
+"""
+from typing import Iterator, List, Optional, Tuple
+
+from PIL import GifImagePlugin, Image, ImageChops, ImageStat
+
+TRANSPARENT = 255
+ALPHA_THRESHOLD = 128
+PALETTE_SAMPLES = 12
+# Most viewers clamp GIF delays below 2/100 s, so faster frames are dropped instead.
+MIN_DELAY_MS = 20
+
+DISPOSE_NONE = 1
+DISPOSE_BACKGROUND = 2
+
+
+def _select_frames(frames: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    """
+    Drop frames so no delay falls below `MIN_DELAY_MS`, keeping the total duration.
+
+    :param frames: List of (frame path, duration in ms).
+    :return: The kept frames with their new durations.
+    """
+    kept = []
+    last_start = None
+    start = 0.0
+    for path, duration in frames:
+        if last_start is None or start - last_start >= MIN_DELAY_MS - 1e-6:
+            kept.append((path, start))
+            last_start = start
+        start += duration
+    ends = [s for _, s in kept[1:]] + [start]
+    return [(path, end - s) for (path, s), end in zip(kept, ends)]
+
+
+def _opaque_mask(frame: Image.Image) -> Image.Image:
+    return frame.getchannel("A").point(lambda a: 255 if a >= ALPHA_THRESHOLD else 0)
+
+
+def build_palette(paths: List[str], colors: int = 255) -> Image.Image:
+    """
+    Build one palette for the whole animation from a sample of its frames.
+
+    Index `TRANSPARENT` is kept free; unused entries repeat entry 0 so nearest-color
+    lookups never pick them.
+
+    :param paths: Frame paths (PNG, RGBA).
+    :param colors: Number of opaque colors (at most 255).
+    :return: A "P" image carrying the palette.
+    """
+    step = max(1, len(paths) // PALETTE_SAMPLES)
+    samples = []
+    for path in paths[::step][:PALETTE_SAMPLES]:
+        with Image.open(path) as im:
+            frame = im.convert("RGBA")
+        mask = _opaque_mask(frame)
+        if mask.getbbox() is None:
+            continue
+        rgb = frame.convert("RGB")
+        # Fill transparent areas with the mean opaque color so they don't claim palette entries.
+        fill = tuple(int(c) for c in ImageStat.Stat(rgb, mask).mean)
+        samples.append(Image.composite(rgb, Image.new("RGB", rgb.size, fill), mask))
+
+    if not samples:
+        samples = [Image.new("RGB", (1, 1))]
+    montage = Image.new("RGB", (sum(s.width for s in samples), max(s.height for s in samples)))
+    x = 0
+    for s in samples:
+        montage.paste(s, (x, 0))
+        x += s.width
+
+    quantized = montage.quantize(colors=max(2, min(colors, 255)), method=Image.Quantize.MEDIANCUT)
+    palette = quantized.getpalette()[: 255 * 3]
+    palette += palette[:3] * (256 - len(palette) // 3)
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette)
+    return palette_image
+
+
+def _index_frame(path: str, palette_image: Image.Image) -> Image.Image:
+    """
+    Map a frame onto the global palette; returns palette indices as an "L" image.
+    """
+    with Image.open(path) as im:
+        frame = im.convert("RGBA")
+    indexed = frame.convert("RGB").quantize(palette=palette_image, dither=Image.Dither.NONE)
+    indexed.paste(TRANSPARENT, mask=ImageChops.invert(_opaque_mask(frame)))
+    return Image.frombytes("L", indexed.size, indexed.tobytes())
+
+
+def _unique_frames(frames: List[Tuple[str, float]], palette_image: Image.Image) -> Iterator[Tuple[Image.Image, float]]:
+    """
+    Yield (indexed frame, duration ms), merging runs of frames identical after quantization.
+    """
+    pending = None
+    pending_bytes = None
+    duration = 0.0
+    for path, frame_ms in _select_frames(frames):
+        frame = _index_frame(path, palette_image)
+        data = frame.tobytes()
+        if pending is not None and data == pending_bytes:
+            duration += frame_ms
+            continue
+        if pending is not None:
+            yield pending, duration
+        pending, pending_bytes, duration = frame, data, frame_ms
+    if pending is not None:
+        yield pending, duration
+
+
+def _opaque_bbox(frame: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    return frame.point(lambda v: 0 if v == TRANSPARENT else 255).getbbox()
+
+
+def _erases(prev: Image.Image, cur: Image.Image) -> bool:
+    """
+    True if a pixel opaque in `prev` is transparent in `cur`, which a delta frame can't express.
+    """
+    prev_opaque = prev.point(lambda v: 0 if v == TRANSPARENT else 255)
+    cur_transparent = cur.point(lambda v: 255 if v == TRANSPARENT else 0)
+    return ImageChops.multiply(prev_opaque, cur_transparent).getbbox() is not None
+
+
+def _union(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def encode_gif(frames: List[Tuple[str, float]], output: str, quality: int = 90) -> None:
+    """
+    Encode rendered frames into an animated GIF.
+
+    :param frames: List of (frame PNG path, duration in ms) in display order.
+    :param output: Output GIF path.
+    :param quality: 1-100, scales the number of palette colors.
+    :raises ValueError: If there are no frames.
+    """
+    if not frames:
+        raise ValueError("No frames to encode")
+    frame_paths = [path for path, _ in frames]
+    palette_image = build_palette(frame_paths, colors=round(255 * max(1, min(quality, 100)) / 100))
+    palette = palette_image.getpalette()
+
+    with Image.open(frame_paths[0]) as first:
+        size = first.size
+    canvas = Image.new("P", size, TRANSPARENT)
+    canvas.putpalette(palette)
+    header, _ = GifImagePlugin.getheader(
+        canvas, info={"loop": 0, "transparency": TRANSPARENT, "background": TRANSPARENT, "optimize": False}
+    )
+
+    unique = _unique_frames(frames, palette_image)
+    prev = None
+    cleared = True
+    elapsed_ms = 0.0
+    written_cs = 0
+    current = next(unique, None)
+    with open(output, "wb") as f:
+        for chunk in header:
+            f.write(chunk)
+        while current is not None:
+            frame, duration = current
+            following = next(unique, None)
+
+            if cleared:
+                pixels = frame
+                rect = _opaque_bbox(frame)
+            else:
+                changed = ImageChops.difference(prev, frame).point(lambda v: 255 if v else 0)
+                pixels = Image.new("L", size, TRANSPARENT)
+                pixels.paste(frame, mask=changed)
+                rect = changed.getbbox()
+
+            # The next frame removes pixels: cover everything visible and clear it afterwards.
+            cleared = following is not None and _erases(frame, following[0])
+            if cleared:
+                rect = _union(rect, _opaque_bbox(frame))
+            rect = rect or (0, 0, 1, 1)
+
+            elapsed_ms += duration
+            delay_cs = round(elapsed_ms / 10) - written_cs
+            written_cs += delay_cs
+
+            tile = Image.frombytes("P", (rect[2] - rect[0], rect[3] - rect[1]), pixels.crop(rect).tobytes())
+            tile.putpalette(palette)
+            for chunk in GifImagePlugin.getdata(
+                tile, offset=rect[:2], duration=delay_cs * 10, transparency=TRANSPARENT,
+                disposal=DISPOSE_BACKGROUND if cleared else DISPOSE_NONE,
+            ):
+                f.write(chunk)
+
+            prev = frame
+            current = following
+        f.write(b";")
+
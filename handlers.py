@@ -1,8 +1,11 @@
 """
 Telegram bot command and callback handlers.
 """
+import asyncio
 import re
+import time
 import traceback
+from typing import Dict, List, Optional
 
 from loguru import logger
 from telegram import Update, Sticker, InlineKeyboardButton, InlineKeyboardMarkup, LinkPreviewOptions
@@ -10,7 +13,14 @@ from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
 from config import load_config
-from exporter import process_single_export, process_set_export, process_single_sticker, process_sticker_set
+from decoders import sticker_extension
+from exporter import (
+    process_single_export, process_set_export, process_single_sticker, process_sticker_batch, process_sticker_set
+)
+from jobs import cancel_job
+from preset import DEFAULT_PRESET, Preset
+from prewarm import record_request
+from sessions import export_history, presets, sessions
 
 # Constants and options for buttons
 FORMAT_OPTIONS = [
@@ -33,6 +43,34 @@ SIZE_OPTIONS = [
 ]
 FPS_OPTIONS = [12, 24, 30, 60, 90, 100]
 
+_batch_conf = load_config().get("batch", {})
+# Stickers a user sends within this many seconds of each other become one batch (0 = off).
+BATCH_WINDOW = _batch_conf.get("window", 2)
+BATCH_MAX_STICKERS = _batch_conf.get("max_stickers", 50)
+# Seconds between edits of a growing batch's menu, so a burst of stickers is one edit.
+MENU_EDIT_INTERVAL = 1
+
+
+class _Batch:
+    """
+    Stickers a user sent in a row and the menu message offered for them.
+    """
+
+    def __init__(self, sticker: Dict[str, str]):
+        self.stickers = [sticker]
+        self.last_at = time.monotonic()
+        # The menu message, once sent.
+        self.menu = None
+        self.edit_task: Optional[asyncio.Task] = None
+        self.expiry: Optional[asyncio.TimerHandle] = None
+
+    def accepts_more(self) -> bool:
+        return time.monotonic() - self.last_at <= BATCH_WINDOW and len(self.stickers) < BATCH_MAX_STICKERS
+
+
+# user_id -> batch still within the window
+_batches: Dict[int, _Batch] = {}
+
 
 def build_button_grid(options, prefix: str, columns: int = 2) -> InlineKeyboardMarkup:
     """
@@ -57,16 +95,52 @@ def build_button_grid(options, prefix: str, columns: int = 2) -> InlineKeyboardM
     return InlineKeyboardMarkup(btns)
 
 
+def build_fps_grid(prefix: str) -> InlineKeyboardMarkup:
+    """
+    Build the FPS buttons (3 per row) with callback data `{prefix}_{fps}`.
+    """
+    btns, row = [], []
+    for fps in FPS_OPTIONS:
+        cb = f"{prefix}_{fps}"
+        label = f"⚡ {fps} fps"
+        row.append(InlineKeyboardButton(label, callback_data=cb))
+        if len(row) == 3:
+            btns.append(row)
+            row = []
+    if row:
+        btns.append(row)
+    btns.append([InlineKeyboardButton("❌ Cancel", callback_data=f"{prefix}_cancel")])
+    return InlineKeyboardMarkup(btns)
+
+
+async def build_preset_rows(user_id: int, prefix: str):
+    """
+    One-tap conversion buttons: last used settings (or the default preset) and saved presets.
+
+    :param user_id: Telegram user ID.
+    :param prefix: Callback prefix of the last menu step (`single_fps` or `set_fps`).
+    :return: Keyboard rows, one button each.
+    """
+    last = await presets.last(user_id)
+    first = last or DEFAULT_PRESET
+    label = f"🔁 Repeat: {first.label()}" if last else f"⚡ {first.label()}"
+    rows = [[InlineKeyboardButton(label, callback_data=first.callback_data(prefix))]]
+    for preset in await presets.saved(user_id):
+        if preset != first:
+            rows.append([InlineKeyboardButton(f"⭐ {preset.label()}", callback_data=preset.callback_data(prefix))])
+    return rows
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handle the /start command: send a welcome message.
     """
     welcome_text = (
         "👋 **Hello!**\n\n"
-        "I can convert your animated stickers into various image formats. 🎉\n\n"
+        "I can convert your stickers into various image formats. 🎉\n\n"
         "• Send me a sticker and I will guide you through format, quality, size.\n"
         "• Or send `sticker set link` to convert an entire sticker set.\n"
-        "• Only `animated stickers` are supported.\n\n"
+        "• Animated, video and static stickers are supported.\n\n"
         "🔗 *Source on* [GitHub](https://github.com/SwaggyMacro/TgStoGifBot)"
     )
     await update.message.reply_text(welcome_text, parse_mode=ParseMode.MARKDOWN)
@@ -78,16 +152,18 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     """
     help_text = (
         "❓ *How to use*\n\n"
-        "1. 📥 Send me an *animated sticker*, and I’ll ask you to pick:\n"
+        "1. 📥 Send me a *sticker*, and I’ll ask you to pick:\n"
         "   • Step 1: *Action* (Export as .tgs, Convert to another format)\n"
         "   • Step 2: *Format* (GIF, PNG, WebP, APNG)\n"
         "   • Step 3: *Quality* (100%, 90%, 70%, 50%)\n"
         "   • Step 4: *Size* (64×64, 128×128, 256×256, 512×512)\n"
-        "   • Step 5: *FPS* (12, 24, 30, 60, 90, 100)\n\n"
+        "   • Step 5: *FPS* (12, 24, 30, 60, 90, 100)\n"
+        "   • Or tap a *preset* button to convert in one step.\n\n"
+        "   • Several stickers sent in a row are converted together into one ZIP.\n\n"
         "2. 📦 Please send a link of sticker set, e.g.:\n`https://t.me/addstickers/GumLoveIs`\n"
         "   • After sending `<sticker set link>`, I’ll guide you through the same steps.\n\n"
         "🗃️ If the sticker sets are *too many*(may *causes error*, like [AnimatedEmojies](https://t.me/addstickers/AnimatedEmojies)), You should export sticker sets as `.tgs` files, and use this tool [lottie-converter](https://github.com/ed-asriyan/lottie-converter) to batch convert them to images(I prefer the docker way).\n\n"
-        "*Only animated stickers are supported.*"
+        "*Animated, video and static stickers can be converted; only animated ones can be exported as `.tgs`.*"
     )
     await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN,
                                     link_preview_options=LinkPreviewOptions(is_disabled=True))
@@ -107,38 +183,115 @@ async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def sticker_to_gif(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Handle incoming sticker: if animated, prompt for export or convert.
+    Handle incoming sticker: reply with the menu for it at once. Stickers that follow within
+    the batch window join it, and the menu is edited into one for the whole batch.
     """
     try:
         sticker: Sticker = update.message.sticker
-        if not sticker.is_animated:
-            await update.message.reply_text(
-                "⚠️ Only `animated stickers` are supported.", parse_mode=ParseMode.MARKDOWN
-            )
-            return
-
-        context.user_data["single_sticker_info"] = {
+        user_id = update.effective_user.id
+        info = {
             "file_id": sticker.file_id,
             "file_unique_id": sticker.file_unique_id,
             "set_name": sticker.set_name or "no_set_name",
+            "extension": sticker_extension(sticker),
         }
 
-        btns = [
-            [
-                InlineKeyboardButton("📁 Export .tgs", callback_data="single_action_export"),
-                InlineKeyboardButton("🖼️ Convert", callback_data="single_action_convert"),
-            ],
-            [InlineKeyboardButton("❌ Cancel", callback_data="single_action_cancel")]
-        ]
-        keyboard = InlineKeyboardMarkup(btns)
-        await update.message.reply_text(
-            "❓ *Please Choose:*", parse_mode=ParseMode.MARKDOWN, reply_markup=keyboard
-        )
+        batch = _batches.get(user_id)
+        if batch is not None and batch.accepts_more():
+            batch.stickers.append(info)
+            batch.last_at = time.monotonic()
+            await _offer_stickers(user_id, batch)
+            _schedule_menu_edit(user_id, batch)
+            return
+
+        batch = _Batch(info)
+        if BATCH_WINDOW:
+            _batches[user_id] = batch
+            batch.expiry = asyncio.get_running_loop().call_later(BATCH_WINDOW, _expire_batch, user_id, batch)
+        await _offer_stickers(user_id, batch)
+        text, markup = await sticker_menu(user_id, batch.stickers)
+        batch.menu = await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+        if len(batch.stickers) > 1:
+            # More stickers arrived while the menu was being sent.
+            _schedule_menu_edit(user_id, batch)
     except Exception as e:
         logger.error(f"Error in sticker_to_gif: {e}")
         await update.message.reply_text(f"❌ *Error:* `{e}`", parse_mode=ParseMode.MARKDOWN)
 
 
+def _expire_batch(user_id: int, batch: _Batch) -> None:
+    if _batches.get(user_id) is not batch:
+        return
+    remaining = batch.last_at + BATCH_WINDOW - time.monotonic()
+    if remaining > 0:
+        # Stickers kept arriving; check again once the window after the last one has passed.
+        batch.expiry = asyncio.get_running_loop().call_later(remaining, _expire_batch, user_id, batch)
+    else:
+        del _batches[user_id]
+
+
+def _close_batch(user_id: int) -> None:
+    """
+    Stop adding stickers to the user's batch, e.g. once they picked an action in its menu.
+    """
+    batch = _batches.pop(user_id, None)
+    if batch is None:
+        return
+    if batch.expiry is not None:
+        batch.expiry.cancel()
+    if batch.edit_task is not None:
+        batch.edit_task.cancel()
+
+
+async def _offer_stickers(user_id: int, batch: _Batch) -> None:
+    # Record in the session what the menu's buttons act on.
+    if len(batch.stickers) == 1:
+        await sessions.update(user_id, **batch.stickers[0], batch=None)
+    else:
+        await sessions.update(user_id, file_id=None, file_unique_id=None, set_name=None, extension=None,
+                              batch=list(batch.stickers))
+
+
+def _schedule_menu_edit(user_id: int, batch: _Batch) -> None:
+    if batch.menu is not None and batch.edit_task is None:
+        batch.edit_task = asyncio.create_task(_edit_batch_menu(user_id, batch))
+
+
+async def _edit_batch_menu(user_id: int, batch: _Batch) -> None:
+    await asyncio.sleep(MENU_EDIT_INTERVAL)
+    # Stickers arriving from here on schedule another edit.
+    batch.edit_task = None
+    text, markup = await sticker_menu(user_id, batch.stickers)
+    try:
+        await batch.menu.edit_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    except Exception as e:
+        logger.error(f"Error updating sticker menu: {e}")
+
+
+async def sticker_menu(user_id: int, stickers: List[Dict[str, str]]):
+    """
+    Text and buttons of the menu for one sticker or a batch.
+
+    :param user_id: Telegram user ID, for the preset buttons.
+    :param stickers: The stickers the menu is for.
+    :return: Tuple of the Markdown text and the InlineKeyboardMarkup.
+    """
+    actions = [InlineKeyboardButton("🖼️ Convert", callback_data="single_action_convert")]
+    if len(stickers) == 1:
+        text = "❓ *Please Choose:*"
+        if stickers[0]["extension"] == "tgs":
+            actions.insert(0, InlineKeyboardButton("📁 Export .tgs", callback_data="single_action_export"))
+    else:
+        text = f"📦 *{len(stickers)} stickers received.*\nThey will be converted together into one ZIP.\n❓ *Please Choose:*"
+
+    btns = [
+        *await build_preset_rows(user_id, "single_fps"),
+        actions,
+        [InlineKeyboardButton("❌ Cancel", callback_data="single_action_cancel")]
+    ]
+    return text, InlineKeyboardMarkup(btns)
+
+
 async def single_action_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handle user choice for single sticker: export or convert.
@@ -146,22 +299,25 @@ async def single_action_callback(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     data = query.data
+    # The menu is being acted on; later stickers start a new batch instead of changing it.
+    _close_batch(update.effective_user.id)
 
     if data == "single_action_cancel":
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend me a sticker again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.pop("single_sticker_info", None)
+        sessions.drop(update.effective_user.id)
         return
 
-    single_info = context.user_data.get("single_sticker_info")
-    if not single_info:
+    session = await sessions.get(update.effective_user.id)
+    single_info = session.sticker_info() if session else None
+    if not single_info and not (session and session.batch):
         await query.edit_message_text(
             "⚠️ Something went wrong. Please send the sticker again.", parse_mode=ParseMode.MARKDOWN
         )
         return
 
-    if data == "single_action_export":
+    if data == "single_action_export" and single_info:
         await process_single_export(context.bot, single_info, query.message)
         return
 
@@ -184,23 +340,15 @@ async def single_format_callback(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend me a sticker again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(update.effective_user.id)
         return
 
-    match = re.match(r"single_format_(gif|png|webp|apng)", data)
+    match = re.match(r"single_format_(gif|png|webp|apng)$", data)
     if not match:
         return
     chosen_format = match.group(1)
 
-    single_info = context.user_data.get("single_sticker_info")
-    if not single_info:
-        await query.edit_message_text(
-            "⚠️ Something went wrong. Please send the sticker again.", parse_mode=ParseMode.MARKDOWN
-        )
-        return
-
-    context.user_data["single_sticker_format"] = chosen_format
-    keyboard = build_button_grid(QUALITY_OPTIONS, prefix="single_quality", columns=2)
+    keyboard = build_button_grid(QUALITY_OPTIONS, prefix=f"single_quality_{chosen_format}", columns=2)
     await query.edit_message_text(
         f"🎨 *Format = {chosen_format.upper()} selected.*\nNow choose *quality* for your sticker:",
         parse_mode=ParseMode.MARKDOWN,
@@ -220,24 +368,15 @@ async def single_quality_callback(update: Update, context: ContextTypes.DEFAULT_
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend me a sticker again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(update.effective_user.id)
         return
 
-    match = re.match(r"single_quality_(\d+)", data)
+    match = re.match(r"single_quality_(gif|png|webp|apng)_(\d+)$", data)
     if not match:
         return
-    quality = int(match.group(1))
+    chosen_format, quality = match.group(1), int(match.group(2))
 
-    single_info = context.user_data.get("single_sticker_info")
-    chosen_format = context.user_data.get("single_sticker_format", "gif")
-    if not single_info:
-        await query.edit_message_text(
-            "⚠️ Something went wrong. Please send the sticker again.", parse_mode=ParseMode.MARKDOWN
-        )
-        return
-
-    context.user_data["single_sticker_quality"] = quality
-    keyboard = build_button_grid(SIZE_OPTIONS, prefix="single_size", columns=2)
+    keyboard = build_button_grid(SIZE_OPTIONS, prefix=f"single_size_{chosen_format}_{quality}", columns=2)
     await query.edit_message_text(
         f"🔧 *Quality = {quality}% selected.*\nNow choose *size* for your sticker:",
         parse_mode=ParseMode.MARKDOWN,
@@ -257,41 +396,16 @@ async def single_size_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend me a sticker again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(update.effective_user.id)
         return
 
-    match = re.match(r"single_size_(\d+x\d+)", data)
+    match = re.match(r"single_size_(gif|png|webp|apng)_(\d+)_(\d+)x(\d+)$", data)
     if not match:
         return
-    size_str = match.group(1)
-    width, height = map(int, size_str.split("x"))
-
-    single_info = context.user_data.get("single_sticker_info")
-    chosen_format = context.user_data.get("single_sticker_format", "gif")
-    quality = context.user_data.get("single_sticker_quality", 100)
-    if not single_info:
-        await query.edit_message_text(
-            "⚠️ Something went wrong. Please send the sticker again.", parse_mode=ParseMode.MARKDOWN
-        )
-        return
-
-    context.user_data["single_sticker_width"] = width
-    context.user_data["single_sticker_height"] = height
-
-    # Build FPS buttons (3 per row)
-    btns, row = [], []
-    for fps in FPS_OPTIONS:
-        cb = f"single_fps_{fps}"
-        label = f"⚡ {fps} fps"
-        row.append(InlineKeyboardButton(label, callback_data=cb))
-        if len(row) == 3:
-            btns.append(row)
-            row = []
-    if row:
-        btns.append(row)
-    btns.append([InlineKeyboardButton("❌ Cancel", callback_data="single_fps_cancel")])
-    keyboard = InlineKeyboardMarkup(btns)
+    chosen_format, quality = match.group(1), int(match.group(2))
+    width, height = int(match.group(3)), int(match.group(4))
 
+    keyboard = build_fps_grid(f"single_fps_{chosen_format}_{quality}_{width}x{height}")
     await query.edit_message_text(
         f"🎬 *Size = {width}×{height} selected.*\nNow choose *frame rate* for your sticker:",
         parse_mode=ParseMode.MARKDOWN,
@@ -306,34 +420,54 @@ async def single_fps_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     data = query.data
+    user_id = update.effective_user.id
+    # Preset buttons of the sticker menu lead here directly.
+    _close_batch(user_id)
 
     if data.endswith("_cancel"):
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend me a sticker again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(user_id)
         return
 
-    match = re.match(r"single_fps_(\d+)", data)
+    match = re.match(r"single_fps_(gif|png|webp|apng)_(\d+)_(\d+)x(\d+)_(\d+)$", data)
     if not match:
         return
-    fps = int(match.group(1))
-
-    single_info = context.user_data.get("single_sticker_info")
-    chosen_format = context.user_data.get("single_sticker_format", "gif")
-    quality = context.user_data.get("single_sticker_quality", 100)
-    width = context.user_data.get("single_sticker_width")
-    height = context.user_data.get("single_sticker_height")
+    chosen_format, quality = match.group(1), int(match.group(2))
+    width, height, fps = int(match.group(3)), int(match.group(4)), int(match.group(5))
 
-    if not single_info or width is None or height is None:
+    session = await sessions.get(user_id)
+    single_info = session.sticker_info() if session else None
+    batch = session.batch if session else None
+    if not single_info and not batch:
         await query.edit_message_text(
             "⚠️ Something went wrong. Please send the sticker again.", parse_mode=ParseMode.MARKDOWN
         )
         return
 
-    # Clean up cached data
-    context.user_data.clear()
+    # The job takes over; a second tap on the same menu must not start another one.
+    sessions.drop(user_id)
+    await presets.set_last(user_id, Preset(chosen_format, quality, width, height, fps))
 
+    if batch:
+        for sticker in batch:
+            if sticker["set_name"] != "no_set_name":
+                record_request(sticker["set_name"], chosen_format, quality, width, height, fps)
+        await process_sticker_batch(
+            bot=context.bot,
+            stickers=batch,
+            chosen_format=chosen_format,
+            quality=quality,
+            width=width,
+            height=height,
+            fps=fps,
+            feedback_msg=query.message,
+        )
+        return
+
+    if single_info["set_name"] != "no_set_name":
+        record_request(single_info["set_name"], chosen_format, quality, width, height, fps)
     await process_single_sticker(
         bot=context.bot,
         single_info=single_info,
@@ -358,8 +492,12 @@ async def set_sticker_set_flow(update: Update, context: ContextTypes.DEFAULT_TYP
             return
 
         sticker_set_name = match.group(1)
-        context.user_data["sticker_set_name"] = sticker_set_name
+        await sessions.update(update.effective_user.id, sticker_set_name=sticker_set_name)
+        preset_rows = []
+        if load_config().allow_sticker_sets:
+            preset_rows = await build_preset_rows(update.effective_user.id, "set_fps")
         keyboard = InlineKeyboardMarkup([
+            *preset_rows,
             [
                 InlineKeyboardButton("📁 Export .tgs", callback_data="set_action_export"),
                 InlineKeyboardButton("🖼️ Convert", callback_data="set_action_convert"),
@@ -377,6 +515,11 @@ async def set_sticker_set_flow(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(f"❌ *Error:* `{e}`", parse_mode=ParseMode.MARKDOWN)
 
 
+async def _pending_set_name(user_id: int) -> Optional[str]:
+    session = await sessions.get(user_id)
+    return session.sticker_set_name if session else None
+
+
 async def set_action_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handle user choice for sticker set: export or convert.
@@ -389,10 +532,10 @@ async def set_action_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend `<sticker set link>` again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(update.effective_user.id)
         return
 
-    sticker_set_name = context.user_data.get("sticker_set_name")
+    sticker_set_name = await _pending_set_name(update.effective_user.id)
     if not sticker_set_name:
         await query.edit_message_text(
             "⚠️ Something went wrong. Please send `<sticker set link>` again", parse_mode=ParseMode.MARKDOWN
@@ -415,7 +558,7 @@ async def set_action_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     if data == "set_action_convert":
-        allow_sticker_sets = load_config()["allow_sticker_sets"]
+        allow_sticker_sets = load_config().allow_sticker_sets
         if not allow_sticker_sets:
             await query.edit_message_text(
                 "⚠️ *Sticker sets conversion is disabled.*\n"
@@ -446,23 +589,22 @@ async def set_format_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend `<sticker set link>` again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(update.effective_user.id)
         return
 
-    match = re.match(r"set_format_(gif|png|webp|apng)", data)
+    match = re.match(r"set_format_(gif|png|webp|apng)$", data)
     if not match:
         return
     chosen_format = match.group(1)
 
-    sticker_set_name = context.user_data.get("sticker_set_name")
+    sticker_set_name = await _pending_set_name(update.effective_user.id)
     if not sticker_set_name:
         await query.edit_message_text(
             "⚠️ Something went wrong. Please send `<sticker set link>` again", parse_mode=ParseMode.MARKDOWN
         )
         return
 
-    context.user_data["sticker_set_format"] = chosen_format
-    keyboard = build_button_grid(QUALITY_OPTIONS, prefix="set_quality", columns=2)
+    keyboard = build_button_grid(QUALITY_OPTIONS, prefix=f"set_quality_{chosen_format}", columns=2)
     await query.edit_message_text(
         f"🎨 *Format = {chosen_format.upper()} selected.*\nNow choose *quality* for `{sticker_set_name}`:",
         parse_mode=ParseMode.MARKDOWN,
@@ -482,24 +624,22 @@ async def set_quality_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend `<sticker set link>` again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(update.effective_user.id)
         return
 
-    match = re.match(r"set_quality_(\d+)", data)
+    match = re.match(r"set_quality_(gif|png|webp|apng)_(\d+)$", data)
     if not match:
         return
-    quality = int(match.group(1))
+    chosen_format, quality = match.group(1), int(match.group(2))
 
-    sticker_set_name = context.user_data.get("sticker_set_name")
-    chosen_format = context.user_data.get("sticker_set_format", "gif")
+    sticker_set_name = await _pending_set_name(update.effective_user.id)
     if not sticker_set_name:
         await query.edit_message_text(
             "⚠️ Something went wrong. Please send `<sticker set link>` again", parse_mode=ParseMode.MARKDOWN
         )
         return
 
-    context.user_data["sticker_set_quality"] = quality
-    keyboard = build_button_grid(SIZE_OPTIONS, prefix="set_size", columns=2)
+    keyboard = build_button_grid(SIZE_OPTIONS, prefix=f"set_size_{chosen_format}_{quality}", columns=2)
     await query.edit_message_text(
         f"🔧 *Quality = {quality}% selected.*\nNow choose *size* for `{sticker_set_name}`:",
         parse_mode=ParseMode.MARKDOWN,
@@ -519,41 +659,23 @@ async def set_size_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend `<sticker set link>` again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(update.effective_user.id)
         return
 
-    match = re.match(r"set_size_(\d+x\d+)", data)
+    match = re.match(r"set_size_(gif|png|webp|apng)_(\d+)_(\d+)x(\d+)$", data)
     if not match:
         return
-    size_str = match.group(1)
-    width, height = map(int, size_str.split("x"))
+    chosen_format, quality = match.group(1), int(match.group(2))
+    width, height = int(match.group(3)), int(match.group(4))
 
-    sticker_set_name = context.user_data.get("sticker_set_name")
-    chosen_format = context.user_data.get("sticker_set_format", "gif")
-    quality = context.user_data.get("sticker_set_quality", 100)
+    sticker_set_name = await _pending_set_name(update.effective_user.id)
     if not sticker_set_name:
         await query.edit_message_text(
             "⚠️ Something went wrong. Please send `<sticker set link>` again", parse_mode=ParseMode.MARKDOWN
         )
         return
 
-    context.user_data["sticker_set_width"] = width
-    context.user_data["sticker_set_height"] = height
-
-    # Build FPS buttons (3 per row)
-    btns, row = [], []
-    for fps in FPS_OPTIONS:
-        cb = f"set_fps_{fps}"
-        label = f"⚡ {fps} fps"
-        row.append(InlineKeyboardButton(label, callback_data=cb))
-        if len(row) == 3:
-            btns.append(row)
-            row = []
-    if row:
-        btns.append(row)
-    btns.append([InlineKeyboardButton("❌ Cancel", callback_data="set_fps_cancel")])
-    keyboard = InlineKeyboardMarkup(btns)
-
+    keyboard = build_fps_grid(f"set_fps_{chosen_format}_{quality}_{width}x{height}")
     await query.edit_message_text(
         f"🎬 *Size = {width}×{height} selected.*\nNow choose *frame rate* for `{sticker_set_name}`:",
         parse_mode=ParseMode.MARKDOWN,
@@ -568,48 +690,207 @@ async def set_fps_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     query = update.callback_query
     await query.answer()
     data = query.data
+    user_id = update.effective_user.id
 
     if data.endswith("_cancel"):
         await query.edit_message_text(
             "❌ *Operation canceled.*\nSend `<sticker set link>` again any time.", parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data.clear()
+        sessions.drop(user_id)
         return
 
-    match = re.match(r"set_fps_(\d+)", data)
+    match = re.match(r"set_fps_(gif|png|webp|apng)_(\d+)_(\d+)x(\d+)_(\d+)$", data)
     if not match:
         return
-    fps = int(match.group(1))
-
-    sticker_set_name = context.user_data.get("sticker_set_name")
-    chosen_format = context.user_data.get("sticker_set_format", "gif")
-    quality = context.user_data.get("sticker_set_quality", 100)
-    width = context.user_data.get("sticker_set_width")
-    height = context.user_data.get("sticker_set_height")
+    chosen_format, quality = match.group(1), int(match.group(2))
+    width, height, fps = int(match.group(3)), int(match.group(4)), int(match.group(5))
 
-    if not sticker_set_name or width is None or height is None:
+    sticker_set_name = await _pending_set_name(user_id)
+    if not sticker_set_name:
         await query.edit_message_text(
             "⚠️ Something went wrong. Please send `<sticker set link>` again", parse_mode=ParseMode.MARKDOWN
         )
         return
 
-    # Clear context data
-    context.user_data.clear()
+    if not load_config().allow_sticker_sets:
+        await query.edit_message_text("⚠️ *Sticker sets conversion is disabled.*", parse_mode=ParseMode.MARKDOWN)
+        return
 
+    preset = Preset(chosen_format, quality, width, height, fps)
     try:
         sticker_set = await context.bot.get_sticker_set(sticker_set_name)
-        await process_sticker_set(
-            bot=context.bot,
-            sticker_set=sticker_set,
-            sticker_set_name=sticker_set_name,
-            chosen_format=chosen_format,
-            quality=quality,
-            width=width,
-            height=height,
-            fps=fps,
-            feedback_msg=query.message,
+    except Exception as e:
+        await query.edit_message_text(
+            f"❌ Failed to get sticker set `{sticker_set_name}`:\n`{e}`", parse_mode=ParseMode.MARKDOWN
+        )
+        return
+
+    exported = await export_history.exported(user_id, sticker_set_name, preset)
+    if exported:
+        # Exported before at these settings: offer just the stickers added since.
+        new_count = sum(1 for st in sticker_set.stickers if st.file_unique_id not in exported)
+        settings = f"{chosen_format}_{quality}_{width}x{height}_{fps}"
+        btns = []
+        if new_count:
+            btns.append([InlineKeyboardButton(f"🆕 Only new stickers ({new_count})",
+                                              callback_data=f"set_delta_{settings}")])
+        btns.append([InlineKeyboardButton("📦 Full set", callback_data=f"set_full_{settings}")])
+        btns.append([InlineKeyboardButton("❌ Cancel", callback_data="set_delta_cancel")])
+        await query.edit_message_text(
+            f"ℹ️ You already exported `{sticker_set_name}` as {preset.label()}.\n"
+            + (f"{new_count} stickers were added since." if new_count else "No stickers were added since."),
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup(btns),
         )
+        return
+
+    await _export_sticker_set(context, query, user_id, sticker_set, sticker_set_name, preset)
+
+
+async def set_delta_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handle the choice between exporting only new stickers and the full set again.
+    """
+    query = update.callback_query
+    await query.answer()
+    data = query.data
+    user_id = update.effective_user.id
+
+    if data.endswith("_cancel"):
+        await query.edit_message_text(
+            "❌ *Operation canceled.*\nSend `<sticker set link>` again any time.", parse_mode=ParseMode.MARKDOWN
+        )
+        sessions.drop(user_id)
+        return
+
+    match = re.match(r"set_(delta|full)_(gif|png|webp|apng)_(\d+)_(\d+)x(\d+)_(\d+)$", data)
+    if not match:
+        return
+    preset = Preset(match.group(2), int(match.group(3)), int(match.group(4)), int(match.group(5)),
+                    int(match.group(6)))
+
+    sticker_set_name = await _pending_set_name(user_id)
+    if not sticker_set_name:
+        await query.edit_message_text(
+            "⚠️ Something went wrong. Please send `<sticker set link>` again", parse_mode=ParseMode.MARKDOWN
+        )
+        return
+
+    if not load_config().allow_sticker_sets:
+        await query.edit_message_text("⚠️ *Sticker sets conversion is disabled.*", parse_mode=ParseMode.MARKDOWN)
+        return
+
+    try:
+        sticker_set = await context.bot.get_sticker_set(sticker_set_name)
     except Exception as e:
         await query.edit_message_text(
             f"❌ Failed to get sticker set `{sticker_set_name}`:\n`{e}`", parse_mode=ParseMode.MARKDOWN
         )
+        return
+
+    # A full export reconverts nothing that is still in the result cache.
+    skip_ids = await export_history.exported(user_id, sticker_set_name, preset) if match.group(1) == "delta" else ()
+    await _export_sticker_set(context, query, user_id, sticker_set, sticker_set_name, preset, skip_ids)
+
+
+async def _export_sticker_set(context, query, user_id: int, sticker_set, sticker_set_name: str,
+                              preset: Preset, skip_ids=()) -> None:
+    """
+    Start the conversion job of a sticker set and record the stickers it delivered.
+
+    :param skip_ids: `file_unique_id`s already exported, left out of a delta export.
+    """
+    # The job takes over; a second tap on the same menu must not start another one.
+    sessions.drop(user_id)
+    await presets.set_last(user_id, preset)
+
+    record_request(sticker_set_name, *preset.as_tuple())
+    converted = await process_sticker_set(
+        bot=context.bot,
+        sticker_set=sticker_set,
+        sticker_set_name=sticker_set_name,
+        chosen_format=preset.chosen_format,
+        quality=preset.quality,
+        width=preset.width,
+        height=preset.height,
+        fps=preset.fps,
+        feedback_msg=query.message,
+        skip_ids=frozenset(skip_ids),
+    )
+    export_history.add(user_id, sticker_set_name, preset, converted)
+
+
+async def job_cancel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handle the cancel button on a running job's progress message.
+    """
+    query = update.callback_query
+    match = re.match(r"job_cancel_([0-9a-f]+)", query.data)
+    if not match:
+        await query.answer()
+        return
+
+    if cancel_job(match.group(1), query.message.chat_id):
+        await query.answer("🛑 Canceling…")
+        await query.edit_message_reply_markup(reply_markup=None)
+    else:
+        await query.answer("ℹ️ This job has already finished.", show_alert=True)
+
+
+async def save_preset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handle the /savepreset command: save the settings of the last conversion as a preset.
+    """
+    user_id = update.effective_user.id
+    last = await presets.last(user_id)
+    if last is None:
+        await update.message.reply_text(
+            "ℹ️ Convert a sticker first, then use /savepreset to keep its settings.", parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    if await presets.save(user_id, last):
+        await update.message.reply_text(f"⭐ *Preset saved:* `{last.label()}`", parse_mode=ParseMode.MARKDOWN)
+    else:
+        await update.message.reply_text(f"ℹ️ `{last.label()}` is already saved.", parse_mode=ParseMode.MARKDOWN)
+
+
+async def build_presets_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    btns = [
+        [InlineKeyboardButton(f"🗑️ {preset.label()}", callback_data=f"preset_delete_{i}")]
+        for i, preset in enumerate(await presets.saved(user_id))
+    ]
+    return InlineKeyboardMarkup(btns)
+
+
+async def presets_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handle the /presets command: list saved presets with buttons to delete them.
+    """
+    user_id = update.effective_user.id
+    if not await presets.saved(user_id):
+        await update.message.reply_text(
+            "ℹ️ No presets saved yet. Convert a sticker, then use /savepreset.", parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    await update.message.reply_text(
+        "⭐ *Your presets* (tap one to delete it):", parse_mode=ParseMode.MARKDOWN,
+        reply_markup=await build_presets_keyboard(user_id),
+    )
+
+
+async def preset_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handle the delete buttons of the /presets list.
+    """
+    query = update.callback_query
+    await query.answer()
+    match = re.match(r"preset_delete_(\d+)$", query.data)
+    if not match:
+        return
+
+    user_id = update.effective_user.id
+    await presets.delete(user_id, int(match.group(1)))
+    if await presets.saved(user_id):
+        await query.edit_message_reply_markup(reply_markup=await build_presets_keyboard(user_id))
+    else:
+        await query.edit_message_text("🗑️ *All presets deleted.*", parse_mode=ParseMode.MARKDOWN)
@@ -0,0 +1,181 @@
+"""
+Registry of running jobs, used to cancel them and kill their renderer subprocesses.
+"""
+import asyncio
+import contextvars
+import os
+import signal
+import subprocess
+import uuid
+from typing import TYPE_CHECKING, Dict, Optional
+
+from loguru import logger
+
+from config import load_config
+
+if TYPE_CHECKING:
+    from telegram import InlineKeyboardMarkup
+
+_config = load_config()
+JOB_TIMEOUT = _config.get("converter", {}).get("job_timeout", 3600)
+
+_jobs: Dict[str, "Job"] = {}
+_current_job: contextvars.ContextVar[Optional["Job"]] = contextvars.ContextVar("current_job", default=None)
+
+
+class Job:
+    """
+    A running export/convert job: its task and the subprocesses it has started.
+    """
+
+    def __init__(self, chat_id: int):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.chat_id = chat_id
+        self.task = asyncio.current_task()
+        self.cancelled = False
+        self.timed_out = False
+        # Predicted seconds of conversion left, used to schedule conversions across jobs.
+        self.predicted_seconds = 0.0
+        self._processes = set()
+        self._token = None
+        self._timeout_handle = None
+
+    def add_process(self, proc: asyncio.subprocess.Process) -> None:
+        """
+        Track a subprocess; it is killed at once if the job was already cancelled.
+        """
+        self._processes.add(proc)
+        if self.cancelled:
+            kill_process_tree(proc)
+
+    def remove_process(self, proc: asyncio.subprocess.Process) -> None:
+        self._processes.discard(proc)
+
+    def kill_processes(self) -> None:
+        """
+        Terminate every tracked subprocess together with its children.
+        """
+        processes = list(self._processes)
+        self._processes.clear()
+        for proc in processes:
+            kill_process_tree(proc)
+
+    def cancel(self) -> None:
+        """
+        Cancel the job: kill its subprocesses and cancel its task (and pending subtasks).
+        """
+        self.cancelled = True
+        self.kill_processes()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def expire(self) -> None:
+        """
+        Cancel the job because it ran longer than `converter.job_timeout`.
+        """
+        logger.warning(f"Job {self.job_id} exceeded {JOB_TIMEOUT}s, cancelling")
+        self.timed_out = True
+        self.cancel()
+
+    def cancel_markup(self) -> "InlineKeyboardMarkup":
+        """
+        Inline keyboard with a cancel button for this job's progress message.
+        """
+        # Imported here so the conversion code can run without the bot (see cli.py).
+        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+        return InlineKeyboardMarkup(
+            [[InlineKeyboardButton("❌ Cancel", callback_data=f"job_cancel_{self.job_id}")]]
+        )
+
+
+def popen_kwargs() -> dict:
+    """
+    Extra `asyncio.create_subprocess_exec` arguments that put the child in its own process group,
+    so `kill_process_tree` reaches the renderer and encoder started by the script.
+    """
+    if os.name == "posix":
+        return {"start_new_session": True}
+    return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+def kill_process_tree(proc: asyncio.subprocess.Process) -> None:
+    """
+    Kill a subprocess started with `popen_kwargs()` and all of its descendants.
+
+    Does not wait for the process: the conversion that started it is waiting on it.
+    """
+    if proc.returncode is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], capture_output=True)
+    except (ProcessLookupError, PermissionError) as e:
+        logger.warning(f"Could not kill process {proc.pid}: {e}")
+
+
+def start_job(chat_id: int) -> Job:
+    """
+    Register a job for the current task and make it the current job.
+
+    Subtasks and worker threads started afterwards inherit it through the context.
+    The job is cancelled automatically after `converter.job_timeout` seconds (0 = never).
+
+    :param chat_id: Chat the job reports to; only this chat may cancel it.
+    :return: The new job.
+    """
+    job = Job(chat_id)
+    _jobs[job.job_id] = job
+    job._token = _current_job.set(job)
+    if JOB_TIMEOUT:
+        job._timeout_handle = asyncio.get_running_loop().call_later(JOB_TIMEOUT, job.expire)
+    return job
+
+
+def finish_job(job: Job) -> None:
+    """
+    Unregister a job and kill any subprocess it left behind.
+    """
+    _jobs.pop(job.job_id, None)
+    if job._timeout_handle is not None:
+        job._timeout_handle.cancel()
+    job.kill_processes()
+    if job._token is not None:
+        try:
+            _current_job.reset(job._token)
+        except ValueError:
+            # Finished from a different context than it was started in.
+            pass
+        job._token = None
+
+
+def current_job() -> Optional[Job]:
+    """
+    Return the job running in the current task/thread context, if any.
+    """
+    return _current_job.get()
+
+
+def running_jobs() -> int:
+    """
+    Number of user jobs currently running.
+    """
+    return len(_jobs)
+
+
+def cancel_job(job_id: str, chat_id: int) -> bool:
+    """
+    Cancel a running job.
+
+    :param job_id: ID from the cancel button's callback data.
+    :param chat_id: Chat the cancel request came from.
+    :return: True if a matching job was found and cancelled.
+    """
+    job = _jobs.get(job_id)
+    if job is None or job.chat_id != chat_id:
+        return False
+    logger.info(f"Cancelling job {job_id} in chat {chat_id}")
+    job.cancel()
+    return True
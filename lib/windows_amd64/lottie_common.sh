@@ -6,6 +6,7 @@
 # $OUTPUT_EXTENSION
 # $QUALITY
 
+# 0 = number of CPUs; also passed to the encoder (RAYON_NUM_THREADS for gifski, -threads for ffmpeg)
 THREADS=0
 
 SCRIPT_DIR=$(dirname "$0")
@@ -16,7 +17,8 @@ function print_help() {
   echo "Lottie animations (.json) and Telegram stickers for Telegram (*.tgs) to animated $OUTPUT_EXTENSION converter"
   echo
   echo "Positional arguments:"
-  echo " path              Path to .json or .tgs file to convert"
+  echo " path              Path to .json or .tgs file to convert, - to read .tgs from stdin,"
+  echo "                   or a directory of PNG frames rendered beforehand"
   echo
   echo "Optional arguments:"
   echo " -h, --help        shows this help message and exits"
@@ -97,15 +99,25 @@ fi
 TMP_PATH=${OUTPUT}.$RANDOM.tmp
 mkdir $TMP_PATH
 
-LOTTIE_PATH=$INPUT_PATH
-if [ "${INPUT_PATH: -4}" == ".tgs" ]; then
-  LOTTIE_PATH=$TMP_PATH/animation.json
-  gunzip -c $INPUT_PATH > $LOTTIE_PATH
-fi
+FRAMES_PATH=$TMP_PATH
+if [ -d "$INPUT_PATH" ]; then
+  # frames already rendered (converter.py renders frame ranges in parallel)
+  FRAMES_PATH=$INPUT_PATH
+else
+  LOTTIE_PATH=$INPUT_PATH
+  if [ "$INPUT_PATH" == "-" ]; then
+    # .tgs content piped on stdin
+    LOTTIE_PATH=$TMP_PATH/animation.json
+    gunzip -c > $LOTTIE_PATH
+  elif [ "${INPUT_PATH: -4}" == ".tgs" ]; then
+    LOTTIE_PATH=$TMP_PATH/animation.json
+    gunzip -c $INPUT_PATH > $LOTTIE_PATH
+  fi
 
-$SCRIPT_DIR/lottie_to_png --width $WIDTH --height $HEIGHT --fps $FPS --threads $THREADS --output $TMP_PATH $LOTTIE_PATH
+  $SCRIPT_DIR/lottie_to_png --width $WIDTH --height $HEIGHT --fps $FPS --threads $THREADS --output $TMP_PATH $LOTTIE_PATH
+fi
 
-PNG_FILES=$(find $TMP_PATH -type f -name '*.png' | sort -k1)
+PNG_FILES=$(find $FRAMES_PATH -type f -name '*.png' | sort -k1)
 
 function cleanup {
   rm -fr $TMP_PATH
@@ -6,4 +6,4 @@ QUALITY=90
 
 SCRIPT_DIR=$(dirname "$0")
 
-source $SCRIPT_DIR/lottie_common.sh && (echo | ffmpeg -y -loglevel error -r $FPS -i $TMP_PATH/%03d.png -plays 0 $OUTPUT)
+source $SCRIPT_DIR/lottie_common.sh && (echo | ffmpeg -y -loglevel error -r $FPS -i $FRAMES_PATH/%03d.png -threads $THREADS -plays 0 $OUTPUT)
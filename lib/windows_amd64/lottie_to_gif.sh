@@ -6,4 +6,4 @@ QUALITY=90
 
 SCRIPT_DIR=$(dirname "$0")
 
-source $SCRIPT_DIR/lottie_common.sh && gifski --quiet -o $OUTPUT --fps $FPS --height $HEIGHT --width $WIDTH --quality $QUALITY $PNG_FILES
+source $SCRIPT_DIR/lottie_common.sh && RAYON_NUM_THREADS=$THREADS gifski --quiet -o $OUTPUT --fps $FPS --quality $QUALITY $PNG_FILES
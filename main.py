@@ -1,10 +1,13 @@
 """
-Main entry point: initialize bot, register handlers, and start polling.
+Main entry point: initialize bot, register handlers, and start polling or the webhook server.
 """
 from loguru import logger
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 
+import mtproto
 from config import load_config, get_proxy_url
+from metrics import start_metrics_server
+from prewarm import PREWARM_ENABLED, run_prewarmer
 from handlers import (
     start,
     help_command,
@@ -21,16 +24,36 @@ from handlers import (
     set_quality_callback,
     set_size_callback,
     set_fps_callback,
+    set_delta_callback,
+    job_cancel_callback,
+    save_preset_command,
+    presets_command,
+    preset_callback,
 )
 
 
+async def post_init(application: Application) -> None:
+    """
+    Start background tasks once the bot is initialized.
+    """
+    if PREWARM_ENABLED:
+        application.create_task(run_prewarmer(application.bot))
+
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Close connections opened next to the Bot API one.
+    """
+    await mtproto.close()
+
+
 def main() -> None:
     """
     Initialize the Telegram bot application and register all handlers.
     """
     # Load configuration
-    config = load_config("config.json")
-    bot_token = config.get("bot_token")
+    config = load_config()
+    bot_token = config.bot_token
 
     # Setup proxy if configured
     proxy_enabled = config.get("proxy", {}).get("status", False)
@@ -39,9 +62,22 @@ def main() -> None:
     else:
         logger.info("Bot is running without proxy.")
 
+    # Expose pipeline metrics if configured
+    metrics_config = config.get("metrics", {})
+    if metrics_config.get("status", False):
+        start_metrics_server(metrics_config.get("host", "127.0.0.1"), metrics_config.get("port", 9464))
+
     # Build application
+    builder = Application.builder()
+    local_api_config = config.get("local_bot_api", {})
+    if local_api_config.get("status", False):
+        logger.info(f"Bot is using the local Bot API server at {local_api_config.get('base_url')}.")
+        builder = (builder
+                   .base_url(local_api_config.get("base_url", "http://127.0.0.1:8081/bot"))
+                   .base_file_url(local_api_config.get("base_file_url", "http://127.0.0.1:8081/file/bot"))
+                   .local_mode(True))
     if proxy_enabled:
-        application = (Application.builder()
+        application = (builder
                        .token(bot_token)
                        .proxy(get_proxy_url(config.get("proxy", {})))
                        .connect_timeout(30000000)
@@ -49,22 +85,30 @@ def main() -> None:
                        .write_timeout(30000000)
                        .pool_timeout(30000000)
                        .media_write_timeout(30000000)
+                       .concurrent_updates(True)
+                       .post_init(post_init)
+                       .post_shutdown(post_shutdown)
                        .get_updates_proxy(get_proxy_url(config.get("proxy", {})))
                        .build())
     else:
-        application = (Application.builder()
+        application = (builder
                        .token(bot_token)
                        .connect_timeout(30000000)
                        .read_timeout(30000000)
                        .write_timeout(30000000)
                        .pool_timeout(30000000)
                        .media_write_timeout(30000000)
+                       .concurrent_updates(True)
+                       .post_init(post_init)
+                       .post_shutdown(post_shutdown)
                        .build())
 
     # Register command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("about", about_command))
+    application.add_handler(CommandHandler("savepreset", save_preset_command))
+    application.add_handler(CommandHandler("presets", presets_command))
 
     # Register message handler for stickers
     application.add_handler(MessageHandler(filters.Sticker.ALL, sticker_to_gif))
@@ -102,9 +146,70 @@ def main() -> None:
     application.add_handler(
         CallbackQueryHandler(set_fps_callback, pattern=r"^set_fps_.*$")
     )
+    application.add_handler(
+        CallbackQueryHandler(set_delta_callback, pattern=r"^set_(delta|full)_.*$")
+    )
 
-    logger.info("🚀 Starting bot...")
-    application.run_polling(allowed_updates=None)
+    application.add_handler(
+        CallbackQueryHandler(job_cancel_callback, pattern=r"^job_cancel_.*$")
+    )
+    application.add_handler(
+        CallbackQueryHandler(preset_callback, pattern=r"^preset_.*$")
+    )
+
+    webhook_config = config.get("webhook", {})
+    if webhook_config.get("status", False):
+        run_webhook(application, webhook_config)
+    else:
+        logger.info("🚀 Starting bot...")
+        application.run_polling(allowed_updates=None)
+
+
+def webhook_options(webhook_config: dict) -> dict:
+    """
+    Arguments of `Application.run_webhook` for the `webhook` config section.
+
+    :param webhook_config: The `webhook` config section.
+    :return: Keyword arguments for `run_webhook`/`Updater.start_webhook`.
+    :raises ValueError: If `secret_token` is not set; without it anyone who finds the URL
+                        could post updates to the bot.
+    """
+    secret_token = webhook_config.get("secret_token")
+    if not secret_token:
+        raise ValueError("webhook.secret_token must be set to run the bot with a webhook")
+    return {
+        "listen": webhook_config.get("listen", "127.0.0.1"),
+        "port": webhook_config.get("port", 8443),
+        "url_path": webhook_config.get("url_path", "webhook").strip("/"),
+        "webhook_url": webhook_config.get("url"),
+        "secret_token": secret_token,
+        "max_connections": webhook_config.get("max_connections", 40),
+        "cert": webhook_config.get("cert") or None,
+        "key": webhook_config.get("key") or None,
+        "drop_pending_updates": webhook_config.get("drop_pending_updates", False),
+        "allowed_updates": None,
+    }
+
+
+def run_webhook(application: Application, webhook_config: dict) -> None:
+    """
+    Serve updates over a webhook instead of long polling.
+
+    Telegram posts updates to `webhook.url`, which must reach `listen:port/url_path`
+    (directly, or through a reverse proxy or load balancer terminating TLS). Requests
+    without the `secret_token` header are rejected; the bot does not start without one.
+
+    Run a single bot process per token: running jobs, sticker batches and sessions live in
+    the process's memory (`sessions.sqlite_path` only keeps sessions across restarts), so a
+    load balancer must not spread updates over several workers.
+
+    :param application: The built application.
+    :param webhook_config: The `webhook` config section.
+    :raises ValueError: If `webhook.secret_token` is not set.
+    """
+    options = webhook_options(webhook_config)
+    logger.info(f"🚀 Starting bot with webhook on {options['listen']}:{options['port']}/{options['url_path']}...")
+    application.run_webhook(**options)
 
 
 if __name__ == "__main__":
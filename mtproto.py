@@ -0,0 +1,133 @@
+"""
+Optional MTProto transfer backend (Pyrogram).
+
+The Bot API caps bot uploads at 50 MB, so larger archives are otherwise split into parts
+users have to join. With `mtproto.status` enabled the bot also logs in over MTProto with
+its bot token and sends such archives as one file (up to `mtproto.max_file_mb`, 2000 MB for
+bots); sticker downloads go through the same connection. Pyrogram transfers large files in
+parallel chunks.
+
+Needs an `api_id` and `api_hash` from https://my.telegram.org. Pyrogram is imported on
+first use, so the bot doesn't load it unless the backend is enabled.
+"""
+import asyncio
+import os
+import re
+from typing import Optional
+
+from loguru import logger
+
+from config import load_config
+
+_config = load_config()
+_mtproto_conf = _config.get("mtproto", {})
+MTPROTO_ENABLED = _mtproto_conf.get("status", False)
+MAX_FILE_BYTES = _mtproto_conf.get("max_file_mb", 2000) * 1024 * 1024
+
+_client = None
+_client_lock = asyncio.Lock()
+
+
+def _proxy() -> Optional[dict]:
+    proxy_config = _config.get("proxy", {})
+    if not proxy_config.get("status", False):
+        return None
+    return {
+        "scheme": proxy_config.get("type"),
+        "hostname": proxy_config.get("host"),
+        "port": proxy_config.get("port"),
+        "username": proxy_config.get("username") or None,
+        "password": proxy_config.get("password") or None,
+    }
+
+
+def _create_client():
+    from pyrogram import Client
+
+    return Client(
+        _mtproto_conf.get("session_name", "mtproto_bot"),
+        api_id=_mtproto_conf.get("api_id"),
+        api_hash=_mtproto_conf.get("api_hash"),
+        bot_token=_config.bot_token,
+        workdir=_mtproto_conf.get("workdir", "."),
+        proxy=_proxy(),
+        no_updates=True,
+        max_concurrent_transmissions=_mtproto_conf.get("max_concurrent_transmissions", 2),
+    )
+
+
+async def get_client():
+    """
+    Return the started Pyrogram client, logging in on first use.
+    """
+    global _client
+    async with _client_lock:
+        if _client is None:
+            client = _create_client()
+            await client.start()
+            _client = client
+            logger.info("MTProto transfer backend connected.")
+    return _client
+
+
+async def close() -> None:
+    """
+    Stop the Pyrogram client if it was started.
+    """
+    global _client
+    async with _client_lock:
+        if _client is not None:
+            await _client.stop()
+            _client = None
+
+
+def to_pyrogram_markdown(text: str) -> str:
+    """
+    Convert the Bot API's legacy Markdown (`*bold*`, `\\_`) to Pyrogram's (`**bold**`, `_`).
+    Links and code spans are written the same in both.
+    """
+    text = re.sub(r"(?<!\*)\*([^*\n]+)\*(?!\*)", r"**\1**", text)
+    return text.replace("\\_", "_")
+
+
+async def upload_document(feedback_msg, path: str, caption: str) -> None:
+    """
+    Send a file as a reply to `feedback_msg` over MTProto.
+
+    :param feedback_msg: Telegram (Bot API) message to reply to.
+    :param path: File to send.
+    :param caption: Caption in the Bot API's legacy Markdown.
+    """
+    from pyrogram.enums import ParseMode
+
+    client = await get_client()
+    await client.send_document(
+        chat_id=feedback_msg.chat_id,
+        document=path,
+        caption=to_pyrogram_markdown(caption),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_to_message_id=feedback_msg.message_id,
+        force_document=True,
+    )
+
+
+async def download_file(file_id: str, path: str) -> str:
+    """
+    Download a file by its Bot API file ID over MTProto.
+
+    :param file_id: Bot API file ID (Pyrogram decodes the same format).
+    :param path: Destination path.
+    :return: The destination path.
+    """
+    client = await get_client()
+    # Relative paths would be resolved against Pyrogram's directory, not ours.
+    return await client.download_media(file_id, file_name=os.path.abspath(path))
+
+
+async def download_bytes(file_id: str) -> bytes:
+    """
+    Download a file by its Bot API file ID over MTProto into memory.
+    """
+    client = await get_client()
+    buffer = await client.download_media(file_id, in_memory=True)
+    return buffer.getvalue()
@@ -0,0 +1,49 @@
+"""
+Conversion presets: a set of conversion settings, and the default one offered before a
+user has any.
+
+Kept apart from `sessions` so the settings can be used without creating the session and
+preset stores, which open SQLite when it is configured.
+"""
+from config import load_config
+
+_default_preset = load_config().get("default_preset", {})
+
+
+class Preset:
+    """
+    A set of conversion settings.
+    """
+
+    __slots__ = ("chosen_format", "quality", "width", "height", "fps")
+
+    def __init__(self, chosen_format: str, quality: int, width: int, height: int, fps: int):
+        self.chosen_format = chosen_format
+        self.quality = quality
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Preset) and self.as_tuple() == other.as_tuple()
+
+    def as_tuple(self) -> tuple:
+        return self.chosen_format, self.quality, self.width, self.height, self.fps
+
+    def label(self) -> str:
+        return f"{self.chosen_format.upper()} {self.width}×{self.height} · {self.quality}% · {self.fps}fps"
+
+    def callback_data(self, prefix: str) -> str:
+        """
+        Callback data of the last menu step with these settings, e.g. `single_fps_gif_90_512x512_60`.
+        """
+        return f"{prefix}_{self.chosen_format}_{self.quality}_{self.width}x{self.height}_{self.fps}"
+
+
+DEFAULT_PRESET = Preset(
+    _default_preset.get("format", "gif"),
+    _default_preset.get("quality", 90),
+    _default_preset.get("width", 512),
+    _default_preset.get("height", 512),
+    _default_preset.get("fps", 60),
+)
@@ -0,0 +1,159 @@
+"""
+Background pre-conversion of trending sticker sets into the result cache.
+
+Conversion requests are counted per sticker set and per parameter combination, with
+exponential decay so the counts follow what is trending. While no user job is running and
+the machine is otherwise idle, the most requested sets are converted at the most popular
+parameters, so that later requests for them are served from `result_cache`.
+"""
+import asyncio
+import os
+import shutil
+import time
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+import result_cache
+from config import load_config
+from conversion import convert_cached, get_script_path
+from converter import cpu_count
+from decoders import sticker_extension
+from exporter import fetch_sticker
+from jobs import running_jobs
+from tracing import span
+
+_config = load_config()
+_prewarm_conf = _config.get("prewarm", {})
+PREWARM_ENABLED = _prewarm_conf.get("status", False)
+INTERVAL = _prewarm_conf.get("interval", 300)
+# 1-minute load average per CPU below which the machine counts as idle.
+MAX_LOAD = _prewarm_conf.get("max_load", 0.25)
+TOP_SETS = _prewarm_conf.get("top_sets", 5)
+TOP_PARAMS = _prewarm_conf.get("top_params", 1)
+HALF_LIFE_SECONDS = _prewarm_conf.get("half_life_hours", 24) * 3600
+
+Params = Tuple[str, int, int, int, int]  # format, quality, width, height, fps
+
+# name -> [score, last update]
+_set_scores: Dict[str, List[float]] = {}
+_param_scores: Dict[Params, List[float]] = {}
+
+
+def _bump(scores: Dict, key, now: float) -> None:
+    score, updated = scores.get(key, (0.0, now))
+    scores[key] = [score * 0.5 ** ((now - updated) / HALF_LIFE_SECONDS) + 1.0, now]
+
+
+def _top(scores: Dict, n: int, now: float) -> list:
+    decayed = {
+        key: score * 0.5 ** ((now - updated) / HALF_LIFE_SECONDS)
+        for key, (score, updated) in scores.items()
+    }
+    return sorted(decayed, key=decayed.get, reverse=True)[:n]
+
+
+def record_request(set_name: str, chosen_format: str, quality: int, width: int, height: int, fps: int) -> None:
+    """
+    Count a conversion request for the pre-warmer.
+
+    :param set_name: Sticker set the request was for.
+    :param chosen_format: Output format.
+    :param quality: Conversion quality (percentage).
+    :param width: Output width.
+    :param height: Output height.
+    :param fps: Frame rate.
+    """
+    if not PREWARM_ENABLED:
+        return
+    now = time.time()
+    _bump(_set_scores, set_name, now)
+    # PNG output is a frame directory, which the result cache doesn't hold.
+    if chosen_format != "png":
+        _bump(_param_scores, (chosen_format, quality, width, height, fps), now)
+
+
+def is_idle() -> bool:
+    """
+    True if no user job is running and the load average is below `prewarm.max_load`.
+    """
+    if running_jobs():
+        return False
+    if hasattr(os, "getloadavg"):
+        return os.getloadavg()[0] / cpu_count() < MAX_LOAD
+    return True
+
+
+async def warm_set(bot, set_name: str, params: List[Params]) -> int:
+    """
+    Convert every sticker of a set at the given parameters into the result cache.
+
+    Stops early as soon as a user job starts.
+
+    :param bot: Telegram Bot instance.
+    :param set_name: Sticker set to convert.
+    :param params: Parameter combinations to convert at.
+    :return: Number of conversions added to the cache.
+    """
+    sticker_set = await bot.get_sticker_set(set_name)
+    tmp_dir = f"tmp/{set_name}-prewarm"
+    os.makedirs(tmp_dir, exist_ok=True)
+    converted = 0
+    try:
+        for sticker in sticker_set.stickers:
+            missing = [
+                p for p in params
+                if not result_cache.contains(result_cache.cache_key(sticker.file_unique_id, *p))
+            ]
+            if not missing:
+                continue
+            if running_jobs():
+                logger.info(f"Pre-warming of {set_name} paused, a user job started")
+                break
+            extension = sticker_extension(sticker)
+            source_path = f"{tmp_dir}/{sticker.file_unique_id}.{extension}"
+            with span("prewarm", set_name=set_name, file_unique_id=sticker.file_unique_id):
+                source_data = await fetch_sticker(
+                    bot, sticker.file_id, source_path, file_unique_id=sticker.file_unique_id
+                )
+                for chosen_format, quality, width, height, fps in missing:
+                    out_path = f"{tmp_dir}/{sticker.file_unique_id}.out.{chosen_format}"
+                    await convert_cached(
+                        source_path, out_path, sticker.file_unique_id, chosen_format,
+                        quality, width, height, fps, get_script_path(chosen_format), source_data,
+                    )
+                    os.remove(out_path)
+                    converted += 1
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return converted
+
+
+async def run_prewarmer(bot) -> None:
+    """
+    Pre-warm trending sets every `prewarm.interval` seconds while the bot is idle.
+
+    :param bot: Telegram Bot instance.
+    """
+    if not result_cache.CACHE_ENABLED:
+        logger.warning("Pre-warming needs the result cache, set cache.status to true")
+        return
+    logger.info("Sticker set pre-warmer started.")
+    while True:
+        await asyncio.sleep(INTERVAL)
+        if not is_idle():
+            continue
+        now = time.time()
+        params = _top(_param_scores, TOP_PARAMS, now)
+        if not params:
+            continue
+        for set_name in _top(_set_scores, TOP_SETS, now):
+            # The load average now includes our own conversions; only user jobs stop us.
+            if running_jobs():
+                break
+            try:
+                converted = await warm_set(bot, set_name, params)
+                if converted:
+                    logger.info(f"Pre-warmed {converted} conversions of {set_name}")
+            except Exception as e:
+                logger.warning(f"Pre-warming {set_name} failed: {e}")
@@ -0,0 +1,197 @@
+"""
+On-disk cache of converted stickers, keyed by sticker content and conversion parameters.
+
+Sticker files are identified by a hash of their content, recorded when they are
+downloaded: many sets reuse the same animation under different `file_unique_id`s, and
+for `.tgs` the hash is taken of the canonical (key-sorted) Lottie JSON, so re-encoded
+copies of an animation share entries too. Stickers whose content hasn't been seen since
+the bot started are keyed by `file_unique_id`.
+
+Entries are plain files under `cache.path`; the least recently used ones are removed once
+the cache grows past `cache.max_mb`. PNG conversions produce a directory of frames and
+are not cached.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from config import load_config
+from metrics import CACHE_LOOKUPS
+
+_config = load_config()
+_cache_conf = _config.get("cache", {})
+CACHE_ENABLED = _cache_conf.get("status", False)
+CACHE_PATH = _cache_conf.get("path", "cache")
+CACHE_MAX_BYTES = _cache_conf.get("max_mb", 2048) * 1024 * 1024
+
+# Content IDs remembered, least recently recorded dropped first.
+MAX_CONTENT_IDS = 100_000
+
+_evict_lock = threading.Lock()
+# Bytes of all cache entries; counted on the first store, then kept up to date.
+_total_bytes: Optional[int] = None
+# file_unique_id -> content ID
+_content_ids: "OrderedDict[str, str]" = OrderedDict()
+
+
+def content_hash(path: str, data: Optional[bytes] = None) -> str:
+    """
+    Hash a sticker file's content; `.tgs` files by their canonical Lottie JSON.
+
+    :param path: Sticker file, read if `data` is not given; its extension selects the hashing.
+    :param data: Content of the sticker file.
+    :return: Hex digest.
+    """
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    if path.endswith(".tgs"):
+        try:
+            animation = json.loads(gzip.decompress(data))
+            data = json.dumps(animation, sort_keys=True, separators=(",", ":")).encode()
+        except (OSError, ValueError):
+            pass
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def record_content(file_unique_id: str, digest: str) -> None:
+    """
+    Remember the content hash of a downloaded sticker file for its cache keys.
+    """
+    _content_ids[file_unique_id] = f"h{digest}"
+    _content_ids.move_to_end(file_unique_id)
+    if len(_content_ids) > MAX_CONTENT_IDS:
+        _content_ids.popitem(last=False)
+
+
+def content_id(file_unique_id: str) -> str:
+    """
+    The ID a sticker file is cached under: its content hash if recorded, else `file_unique_id`.
+    """
+    return _content_ids.get(file_unique_id, file_unique_id)
+
+
+def cache_key(file_unique_id: str, chosen_format: str, quality: int, width: int, height: int, fps: int) -> str:
+    """
+    Build the cache key of one conversion.
+
+    :param file_unique_id: Telegram's stable ID of the sticker file; replaced by the
+                           file's content hash if one was recorded (see `record_content`).
+    :param chosen_format: Output format (`gif`, `webp`, `apng`).
+    :param quality: Conversion quality (percentage).
+    :param width: Output width.
+    :param height: Output height.
+    :param fps: Frame rate.
+    :return: Key usable as a file name.
+    """
+    return f"{content_id(file_unique_id)}-{width}x{height}-{fps}fps-q{quality}.{chosen_format}"
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_PATH, key)
+
+
+def lookup(key: str) -> Optional[str]:
+    """
+    Return the path of a cached conversion, or None on a miss or if the cache is disabled.
+
+    A hit refreshes the entry's modification time, which eviction uses as last access.
+    """
+    if not CACHE_ENABLED:
+        return None
+    path = _entry_path(key)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        CACHE_LOOKUPS.inc(cache="result", result="miss")
+        return None
+    CACHE_LOOKUPS.inc(cache="result", result="hit")
+    return path
+
+
+def contains(key: str) -> bool:
+    """
+    True if `key` is cached; unlike `lookup` this is not counted as an access.
+    """
+    return CACHE_ENABLED and os.path.isfile(_entry_path(key))
+
+
+def store(key: str, path: str) -> None:
+    """
+    Copy a converted file into the cache. Does nothing if the cache is disabled or
+    `path` is not a regular file. Blocks on file I/O; call it from a worker thread.
+    """
+    global _total_bytes
+    if not CACHE_ENABLED or not os.path.isfile(path):
+        return
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    entry_path = _entry_path(key)
+    try:
+        replaced = os.path.getsize(entry_path)
+    except FileNotFoundError:
+        replaced = 0
+    # Copy under a temporary name first so readers never see a partial entry.
+    tmp_path = _entry_path(f".{key}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        shutil.copyfile(path, tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, entry_path)
+    except OSError as e:
+        logger.warning(f"Could not cache {key}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    with _evict_lock:
+        if _total_bytes is None:
+            _total_bytes = sum(st_size for _, st_size, _ in _scan())
+        else:
+            _total_bytes += size - replaced
+    evict()
+
+
+def _scan() -> List[Tuple[float, int, str]]:
+    # (modification time, size, path) of every cache entry.
+    try:
+        entries = [e for e in os.scandir(CACHE_PATH) if e.is_file() and not e.name.startswith(".")]
+    except FileNotFoundError:
+        return []
+    stats = []
+    for entry in entries:
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        stats.append((st.st_mtime, st.st_size, entry.path))
+    return stats
+
+
+def evict() -> None:
+    """
+    Remove least recently used entries until the cache fits in `cache.max_mb`.
+
+    The directory is only scanned once the running total of entry sizes exceeds the
+    limit; the scan also corrects the total for entries changed by other processes.
+    """
+    global _total_bytes
+    with _evict_lock:
+        if _total_bytes is not None and _total_bytes <= CACHE_MAX_BYTES:
+            return
+        stats = _scan()
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        _total_bytes = total
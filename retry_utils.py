@@ -1,38 +1,226 @@
+"""
+Retry policy for Telegram transfers: jittered exponential backoff, server-directed delays,
+error classification and a circuit breaker per endpoint.
+
+Only transient errors (network failures, timeouts, flood control, Telegram server errors)
+are retried; anything else, such as `BadRequest` for an invalid file ID, is raised on the
+first attempt. Pyrogram's errors are recognised too, for the MTProto transfers. After
+`retry.breaker_threshold` network failures in a row on one endpoint its breaker opens and
+calls fail fast with `CircuitOpenError` for `retry.breaker_reset_seconds`, after which a
+single trial call decides whether it closes again. Flood control is per chat, so it is
+waited out but never counted against the shared breaker.
+"""
 import asyncio
-import functools
+import datetime
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from httpx import TransportError
+from loguru import logger
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
 from config import load_config
+from metrics import RETRIES, RETRY_AFTER
 
 # 读取全局配置
 _config = load_config()
 _retry_conf = _config.get("retry", {})
 DEFAULT_RETRIES = _retry_conf.get("max_attempts", 3)
 BACKOFF_FACTOR = _retry_conf.get("backoff_factor", 1)
+MAX_BACKOFF = _retry_conf.get("max_backoff", 30)
+# Flood-control waits longer than this are not sat out; the error is raised instead.
+MAX_RETRY_AFTER = _retry_conf.get("max_retry_after", 120)
+BREAKER_THRESHOLD = _retry_conf.get("breaker_threshold", 5)
+BREAKER_RESET_SECONDS = _retry_conf.get("breaker_reset_seconds", 30)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit breaker is open.
+    """
+
+
+def _is_pyrogram_error(exc: BaseException, *names: str) -> bool:
+    """
+    True if `exc` is one of the named `pyrogram.errors` classes.
+
+    Pyrogram is only imported for errors it raised, as MTProto support is optional.
+    """
+    if not type(exc).__module__.startswith("pyrogram."):
+        return False
+    import pyrogram.errors
+    return isinstance(exc, tuple(getattr(pyrogram.errors, name) for name in names))
+
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    True if `exc` is worth retrying: network errors, timeouts, flood control and
+    Telegram server errors.
+    """
+    if isinstance(exc, (BadRequest, Forbidden)):
+        # Subclasses of NetworkError, but the request itself is wrong.
+        return False
+    if isinstance(exc, (RetryAfter, NetworkError, TransportError, ConnectionError, TimeoutError)):
+        return True
+    return _is_pyrogram_error(exc, "FloodWait", "InternalServerError", "ServiceUnavailable")
+
+
+def is_flood_control(exc: BaseException) -> bool:
+    """
+    True if `exc` is Telegram's flood control (`RetryAfter`, or Pyrogram's `FloodWait`).
+    """
+    return isinstance(exc, RetryAfter) or _is_pyrogram_error(exc, "FloodWait")
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """
+    The delay Telegram asked for, if `exc` is flood control.
+    """
+    if not is_flood_control(exc):
+        return None
+    # FloodWait carries the delay in seconds as `value`.
+    retry_after = exc.retry_after if isinstance(exc, RetryAfter) else exc.value
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive transient failures of one endpoint.
+
+    Once due, an open breaker lets a single trial call through; other callers keep failing
+    fast until that call has succeeded or failed.
+    """
+
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # A trial call of the half-open breaker is in flight.
+        self.probing = False
+
+    def before_call(self) -> bool:
+        """
+        :return: True if this call is the trial call of the half-open breaker.
+        :raises CircuitOpenError: If the breaker is open and not yet due for a trial call,
+                                  or another caller is making the trial call.
+        """
+        if self.opened_at is None:
+            return False
+        if self.probing:
+            raise CircuitOpenError(f"{self.name} is failing, waiting for a trial call")
+        remaining = self.opened_at + self.reset_seconds - time.monotonic()
+        if remaining > 0:
+            raise CircuitOpenError(f"{self.name} is failing, not retrying for {remaining:.0f}s")
+        # Half-open: this call is the trial; it closes or reopens the breaker.
+        self.probing = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.probing:
+            self.probing = False
+            self.opened_at = time.monotonic()
+            logger.warning(f"Circuit breaker for {self.name} reopened, the trial call failed")
+        elif self.failures >= self.threshold and self.opened_at is None:
+            self.opened_at = time.monotonic()
+            logger.warning(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+
+    def abandon_trial(self) -> None:
+        """
+        Give up a trial call that ended without an answer, e.g. cancelled; the next call is the trial.
+        """
+        self.probing = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    """
+    The circuit breaker shared by every call to `endpoint`.
+    """
+    if endpoint not in _breakers:
+        _breakers[endpoint] = CircuitBreaker(endpoint)
+    return _breakers[endpoint]
+
+
+class RetryPolicy:
+    """
+    How often and how long to retry calls to one endpoint.
+
+    :param endpoint: Name of the endpoint; used for the shared circuit breaker and metrics.
+    :param max_attempts: Attempts including the first one.
+    :param backoff_factor: Base delay in seconds; attempt n waits up to `backoff_factor * 2**(n-1)`.
+    :param max_backoff: Cap of the backoff delay in seconds.
+    """
+
+    def __init__(self, endpoint: str, max_attempts: int = DEFAULT_RETRIES,
+                 backoff_factor: float = BACKOFF_FACTOR, max_backoff: float = MAX_BACKOFF):
+        self.endpoint = endpoint
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.breaker = get_breaker(endpoint)
+
+    def delay(self, attempt: int, exc: BaseException) -> float:
+        """
+        Seconds to wait before retrying after failed attempt number `attempt`.
+        """
+        retry_after = retry_after_seconds(exc)
+        if retry_after is not None:
+            return retry_after
+        # Full jitter keeps concurrent retries from hitting the server in lockstep.
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** (attempt - 1)))
 
+    async def run(self, func: Callable[..., Awaitable], *args,
+                  on_retry: Optional[Callable[[int, float, BaseException], Awaitable]] = None, **kwargs):
+        """
+        Call `await func(*args, **kwargs)` under this policy.
 
-def retry_on_exception(exc_types, max_retries: int = None, backoff_factor: float = None):
-    """
-    异步函数重试装饰器，根据配置或指定参数进行重试和指数级回退。
-    :param exc_types: 要捕获并重试的异常类型元组
-    :param max_retries: 最大重试次数（默认为配置中的 DEFAULT_RETRIES）
-    :param backoff_factor: 回退基数（秒），每次重试间隔 = backoff_factor * attempt
-    """
-    def decorator(func):
-        @functools.wraps(func)
-        async def wrapper(*args, **kwargs):
-            retries = max_retries or DEFAULT_RETRIES
-            backoff = backoff_factor or BACKOFF_FACTOR
-            last_exc = None
-            for attempt in range(1, retries + 1):
-                try:
-                    return await func(*args, **kwargs)
-                except exc_types as e:
-                    last_exc = e
-                    if attempt < retries:
-                        delay = backoff * attempt
-                        # 可根据需要记录日志：logger.warning(...)
-                        await asyncio.sleep(delay)
-                        continue
-            # 最后一次重试仍然失败，抛出最后捕获到的异常
-            raise last_exc
-        return wrapper
-    return decorator
\ No newline at end of file
+        :param on_retry: Awaited as `on_retry(attempt, delay, exc)` before each retry.
+        :return: The result of `func`.
+        :raises CircuitOpenError: If the endpoint's circuit breaker is open.
+        :raises Exception: The error of the last attempt, or the first non-transient one.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            trial = self.breaker.before_call()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # The endpoint answered; the request itself was wrong.
+                    self.breaker.record_success()
+                    raise
+                if is_flood_control(e):
+                    # Flood control limits one chat or account, the endpoint itself is up.
+                    self.breaker.record_success()
+                    RETRY_AFTER.inc(operation=self.endpoint)
+                else:
+                    self.breaker.record_failure()
+                delay = self.delay(attempt, e)
+                if attempt == self.max_attempts or delay > MAX_RETRY_AFTER:
+                    raise
+                RETRIES.inc(operation=self.endpoint)
+                logger.warning(
+                    f"{self.endpoint} attempt {attempt}/{self.max_attempts} failed: {e!r}, retrying in {delay:.1f}s"
+                )
+                if on_retry is not None:
+                    await on_retry(attempt, delay, e)
+                await asyncio.sleep(delay)
+            except BaseException:
+                if trial:
+                    self.breaker.abandon_trial()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
@@ -0,0 +1,60 @@
+"""
+Run a command under resource limits and report its resource usage.
+
+Started by `converter.py` in front of every conversion script (POSIX only): the limits
+apply to the script and every renderer/encoder it starts, and the usage written to
+`--stats-fd` covers that whole process tree. The exit status of the command is passed through.
+
+Usage: python run_limited.py [--cpu-seconds N] [--memory-mb N] [--stats-fd FD] -- command [args...]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+
+
+def _apply_limits(cpu_seconds: int, memory_mb: int) -> None:
+    if cpu_seconds > 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cpu-seconds", type=int, default=0, help="RLIMIT_CPU per process, 0 = unlimited")
+    parser.add_argument("--memory-mb", type=int, default=0, help="RLIMIT_AS per process, 0 = unlimited")
+    parser.add_argument("--stats-fd", type=int, default=None, help="File descriptor to write JSON usage to")
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("missing command")
+
+    _apply_limits(args.cpu_seconds, args.memory_mb)
+    proc = subprocess.Popen(command)
+    _, status, usage = os.wait4(proc.pid, 0)
+
+    stats = {
+        "cpu_user_seconds": round(usage.ru_utime, 3),
+        "cpu_system_seconds": round(usage.ru_stime, 3),
+        "max_rss_kb": usage.ru_maxrss,
+    }
+    if os.WIFSIGNALED(status):
+        stats["signal"] = os.WTERMSIG(status)
+        returncode = 128 + os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+
+    if args.stats_fd is not None:
+        with os.fdopen(args.stats_fd, "w") as f:
+            json.dump(stats, f)
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
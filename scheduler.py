@@ -0,0 +1,207 @@
+"""
+Render cost estimation and scheduling of conversions.
+
+The render cost of a sticker is estimated in work units: output frames times output pixels
+(relative to 512×512), weighted for `.tgs` by the animation's layer and mask count read
+from its Lottie JSON. Units are turned into seconds by a factor per input type and output
+format that is learned from measured conversion times.
+
+Set jobs convert their stickers longest first, so no long sticker is left running alone
+at the end, and report the predicted time left. Across users, with `scheduler.status`
+enabled, conversions wait for one of `scheduler.max_parallel` slots; free slots go to the
+waiter whose job has the least predicted work left, so single stickers are not queued
+behind large sets. The wait counts against a waiter's cost, so large jobs still progress.
+"""
+import asyncio
+import contextlib
+import gzip
+import heapq
+import itertools
+import json
+import time
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+
+from config import load_config
+from converter import cpu_count, supersample_factor
+from decoders import get_decoder
+from jobs import current_job
+
+_config = load_config()
+_scheduler_conf = _config.get("scheduler", {})
+SCHEDULER_ENABLED = _scheduler_conf.get("status", False)
+MAX_PARALLEL = _scheduler_conf.get("max_parallel", 0) or cpu_count()
+# Weight of the newest measurement in the learned seconds per unit.
+LEARNING_RATE = _scheduler_conf.get("learning_rate", 0.2)
+
+# Starting guess of seconds per work unit (one 512×512 frame), until measurements come in.
+DEFAULT_SECONDS_PER_UNIT = 0.02
+# Video stickers are at most 3 seconds long; their exact length would need ffprobe.
+VIDEO_SECONDS = 3.0
+LAYER_WEIGHT = 0.05
+MASK_WEIGHT = 0.25
+
+# (input extension, output format) -> learned seconds per work unit
+_seconds_per_unit: Dict[Tuple[str, str], float] = {}
+
+
+def _count_lottie(layers: list) -> Tuple[int, int]:
+    """
+    Count layers and masks (including track mattes) of a Lottie layer list.
+    """
+    masks = 0
+    for layer in layers:
+        masks += len(layer.get("masksProperties") or ())
+        if layer.get("tt"):
+            masks += 1
+    return len(layers), masks
+
+
+def lottie_features(path: str, data: Optional[bytes] = None) -> Dict[str, float]:
+    """
+    Read what drives the render cost from a `.tgs` file.
+
+    :param path: `.tgs` file, used if `data` is not given.
+    :param data: Content of the `.tgs` file.
+    :return: Dict with `duration` (seconds, from `op - ip` and `fr`), `layers` and `masks`.
+    """
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    animation = json.loads(gzip.decompress(data))
+    frame_rate = animation.get("fr") or 60
+    layers, masks = _count_lottie(animation.get("layers", []))
+    for asset in animation.get("assets", []):
+        asset_layers, asset_masks = _count_lottie(asset.get("layers") or [])
+        layers += asset_layers
+        masks += asset_masks
+    return {
+        "duration": max(0.0, animation.get("op", 0) - animation.get("ip", 0)) / frame_rate,
+        "layers": layers,
+        "masks": masks,
+    }
+
+
+def estimate_units(path: str, width: int, height: int, fps: int, data: Optional[bytes] = None) -> float:
+    """
+    Estimate the work of converting a sticker at the given settings.
+
+    :param path: Sticker file (its name only, with `data`).
+    :param width: Output width.
+    :param height: Output height.
+    :param fps: Frame rate.
+    :param data: Content of the sticker file, if held in memory.
+    :return: Work units, roughly the number of 512×512 frames rendered.
+    """
+    decoder = get_decoder(path)
+    factor = supersample_factor(decoder, width, height)
+    pixels = width * height * factor * factor / (512 * 512)
+    if decoder.extension == "tgs":
+        try:
+            features = lottie_features(path, data)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Could not read Lottie metadata of {path}: {e}")
+            features = {"duration": VIDEO_SECONDS, "layers": 0, "masks": 0}
+        complexity = 1 + LAYER_WEIGHT * features["layers"] + MASK_WEIGHT * features["masks"]
+        return max(1.0, features["duration"] * fps) * pixels * complexity
+    if decoder.extension == "webm":
+        return VIDEO_SECONDS * fps * pixels
+    return pixels
+
+
+def predict_seconds(extension: str, chosen_format: str, units: float) -> float:
+    """
+    Predict the conversion time of `units` of work from the timings measured so far.
+    """
+    return units * _seconds_per_unit.get((extension, chosen_format), DEFAULT_SECONDS_PER_UNIT)
+
+
+def record_timing(extension: str, chosen_format: str, units: float, seconds: float) -> None:
+    """
+    Learn from the measured time of a conversion estimated at `units`.
+    """
+    if units <= 0:
+        return
+    key = (extension, chosen_format)
+    rate = _seconds_per_unit.get(key)
+    measured = seconds / units
+    _seconds_per_unit[key] = measured if rate is None else rate + LEARNING_RATE * (measured - rate)
+
+
+def eta_seconds(costs, workers: int) -> float:
+    """
+    Predicted time until conversions of the given costs finish on `workers` workers.
+    """
+    costs = list(costs)
+    if not costs:
+        return 0.0
+    return max(sum(costs) / max(1, min(workers, len(costs))), max(costs))
+
+
+def format_eta(seconds: float) -> str:
+    """
+    Format a predicted duration for progress messages, e.g. `~40s` or `~3 min`.
+    """
+    if seconds < 90:
+        return f"~{max(1, round(seconds))}s"
+    return f"~{round(seconds / 60)} min"
+
+
+class ConversionSlots:
+    """
+    At most `limit` conversions at once; waiters are served by lowest cost, where a waiter's
+    cost is the time it entered the queue plus its job's predicted remaining seconds.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, cost: float) -> None:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (time.monotonic() + cost, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        # Hand the slot to the next waiter still waiting, if any.
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+_slots = ConversionSlots(MAX_PARALLEL)
+
+
+@contextlib.asynccontextmanager
+async def conversion_slot(predicted: float):
+    """
+    Wait for a conversion slot (if `scheduler.status` is enabled) and hold it.
+
+    :param predicted: Predicted seconds of the conversion; the current job's remaining
+                      prediction is used instead if it is larger.
+    """
+    if not SCHEDULER_ENABLED:
+        yield
+        return
+    job = current_job()
+    cost = max(predicted, job.predicted_seconds if job is not None else 0.0)
+    await _slots.acquire(cost)
+    try:
+        yield
+    finally:
+        _slots.release()
@@ -0,0 +1,369 @@
+"""
+Per-user state: menu sessions and conversion presets.
+
+A menu session is the sticker, batch of stickers or sticker set a user is choosing
+conversion options for.
+The options chosen so far travel in the callback data of the menu buttons, so a session
+only holds what doesn't fit there (file IDs are longer than Telegram's 64-byte callback
+limit). Sessions expire after `sessions.ttl` seconds.
+
+Presets are the user's saved conversion settings plus the settings they used last, offered
+as one-tap buttons when a sticker arrives; they don't expire.
+
+The export history records which stickers of a set a user has already received at given
+settings, so a later export of the same set can be limited to the stickers added since.
+
+All three can be persisted to SQLite (`sessions.sqlite_path`) so they survive restarts.
+The in-memory state is authoritative while the bot runs: writes to SQLite are queued to a
+background thread so handlers never wait for the disk, and it is only read on a cache miss,
+by awaiting that thread, so other handlers keep running meanwhile.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from config import load_config
+from preset import Preset
+
+_config = load_config()
+_sessions_conf = _config.get("sessions", {})
+SESSION_TTL = _sessions_conf.get("ttl", 3600)
+SQLITE_PATH = _sessions_conf.get("sqlite_path", "")
+# Users whose presets are kept in memory when they are persisted to SQLite.
+PRESET_CACHE_SIZE = _sessions_conf.get("preset_cache_size", 1000)
+# (user, set, settings) export histories kept when they are not persisted to SQLite.
+MAX_EXPORT_ENTRIES = 10_000
+PURGE_INTERVAL = 300
+MAX_PRESETS = 3
+
+
+class Session:
+    """
+    What one user is converting. A sticker (or batch of stickers) and a sticker set can be
+    pending at the same time.
+    """
+
+    __slots__ = ("file_id", "file_unique_id", "set_name", "extension", "batch", "sticker_set_name", "expires_at")
+    FIELDS = ("file_id", "file_unique_id", "set_name", "extension", "batch", "sticker_set_name")
+
+    def __init__(self, file_id: Optional[str] = None, file_unique_id: Optional[str] = None,
+                 set_name: Optional[str] = None, extension: Optional[str] = None,
+                 batch: Optional[List[Dict[str, str]]] = None,
+                 sticker_set_name: Optional[str] = None, expires_at: float = 0.0):
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.set_name = set_name
+        self.extension = extension
+        # Stickers sent together: dicts with `file_id`, `file_unique_id`, `set_name` and `extension`.
+        self.batch = batch
+        self.sticker_set_name = sticker_set_name
+        self.expires_at = expires_at
+
+    def sticker_info(self) -> Optional[Dict[str, str]]:
+        """
+        The pending single sticker in the form `process_single_sticker` takes, if any.
+        """
+        if self.file_id is None:
+            return None
+        return {
+            "file_id": self.file_id,
+            "file_unique_id": self.file_unique_id,
+            "set_name": self.set_name,
+            "extension": self.extension,
+        }
+
+
+class Database:
+    """
+    A SQLite connection used from one background thread. Writes are queued and return at
+    once; queries are awaited and run after the writes queued before them, so they see
+    their own changes.
+    """
+
+    def __init__(self, sqlite_path: str):
+        directory = os.path.dirname(sqlite_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(sqlite_path, isolation_level=None, check_same_thread=False)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def _write(self, sql: str, rows: list) -> None:
+        try:
+            self._conn.executemany(sql, rows)
+        except sqlite3.Error as e:
+            logger.error(f"SQLite write failed: {e} ({sql})")
+
+    def execute(self, sql: str, params: tuple = ()) -> None:
+        """
+        Queue a write.
+        """
+        self._executor.submit(self._write, sql, [params])
+
+    def executemany(self, sql: str, rows: list) -> None:
+        """
+        Queue a write for each of `rows`.
+        """
+        self._executor.submit(self._write, sql, rows)
+
+    async def query(self, sql: str, params: tuple = ()) -> list:
+        """
+        Run a query after the queued writes and return all its rows.
+        """
+        return await asyncio.wrap_future(
+            self._executor.submit(lambda: self._conn.execute(sql, params).fetchall())
+        )
+
+
+class SessionStore:
+    """
+    Sessions by user ID, kept in memory and optionally written through to SQLite.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, sqlite_path: str = SQLITE_PATH):
+        self.ttl = ttl
+        self._sessions: Dict[int, Session] = {}
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+        self._db = None
+        if sqlite_path:
+            self._db = Database(sqlite_path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, file_id TEXT, "
+                "file_unique_id TEXT, set_name TEXT, extension TEXT, batch TEXT, sticker_set_name TEXT, "
+                "expires_at REAL)"
+            )
+
+    async def get(self, user_id: int) -> Optional[Session]:
+        """
+        Return the user's session if it hasn't expired.
+        """
+        session = self._sessions.get(user_id)
+        if session is None and self._db is not None:
+            rows = await self._db.query(
+                "SELECT file_id, file_unique_id, set_name, extension, batch, sticker_set_name, expires_at "
+                "FROM sessions WHERE user_id = ?", (user_id,)
+            )
+            if rows:
+                session = Session(*rows[0])
+                session.batch = json.loads(session.batch) if session.batch else None
+                self._sessions[user_id] = session
+        if session is None:
+            return None
+        if session.expires_at < time.time():
+            self.drop(user_id)
+            return None
+        return session
+
+    async def update(self, user_id: int, **fields) -> Session:
+        """
+        Set fields of the user's session (creating it) and restart its TTL.
+
+        :param user_id: Telegram user ID.
+        :param fields: `Session.FIELDS` to set.
+        :return: The updated session.
+        """
+        session = await self.get(user_id) or Session()
+        for name, value in fields.items():
+            setattr(session, name, value)
+        session.expires_at = time.time() + self.ttl
+        self._sessions[user_id] = session
+        if self._db is not None:
+            values = [getattr(session, name) for name in Session.FIELDS]
+            values[Session.FIELDS.index("batch")] = json.dumps(session.batch) if session.batch else None
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, *values, session.expires_at),
+            )
+        self._purge()
+        return session
+
+    def drop(self, user_id: int) -> None:
+        """
+        Forget the user's session.
+        """
+        self._sessions.pop(user_id, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def _purge(self) -> None:
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+        now = time.time()
+        for user_id in [uid for uid, s in self._sessions.items() if s.expires_at < now]:
+            del self._sessions[user_id]
+        if self._db is not None:
+            self._db.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+
+
+class PresetStore:
+    """
+    Saved presets (at most `MAX_PRESETS`) and last used settings by user ID.
+
+    With SQLite, the `cache_size` most recently used users are held in memory, including
+    those without presets, so a sticker from a known user doesn't hit the database.
+    Without it, only users who have presets are held.
+    """
+
+    def __init__(self, sqlite_path: str = SQLITE_PATH, cache_size: int = PRESET_CACHE_SIZE):
+        # user_id -> [last used or None, saved presets...], least recently used first
+        self._presets: "OrderedDict[int, List[Optional[Preset]]]" = OrderedDict()
+        self.cache_size = cache_size
+        self._db = None
+        if sqlite_path:
+            self._db = Database(sqlite_path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS presets (user_id INTEGER, slot INTEGER, format TEXT, "
+                "quality INTEGER, width INTEGER, height INTEGER, fps INTEGER, PRIMARY KEY (user_id, slot))"
+            )
+
+    async def _load(self, user_id: int) -> List[Optional[Preset]]:
+        entry = self._presets.get(user_id)
+        if entry is not None:
+            self._presets.move_to_end(user_id)
+            return entry
+        entry = [None]
+        if self._db is not None:
+            rows = await self._db.query(
+                "SELECT slot, format, quality, width, height, fps FROM presets WHERE user_id = ? ORDER BY slot",
+                (user_id,),
+            )
+            for slot, *values in rows:
+                if slot == 0:
+                    entry[0] = Preset(*values)
+                else:
+                    entry.append(Preset(*values))
+            self._remember(user_id, entry)
+        return entry
+
+    def _remember(self, user_id: int, entry: List[Optional[Preset]]) -> None:
+        self._presets[user_id] = entry
+        self._presets.move_to_end(user_id)
+        # Without SQLite, memory is the only copy.
+        if self._db is not None:
+            while len(self._presets) > self.cache_size:
+                self._presets.popitem(last=False)
+
+    def _save(self, user_id: int, entry: List[Optional[Preset]]) -> None:
+        self._remember(user_id, entry)
+        if self._db is None:
+            return
+        self._db.execute("DELETE FROM presets WHERE user_id = ?", (user_id,))
+        self._db.executemany(
+            "INSERT INTO presets VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(user_id, slot, *preset.as_tuple()) for slot, preset in enumerate(entry) if preset is not None],
+        )
+
+    async def last(self, user_id: int) -> Optional[Preset]:
+        """
+        Settings of the user's last conversion, if any.
+        """
+        return (await self._load(user_id))[0]
+
+    async def set_last(self, user_id: int, preset: Preset) -> None:
+        entry = await self._load(user_id)
+        if entry[0] == preset:
+            return
+        entry[0] = preset
+        self._save(user_id, entry)
+
+    async def saved(self, user_id: int) -> List[Preset]:
+        """
+        The user's saved presets, oldest first.
+        """
+        return (await self._load(user_id))[1:]
+
+    async def save(self, user_id: int, preset: Preset) -> bool:
+        """
+        Save a preset, replacing the oldest one when `MAX_PRESETS` are saved.
+
+        :return: False if the preset was already saved.
+        """
+        entry = await self._load(user_id)
+        if preset in entry[1:]:
+            return False
+        entry.append(preset)
+        if len(entry) > MAX_PRESETS + 1:
+            del entry[1]
+        self._save(user_id, entry)
+        return True
+
+    async def delete(self, user_id: int, index: int) -> bool:
+        """
+        Delete the saved preset at `index` (as listed by `saved`).
+
+        :return: False if there is no such preset.
+        """
+        entry = await self._load(user_id)
+        if not 0 <= index < len(entry) - 1:
+            return False
+        del entry[index + 1]
+        self._save(user_id, entry)
+        return True
+
+
+class ExportHistory:
+    """
+    `file_unique_id`s of the stickers each user has received per sticker set and settings.
+
+    With SQLite it is read from there when a set is exported (rarely enough to not need a
+    cache); otherwise only the `max_entries` most recently used (user, set, settings) are kept.
+    """
+
+    def __init__(self, sqlite_path: str = SQLITE_PATH, max_entries: int = MAX_EXPORT_ENTRIES):
+        # (user_id, set_name, settings) -> file_unique_ids, least recently used first
+        self._exports: "OrderedDict[Tuple[int, str, str], Set[str]]" = OrderedDict()
+        self.max_entries = max_entries
+        self._db = None
+        if sqlite_path:
+            self._db = Database(sqlite_path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS exports (user_id INTEGER, set_name TEXT, settings TEXT, "
+                "file_unique_id TEXT, PRIMARY KEY (user_id, set_name, settings, file_unique_id))"
+            )
+
+    async def exported(self, user_id: int, set_name: str, preset: Preset) -> Set[str]:
+        """
+        The stickers of `set_name` the user already received converted with `preset`.
+        """
+        key = (user_id, set_name, preset.callback_data("set"))
+        if self._db is not None:
+            rows = await self._db.query(
+                "SELECT file_unique_id FROM exports WHERE user_id = ? AND set_name = ? AND settings = ?",
+                key,
+            )
+            return {row[0] for row in rows}
+        entry = self._exports.get(key)
+        if entry is None:
+            return set()
+        self._exports.move_to_end(key)
+        return set(entry)
+
+    def add(self, user_id: int, set_name: str, preset: Preset, file_unique_ids: List[str]) -> None:
+        """
+        Record stickers of `set_name` as delivered to the user converted with `preset`.
+        """
+        if not file_unique_ids:
+            return
+        key = (user_id, set_name, preset.callback_data("set"))
+        if self._db is not None:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO exports VALUES (?, ?, ?, ?)",
+                [(*key, uid) for uid in file_unique_ids],
+            )
+            return
+        self._exports.setdefault(key, set()).update(file_unique_ids)
+        self._exports.move_to_end(key)
+        while len(self._exports) > self.max_entries:
+            self._exports.popitem(last=False)
+
+
+sessions = SessionStore()
+presets = PresetStore()
+export_history = ExportHistory()
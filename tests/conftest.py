@@ -0,0 +1,15 @@
+"""
+Test setup: import the bot's modules from the repository root with the example configuration,
+so the tests run without a `config.json` or a bot token.
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+
+with open(os.path.join(ROOT, "config.json.example"), "r", encoding="utf-8") as f:
+    config._configs[config.CONFIG_PATH] = config.Config(config.CONFIG_PATH, json.load(f), 0.0)
@@ -0,0 +1,143 @@
+"""
+The MTProto transfer backend, with `pyrogram` replaced by a stub client.
+"""
+import asyncio
+import io
+import sys
+import types
+
+import pytest
+
+import mtproto
+import utils
+
+
+class FakeClient:
+    """
+    Stands in for `pyrogram.Client`, recording what the bot asks of it.
+    """
+
+    instances = []
+
+    def __init__(self, name, **kwargs):
+        self.name = name
+        self.kwargs = kwargs
+        self.started = False
+        self.sent = []
+        self.fail_send = None
+        FakeClient.instances.append(self)
+
+    async def start(self):
+        self.started = True
+
+    async def stop(self):
+        self.started = False
+
+    async def send_document(self, **kwargs):
+        if self.fail_send is not None:
+            raise self.fail_send
+        self.sent.append(kwargs)
+
+    async def download_media(self, file_id, file_name=None, in_memory=False):
+        if in_memory:
+            return io.BytesIO(f"content of {file_id}".encode())
+        with open(file_name, "wb") as f:
+            f.write(b"content")
+        return file_name
+
+
+class FakeMessage:
+    """
+    A Bot API message the bot replies to.
+    """
+
+    chat_id = 7
+    message_id = 42
+
+    def __init__(self):
+        self.texts = []
+        self.documents = []
+
+    async def reply_text(self, text, **kwargs):
+        self.texts.append(text)
+
+    async def reply_document(self, document, caption=None, **kwargs):
+        self.documents.append(caption)
+
+
+@pytest.fixture
+def pyrogram_stub(monkeypatch):
+    pyrogram = types.ModuleType("pyrogram")
+    pyrogram.Client = FakeClient
+    enums = types.ModuleType("pyrogram.enums")
+    enums.ParseMode = types.SimpleNamespace(MARKDOWN="markdown")
+    pyrogram.enums = enums
+    monkeypatch.setitem(sys.modules, "pyrogram", pyrogram)
+    monkeypatch.setitem(sys.modules, "pyrogram.enums", enums)
+    monkeypatch.setattr(mtproto, "_client", None)
+    monkeypatch.setattr(mtproto, "_client_lock", asyncio.Lock())
+    FakeClient.instances = []
+    yield
+    FakeClient.instances = []
+
+
+def test_client_is_started_once_and_closed(pyrogram_stub):
+    async def run():
+        first = await mtproto.get_client()
+        second = await mtproto.get_client()
+        await mtproto.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert FakeClient.instances == [first]
+    assert first.kwargs["no_updates"] is True
+    assert not first.started
+    assert mtproto._client is None
+
+
+def test_upload_document_replies_with_pyrogram_markdown(pyrogram_stub):
+    message = FakeMessage()
+    asyncio.run(mtproto.upload_document(message, "set.zip", "✅ *Done!*\n• set\\_name"))
+
+    sent = FakeClient.instances[0].sent
+    assert sent == [{
+        "chat_id": 7,
+        "document": "set.zip",
+        "caption": "✅ **Done!**\n• set_name",
+        "parse_mode": "markdown",
+        "reply_to_message_id": 42,
+        "force_document": True,
+    }]
+
+
+def test_download_bytes(pyrogram_stub):
+    assert asyncio.run(mtproto.download_bytes("file-1")) == b"content of file-1"
+
+
+def test_large_zip_is_sent_over_mtproto_in_one_piece(pyrogram_stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(mtproto, "MTPROTO_ENABLED", True)
+    zip_path = tmp_path / "set.zip"
+    zip_path.write_bytes(b"x" * 1000)
+    message = FakeMessage()
+
+    delivered = asyncio.run(utils.split_and_upload_document(message, "caption", str(zip_path), chunk_size=300))
+
+    assert delivered
+    assert [sent["document"] for sent in FakeClient.instances[0].sent] == [str(zip_path)]
+    assert message.documents == []
+
+
+def test_failed_mtproto_upload_falls_back_to_parts(pyrogram_stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(mtproto, "MTPROTO_ENABLED", True)
+    zip_path = tmp_path / "set.zip"
+    zip_path.write_bytes(b"x" * 1000)
+    message = FakeMessage()
+
+    async def run():
+        client = await mtproto.get_client()
+        client.fail_send = ConnectionError("MTProto down")
+        return await utils.split_and_upload_document(message, "caption", str(zip_path), chunk_size=300)
+
+    assert asyncio.run(run())
+    assert sorted(message.documents) == [f"caption\n(Part {index} of 4)" for index in range(1, 5)]
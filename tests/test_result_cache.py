@@ -0,0 +1,59 @@
+"""
+Storing and evicting converted stickers in the result cache.
+"""
+import os
+
+import pytest
+
+import result_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / "cache"
+    monkeypatch.setattr(result_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(result_cache, "CACHE_PATH", str(path))
+    monkeypatch.setattr(result_cache, "CACHE_MAX_BYTES", 250)
+    monkeypatch.setattr(result_cache, "_total_bytes", None)
+    return path
+
+
+def converted(tmp_path, name: str, size: int) -> str:
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def count_scans(monkeypatch) -> list:
+    scans = []
+    scan = result_cache._scan
+
+    def counting_scan():
+        scans.append(1)
+        return scan()
+
+    monkeypatch.setattr(result_cache, "_scan", counting_scan)
+    return scans
+
+
+def test_store_keeps_a_running_total(cache_dir, tmp_path, monkeypatch):
+    scans = count_scans(monkeypatch)
+    result_cache.store("a.gif", converted(tmp_path, "a.gif", 100))
+    result_cache.store("b.gif", converted(tmp_path, "b.gif", 100))
+    # Replacing an entry counts its new size only.
+    result_cache.store("b.gif", converted(tmp_path, "b2.gif", 50))
+
+    assert result_cache._total_bytes == 150
+    # Counted once on the first store; below the limit nothing is rescanned.
+    assert len(scans) == 1
+    assert result_cache.lookup("a.gif") is not None
+
+
+def test_store_evicts_least_recently_used(cache_dir, tmp_path):
+    for index, name in enumerate(("a.gif", "b.gif", "c.gif")):
+        result_cache.store(name, converted(tmp_path, name, 100))
+        os.utime(cache_dir / name, (index, index))
+    result_cache.store("d.gif", converted(tmp_path, "d.gif", 100))
+
+    assert sorted(os.listdir(cache_dir)) == ["c.gif", "d.gif"]
+    assert result_cache._total_bytes == 200
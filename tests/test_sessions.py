@@ -0,0 +1,133 @@
+"""
+Presets and export history persisted to SQLite.
+"""
+import asyncio
+import time
+
+from preset import Preset
+from sessions import Database, ExportHistory, PresetStore
+
+GIF = Preset("gif", 90, 512, 512, 60)
+PNG = Preset("png", 100, 128, 128, 30)
+
+
+def flush(store) -> None:
+    # Wait for the store's queued writes, as a restart would.
+    store._db._executor.submit(lambda: None).result()
+
+
+def count_queries(monkeypatch) -> list:
+    queries = []
+    query = Database.query
+
+    async def counting_query(self, sql, params=()):
+        queries.append(sql)
+        return await query(self, sql, params)
+
+    monkeypatch.setattr(Database, "query", counting_query)
+    return queries
+
+
+def test_presets_survive_a_restart(tmp_path):
+    path = str(tmp_path / "bot.db")
+
+    async def run():
+        store = PresetStore(path)
+        await store.save(1, GIF)
+        await store.set_last(1, PNG)
+        flush(store)
+        restarted = PresetStore(path)
+        return await restarted.last(1), await restarted.saved(1)
+
+    last, saved = asyncio.run(run())
+    assert last == PNG
+    assert saved == [GIF]
+
+
+def test_users_without_presets_are_queried_once(tmp_path, monkeypatch):
+    queries = count_queries(monkeypatch)
+    store = PresetStore(str(tmp_path / "bot.db"), cache_size=10)
+
+    async def run():
+        for _ in range(3):
+            assert await store.last(1) is None
+            assert await store.saved(1) == []
+
+    asyncio.run(run())
+    assert len(queries) == 1
+
+
+def test_preset_cache_is_bounded(tmp_path):
+    store = PresetStore(str(tmp_path / "bot.db"), cache_size=10)
+
+    async def run():
+        for user_id in range(100):
+            await store.last(user_id)
+        await store.save(5, GIF)
+        flush(store)
+        return await PresetStore(str(tmp_path / "bot.db")).saved(5)
+
+    assert asyncio.run(run()) == [GIF]
+    assert len(store._presets) == 10
+
+
+class SlowConnection:
+    """
+    A SQLite connection whose statements take a while, like on a busy disk.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        time.sleep(0.2)
+        return self.conn.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        return self.conn.executemany(sql, rows)
+
+
+def test_export_history_persists(tmp_path):
+    path = str(tmp_path / "bot.db")
+    history = ExportHistory(path)
+    history.add(1, "set", GIF, ["a", "b"])
+    flush(history)
+
+    async def run():
+        restarted = ExportHistory(path)
+        return await restarted.exported(1, "set", GIF), await restarted.exported(1, "set", PNG)
+
+    assert asyncio.run(run()) == ({"a", "b"}, set())
+
+
+def test_export_history_reads_do_not_block_the_event_loop(tmp_path):
+    history = ExportHistory(str(tmp_path / "bot.db"))
+    history.add(1, "set", GIF, ["a"])
+    history._db._conn = SlowConnection(history._db._conn)
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        ticker = asyncio.create_task(tick())
+        exported = await history.exported(1, "set", GIF)
+        ticker.cancel()
+        return exported
+
+    assert asyncio.run(run()) == {"a"}
+    # The loop kept running other tasks while the query was on the SQLite thread.
+    assert len(ticks) >= 5
+
+
+def test_export_history_without_sqlite_is_bounded():
+    history = ExportHistory("", max_entries=2)
+
+    async def run():
+        for set_name in ("a", "b", "c"):
+            history.add(1, set_name, GIF, [set_name])
+        return [await history.exported(1, set_name, GIF) for set_name in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == [set(), {"b"}, {"c"}]
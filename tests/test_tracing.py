@@ -0,0 +1,32 @@
+"""
+Trace records written for jobs.
+"""
+import asyncio
+import json
+
+import tracing
+
+
+def test_job_started_inside_a_span_gets_its_own_trace(tmp_path, monkeypatch):
+    trace_path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", True)
+    monkeypatch.setattr(tracing, "TRACE_PATH", str(trace_path))
+
+    @tracing.traced_job("sticker_set")
+    async def job():
+        with tracing.span("convert"):
+            pass
+
+    async def run():
+        with tracing.span("prewarm") as outer:
+            await job()
+        return outer
+
+    outer = asyncio.run(run())
+    records = [json.loads(line) for line in trace_path.read_text().splitlines()]
+
+    assert [record["name"] for record in records] == ["job", "prewarm"]
+    assert records[0]["attrs"] == {"kind": "sticker_set"}
+    assert [child["name"] for child in records[0]["children"]] == ["convert"]
+    assert records[0]["trace_id"] != outer.trace_id
+    assert outer.children == []
@@ -0,0 +1,44 @@
+"""
+Uploading a ZIP split into parts over the Bot API.
+"""
+import asyncio
+
+import httpx
+
+import utils
+
+
+class PartRecorder:
+    """
+    A message the parts are sent as replies to; encodes each part as the HTTP client would.
+    """
+
+    def __init__(self):
+        self.parts = {}
+        self.contents = []
+
+    async def reply_text(self, text, **kwargs):
+        pass
+
+    async def reply_document(self, document, caption=None, **kwargs):
+        self.contents.append(document.input_file_content)
+        request = httpx.Request("POST", "https://api.telegram.org/bot/sendDocument",
+                                files={"document": document.field_tuple})
+        self.parts[document.filename] = request.read()
+
+
+def test_parts_are_streamed_from_the_mapping(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.mtproto, "MTPROTO_ENABLED", False)
+    zip_path = tmp_path / "set.zip"
+    zip_path.write_bytes(b"a" * 300 + b"b" * 300 + b"c" * 100)
+    message = PartRecorder()
+
+    assert asyncio.run(utils.split_and_upload_document(message, "caption", str(zip_path), chunk_size=300))
+
+    # The parts reach the HTTP client unread instead of as bytes copied from the mapping.
+    assert all(isinstance(content, utils.FilePart) for content in message.contents)
+    assert sorted(message.parts) == ["set.zip.part01", "set.zip.part02", "set.zip.part03"]
+    for name, content in (("set.zip.part01", b"a" * 300), ("set.zip.part02", b"b" * 300),
+                          ("set.zip.part03", b"c" * 100)):
+        assert content in message.parts[name]
+        assert b"a" * 301 not in message.parts[name]
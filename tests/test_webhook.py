@@ -0,0 +1,118 @@
+"""
+The webhook server, run against a local fake Bot API server.
+"""
+import asyncio
+import http.server
+import json
+import socket
+import threading
+
+import httpx
+import pytest
+from telegram.ext import Application, MessageHandler, filters
+
+from main import webhook_options
+
+SECRET = "test-secret"
+
+
+class FakeBotApi(http.server.ThreadingHTTPServer):
+    """
+    Answers every Bot API method with success and records the calls.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeBotApiHandler)
+        self.calls = []
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/bot"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class FakeBotApiHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        method = self.path.rsplit("/", 1)[-1]
+        self.server.calls.append((method, body.decode()))
+        result = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot"} if method == "getMe" else True
+        data = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": 7, "type": "private"},
+            "from": {"id": 7, "is_bot": False, "first_name": "User"},
+            "text": "hello",
+        },
+    }
+
+
+def test_webhook_requires_secret_token():
+    with pytest.raises(ValueError):
+        webhook_options({"url": "https://example.com/webhook", "secret_token": ""})
+
+
+def test_webhook_delivers_updates_with_the_secret_token():
+    fake_api = FakeBotApi()
+    port = free_port()
+    options = webhook_options({
+        "url": "https://example.com/webhook",
+        "port": port,
+        "url_path": "/hook/",
+        "secret_token": SECRET,
+    })
+    received = []
+
+    async def on_text(update, context):
+        received.append(update.update_id)
+
+    async def run():
+        application = Application.builder().token("123:abc").base_url(fake_api.url).build()
+        application.add_handler(MessageHandler(filters.TEXT, on_text))
+        async with application:
+            await application.updater.start_webhook(**options)
+            await application.start()
+            try:
+                async with httpx.AsyncClient() as client:
+                    url = f"http://127.0.0.1:{port}/hook"
+                    rejected = await client.post(url, json=update(1))
+                    wrong = await client.post(url, json=update(2),
+                                              headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+                    accepted = await client.post(url, json=update(3),
+                                                 headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+                for _ in range(50):
+                    if received:
+                        break
+                    await asyncio.sleep(0.05)
+            finally:
+                await application.updater.stop()
+                await application.stop()
+        return rejected.status_code, wrong.status_code, accepted.status_code
+
+    try:
+        statuses = asyncio.run(run())
+    finally:
+        fake_api.shutdown()
+        fake_api.server_close()
+
+    assert statuses == (403, 403, 200)
+    assert received == [3]
+    set_webhook = [body for method, body in fake_api.calls if method == "setWebhook"]
+    assert set_webhook and SECRET in set_webhook[0]
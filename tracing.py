@@ -0,0 +1,154 @@
+"""
+Per-job span tracing (job → sticker → stage) written to a local JSONL trace file.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from config import load_config
+
+_config = load_config()
+_tracing_conf = _config.get("tracing", {})
+TRACING_ENABLED = _tracing_conf.get("status", False)
+TRACE_PATH = _tracing_conf.get("path", "traces.jsonl")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_write_lock = threading.Lock()
+
+
+class Span:
+    """
+    A timed unit of work with attributes and child spans.
+
+    A span opened without entering it (see `Span.group`) only groups other spans,
+    its start and end are taken from its children when the trace is written.
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, grouping: bool = False, **attrs):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attrs: Dict[str, Any] = dict(attrs)
+        self.children: List["Span"] = []
+        self.grouping = grouping
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.start = time.time()
+        self.end: Optional[float] = None
+        if parent is not None:
+            parent.children.append(self)
+
+    def set(self, **attrs) -> None:
+        """
+        Attach or overwrite attributes on this span.
+        """
+        self.attrs.update(attrs)
+
+    def fail(self, exc: BaseException) -> None:
+        """
+        Mark this span as failed (or cancelled) because of `exc`.
+        """
+        self.status = "cancelled" if isinstance(exc, asyncio.CancelledError) else "error"
+        self.error = f"{exc.__class__.__name__}: {exc}"
+
+    def group(self, name: str, **attrs) -> "Span":
+        """
+        Create a grouping child span, e.g. one per sticker with a span per stage below it.
+        """
+        return Span(name, parent=self, grouping=True, **attrs)
+
+    def _bounds(self):
+        if self.grouping and self.children:
+            bounds = [child._bounds() for child in self.children]
+            return min(b[0] for b in bounds), max(b[1] for b in bounds)
+        return self.start, self.end if self.end is not None else time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        start, end = self._bounds()
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "start": round(start, 6),
+            "duration": round(end - start, 6),
+            "status": self.status,
+            "error": self.error,
+            "attrs": self.attrs,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+def current_span() -> Optional[Span]:
+    """
+    Return the span active in the current task/thread context, if any.
+    """
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, root: bool = False, **attrs):
+    """
+    Open a span as child of `parent` (default: the current span) and make it current.
+
+    A span without any parent is a trace root; it is appended to the trace file when it ends.
+
+    :param name: Span name, e.g. "job", "download", "convert".
+    :param parent: Explicit parent span, for stages that run outside the parent's context.
+    :param root: Start a new trace even if a span is current.
+    :param attrs: Attributes recorded on the span.
+    """
+    if root:
+        parent = None
+    elif parent is None:
+        parent = _current_span.get()
+    s = Span(name, parent=parent, **attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.fail(e)
+        raise
+    finally:
+        s.end = time.time()
+        _current_span.reset(token)
+        if parent is None:
+            _write_trace(s)
+
+
+def _write_trace(root: Span) -> None:
+    if not TRACING_ENABLED:
+        return
+    record = {"trace_id": root.trace_id, **root.to_dict()}
+    try:
+        directory = os.path.dirname(TRACE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with _write_lock, open(TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        logger.error(f"Could not write trace {root.trace_id}: {e}")
+
+
+def traced_job(kind: str):
+    """
+    Decorator running an async job function inside a root "job" span.
+
+    :param kind: Job kind recorded on the span (e.g. "sticker_set").
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span("job", root=True, kind=kind):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -2,12 +2,131 @@
 Utility functions for file uploads and ZIP management.
 """
 import asyncio
-import io
+import mmap
 import os
+import shutil
 import traceback
+from pathlib import Path
 
 from loguru import logger
-from telegram.error import RetryAfter, TimedOut
+from telegram import InputFile
+
+import mtproto
+from config import load_config
+from metrics import UPLOAD_BYTES, UPLOAD_SECONDS
+from retry_utils import DEFAULT_RETRIES, CircuitOpenError, RetryPolicy, is_transient
+
+_config = load_config()
+_local_api_conf = _config.get("local_bot_api", {})
+# Talking to a self-hosted Bot API server started with --local, which shares our file system.
+LOCAL_MODE = _local_api_conf.get("status", False)
+# A local server accepts uploads up to 2000 MB instead of 50 MB.
+LOCAL_MAX_UPLOAD_BYTES = _local_api_conf.get("max_upload_mb", 2000) * 1_000_000
+# Parts of a split ZIP uploaded at the same time.
+PART_UPLOAD_WORKERS = _config.get("upload", {}).get("part_workers", 3)
+# Passes over the parts that still failed after their own retries.
+PART_UPLOAD_ROUNDS = 2
+
+
+class FilePart:
+    """
+    A slice of a memory-mapped file that uploads like a file object. The upload reads it
+    in chunks, so only the chunk being sent is copied out of the mapping.
+    """
+
+    def __init__(self, mapped: mmap.mmap, start: int, end: int, name: str):
+        self._view = memoryview(mapped)[start:end]
+        self._position = 0
+        self.name = name
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._position + size
+        chunk = self._view[self._position:end].tobytes()
+        self._position += len(chunk)
+        return chunk
+
+    def getbuffer(self) -> memoryview:
+        return self._view
+
+    def release(self) -> None:
+        self._view.release()
+
+
+def notify_retry(feedback_msg, action: str):
+    """
+    Build an `on_retry` callback for `RetryPolicy.run` that tells the user about the retry.
+
+    :param feedback_msg: Telegram message object to reply to.
+    :param action: What is being retried, e.g. "Upload".
+    """
+    async def on_retry(attempt: int, delay: float, exc: BaseException) -> None:
+        await feedback_msg.reply_text(
+            f"⚠️ {action} error: {exc.__class__.__name__}. Retrying in {delay:.0f}s (attempt {attempt})…"
+        )
+    return on_retry
+
+
+def link_local_file(source: str, path: str) -> str:
+    """
+    Make a file from the local Bot API server's storage available at `path` without
+    copying it: hardlink it, or copy it if the two are on different file systems.
+
+    :param source: Absolute path reported by the server as `file_path`.
+    :param path: Destination path.
+    :return: The destination path.
+    """
+    try:
+        _link_or_copy(source, path)
+    except FileExistsError:
+        os.remove(path)
+        _link_or_copy(source, path)
+    return path
+
+
+def _link_or_copy(source: str, path: str) -> None:
+    # FileExistsError is left to the caller; other link failures (EXDEV across file
+    # systems, EPERM on file systems without hardlinks) fall back to a copy.
+    try:
+        os.link(source, path)
+    except FileExistsError:
+        raise
+    except OSError:
+        shutil.copyfile(source, path)
+
+
+async def _send_document(feedback_msg, file_obj, caption: str, parse_mode) -> None:
+    with UPLOAD_SECONDS.time():
+        if isinstance(file_obj, str) and LOCAL_MODE:
+            # The local server reads the file itself (passed as a file:// URI).
+            await feedback_msg.reply_document(
+                document=Path(file_obj).absolute(), caption=caption, parse_mode=parse_mode
+            )
+            UPLOAD_BYTES.inc(os.path.getsize(file_obj))
+        elif isinstance(file_obj, str):
+            # file_obj is a disk path
+            with open(file_obj, "rb") as f:
+                await feedback_msg.reply_document(document=f, caption=caption, parse_mode=parse_mode)
+            UPLOAD_BYTES.inc(os.path.getsize(file_obj))
+        else:
+            # file_obj is file-like (BytesIO, FilePart)
+            file_obj.seek(0)
+            document = file_obj
+            if isinstance(file_obj, FilePart):
+                # Handed to the HTTP client unread, which streams it instead of reading it whole.
+                document = InputFile(file_obj, filename=file_obj.name, read_file_handle=False)
+            await feedback_msg.reply_document(document=document, caption=caption, parse_mode=parse_mode)
+            UPLOAD_BYTES.inc(file_obj.getbuffer().nbytes)
 
 
 async def retry_upload_document(
@@ -15,40 +134,37 @@ async def retry_upload_document(
     file_obj,
     caption: str,
     parse_mode=None,
-    max_retries: int = 5
-) -> None:
+    max_retries: int = DEFAULT_RETRIES
+) -> bool:
     """
-    Attempt to send a document (file path or BytesIO) with retry logic.
+    Attempt to send a document (file path, BytesIO or FilePart), retrying transient errors
+    under the upload retry policy.
 
     :param feedback_msg: Telegram message object to reply to.
     :param file_obj: Either a file path (str) or a file-like object (e.g., BytesIO).
     :param caption: Caption text for the document.
     :param parse_mode: Parse mode for the caption (e.g., Markdown).
-    :param max_retries: Maximum number of upload attempts.
+    :param max_retries: Maximum number of upload attempts (default `retry.max_attempts`).
+    :return: True if the document was sent, False if it still failed transiently.
+    :raises Exception: Non-transient upload errors, after telling the user.
     """
-    for attempt in range(1, max_retries + 1):
-        try:
-            if isinstance(file_obj, str):
-                # file_obj is a disk path
-                with open(file_obj, "rb") as f:
-                    await feedback_msg.reply_document(document=f, caption=caption, parse_mode=parse_mode)
-            else:
-                # file_obj is file-like (BytesIO)
-                file_obj.seek(0)
-                await feedback_msg.reply_document(document=file_obj, caption=caption, parse_mode=parse_mode)
-            return  # successful upload
-        except (RetryAfter, TimedOut) as e:
-            logger.warning(f"Upload attempt {attempt} failed: {e}\n {traceback.format_exc()}")
-            wait_secs = getattr(e, "retry_after", 5)
-            await feedback_msg.reply_text(
-                f"⚠️ Upload error: {e.__class__.__name__}. Retrying in {wait_secs}s (attempt {attempt}/{max_retries})…"
-            )
-            await asyncio.sleep(wait_secs)
-        except Exception as e:
-            await feedback_msg.reply_text(f"❌ Unexpected upload exception: `{e}`")
-            raise
-
-    await feedback_msg.reply_text(f"❌ Failed to upload after {max_retries} attempts.")
+    policy = RetryPolicy("upload", max_attempts=max_retries)
+    try:
+        await policy.run(
+            _send_document, feedback_msg, file_obj, caption, parse_mode,
+            on_retry=notify_retry(feedback_msg, "Upload"),
+        )
+        return True
+    except CircuitOpenError as e:
+        await feedback_msg.reply_text(f"❌ Upload failed: {e}")
+        return False
+    except Exception as e:
+        if is_transient(e):
+            logger.warning(f"Upload failed: {e}\n {traceback.format_exc()}")
+            await feedback_msg.reply_text(f"❌ Failed to upload after {max_retries} attempts.")
+            return False
+        await feedback_msg.reply_text(f"❌ Unexpected upload exception: `{e}`")
+        raise
 
 
 async def split_and_upload_document(
@@ -56,56 +172,82 @@ async def split_and_upload_document(
     caption: str,
     zip_path: str,
     chunk_size: int = 50_000_000
-) -> None:
+) -> bool:
     """
     Split a large ZIP into smaller parts and upload each.
 
+    With the MTProto backend enabled, a ZIP too large for one Bot API upload is sent
+    over MTProto as a single file instead, if it fits `mtproto.max_file_mb`.
+
     :param feedback_msg: Telegram message object to reply to.
     :param caption: Base caption for each part.
     :param zip_path: Path to the ZIP file.
-    :param chunk_size: Maximum size (bytes) per part.
+    :param chunk_size: Maximum size (bytes) per part; raised to `local_bot_api.max_upload_mb`
+                       in local mode.
+    :return: True if the whole ZIP was delivered; the user has been told otherwise.
     """
+    if LOCAL_MODE:
+        chunk_size = max(chunk_size, LOCAL_MAX_UPLOAD_BYTES)
     try:
         total_size = os.path.getsize(zip_path)
     except OSError as e:
         await feedback_msg.reply_text(f"❌ Could not stat '{zip_path}': {e}")
-        return
+        return False
 
     # If small enough, upload directly
     if total_size <= chunk_size:
-        await retry_upload_document(feedback_msg, zip_path, caption, parse_mode="Markdown")
-        return
+        return await retry_upload_document(feedback_msg, zip_path, caption, parse_mode="Markdown")
+
+    if mtproto.MTPROTO_ENABLED and total_size <= mtproto.MAX_FILE_BYTES:
+        try:
+            with UPLOAD_SECONDS.time():
+                await mtproto.upload_document(feedback_msg, zip_path, caption)
+            UPLOAD_BYTES.inc(total_size)
+            return True
+        except Exception as e:
+            logger.exception(f"MTProto upload of {zip_path} failed, splitting it instead: {e!r}")
 
     num_parts = (total_size + chunk_size - 1) // chunk_size
     await feedback_msg.reply_text(
-        f"📦 Splitting large ZIP ({total_size // (1024*1024)} MB) into {num_parts} parts…"
+        f"📦 Splitting large ZIP ({total_size // (1024*1024)} MB) into {num_parts} parts…"
     )
 
     base_name = os.path.basename(zip_path)
-    windows_combine = ''
-    linux_combine = ''
-    macos_combine = ''
-
-    with open(zip_path, "rb") as f:
-        part_index = 1
-        while True:
-            chunk_data = f.read(chunk_size)
-            if not chunk_data:
+    part_names = [f"{base_name}.part{index:02d}" for index in range(1, num_parts + 1)]
+    windows_combine = f"```bash\ncopy /b {' + '.join(part_names)} + "
+    linux_combine = f"```bash\ncat {' '.join(part_names)} "
+    macos_combine = linux_combine
+
+    # Parts are uploaded concurrently straight from a read-only mapping of the ZIP. A part
+    # that fails all its retries is tried again after the others instead of stopping them.
+    sem = asyncio.Semaphore(PART_UPLOAD_WORKERS)
+
+    async def upload_part(index: int) -> bool:
+        async with sem:
+            part = FilePart(mapped, index * chunk_size, min(total_size, (index + 1) * chunk_size), part_names[index])
+            try:
+                return await retry_upload_document(
+                    feedback_msg, part, f"{caption}\n(Part {index + 1} of {num_parts})", parse_mode="Markdown"
+                )
+            finally:
+                part.release()
+
+    with open(zip_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        pending = list(range(num_parts))
+        for _ in range(PART_UPLOAD_ROUNDS):
+            # Let every upload finish before raising, the mapping can't close while parts use it.
+            results = await asyncio.gather(*(upload_part(index) for index in pending), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            pending = [index for index, sent in zip(pending, results) if not sent]
+            if not pending:
                 break
 
-            bio = io.BytesIO(chunk_data)
-            bio.name = f"{base_name}.part{part_index:02d}"
-            part_caption = f"{caption}\n(Part {part_index} of {num_parts})"
-            if part_index == 1:
-                windows_combine = f"```bash\ncopy /b {bio.name} + "
-                linux_combine = f"```bash\ncat {bio.name} "
-                macos_combine = f"```bash\ncat {bio.name} "
-            else:
-                windows_combine += f"{bio.name} + "
-                linux_combine += f"{bio.name} "
-                macos_combine += f"{bio.name} "
-            await retry_upload_document(feedback_msg, bio, part_caption, parse_mode="Markdown")
-            part_index += 1
+    if pending:
+        missing = ", ".join(part_names[index] for index in pending)
+        await feedback_msg.reply_text(f"❌ Could not upload {missing}. Please try again later.")
+        return False
 
     # Finalize combine commands
     windows_combine = windows_combine[:-3] + f" {base_name}.zip```"
@@ -121,4 +263,5 @@ async def split_and_upload_document(
                                   "🍎 **macOS**\n"
                                   f"{macos_combine}\n\n"
                                   "**Make sure to run the command in the same directory where the parts are saved.**", parse_mode="Markdown")
+    return True
 